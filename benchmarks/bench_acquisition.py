@@ -0,0 +1,183 @@
+"""
+Benchmark the sustained sample rate that the spectrometer functions in
+`src/spectrum.py` can channelise, using frames from the simulated SDR in
+`src/sim_sdr.py`.
+
+For each combination of channeliser (`fft`/`pfb`), `nChannels`, `nTaps`,
+window and sample dtype, a chunk of frames is read from the simulator and
+passed repeatedly through `spectrum.buffer_to_psd_fft` or
+`spectrum.buffer_to_psd_pfb`. The processing rate in MS/s is compared with
+the configured `bandwidth` (the complex sample rate): a headroom below 1
+means the channeliser cannot keep up with the SDR on this machine.
+
+Example:
+    python3 benchmarks/bench_acquisition.py --yaml obs_config.yaml \\
+        --json bench_acquisition.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import numpy as np
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+import spectrum
+import sim_sdr
+from sim_sdr import SOAPY_SDR_RX, SOAPY_SDR_CF32
+
+
+def make_window(spectrometerMode, appliedWindow, nChannels, nTaps, 
+                precision='single'):
+    """
+    Window coefficients as built by `sdr_control.measure_spectra`, in the 
+    given precision. Names
+    are matched case-insensitively, since the `fft` and `pfb` modes use
+    `spectrum.window_dict` and `scipy.signal.get_window` names respectively.
+    """
+    if spectrometerMode == 'fft':
+        names = {name.lower(): name for name in spectrum.window_dict}
+        appliedWindow = names[appliedWindow.lower()]
+    else:
+        appliedWindow = appliedWindow.lower()
+    return spectrum.get_window_coeffs(spectrometerMode, appliedWindow, 
+                                      nChannels, nTaps, 
+                                      spectrum.precision_dict[precision])
+
+
+def read_frames(n_frames, n_spec_points, bandwidth, seed=0):
+    """
+    Read `n_frames` frames of `n_spec_points` samples from the simulated SDR,
+    as fast as they can be generated.
+    """
+    sdr = sim_sdr.SimDevice(realtime=False, tones=[[bandwidth / 5, 1e-2]],
+                            mtu=max(n_spec_points, 65536), seed=seed)
+    sdr.setSampleRate(SOAPY_SDR_RX, 0, bandwidth)
+    rxStream = sdr.setupStream(SOAPY_SDR_RX, SOAPY_SDR_CF32, [0])
+    sdr.activateStream(rxStream)
+    frame_set = np.zeros((n_frames, n_spec_points), dtype=np.complex64)
+    for i in range(n_frames):
+        sdr.readStream(rxStream, [frame_set[i]], n_spec_points)
+    sdr.closeStream(rxStream)
+    return frame_set
+
+
+def bench_config(spectrometerMode, nChannels, nTaps, appliedWindow, dtype,
+                 bandwidth, chunkFrames, min_time=1., precision='single'):
+    if spectrometerMode == 'fft':
+        nTaps = None
+        n_spec_points = nChannels
+        spectrometer_func = spectrum.buffer_to_psd_fft
+    else:
+        n_spec_points = nChannels * nTaps
+        spectrometer_func = spectrum.buffer_to_psd_pfb
+    win_coeffs = make_window(spectrometerMode, appliedWindow, nChannels, nTaps,
+                             precision)
+    frame_set = read_frames(chunkFrames, n_spec_points,
+                            bandwidth).astype(dtype)
+
+    spectrometer_func(frame_set, win_coeffs, nChannels, nTaps) # warm up
+    n_calls = 0
+    t0 = time.perf_counter()
+    while True:
+        spectrometer_func(frame_set, win_coeffs, nChannels, nTaps)
+        n_calls += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+
+    msps = n_calls * frame_set.size / elapsed / 1e6
+    return {'spectrometerMode': spectrometerMode,
+            'nChannels': nChannels,
+            'nTaps': nTaps,
+            'appliedWindow': appliedWindow,
+            'dtype': np.dtype(dtype).name,
+            'precision': precision,
+            'chunkFrames': chunkFrames,
+            'MSps': msps,
+            'headroom': msps / (bandwidth / 1e6),
+            'cpu_fraction': (bandwidth / 1e6) / msps}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Channeliser throughput '
+                                                 'benchmark')
+    parser.add_argument('--yaml', type=str, default=None,
+                        help='Config .yaml to take the default bandwidth, '
+                             'channelisation and FFT backend from')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='Sample rate to compare against, in Hz')
+    parser.add_argument('--modes', type=str, nargs='+', default=None,
+                        help='Channelisers to test, fft and/or pfb')
+    parser.add_argument('--n-channels', type=int, nargs='+', default=None)
+    parser.add_argument('--n-taps', type=int, nargs='+', default=None)
+    parser.add_argument('--windows', type=str, nargs='+', default=None,
+                        help='Window names, as in spectrum.window_dict')
+    parser.add_argument('--dtypes', type=str, nargs='+',
+                        default=['complex64', 'complex128'])
+    parser.add_argument('--precisions', type=str, nargs='+',
+                        default=['single', 'double'],
+                        help='Window precisions, see spectrum.set_precision')
+    parser.add_argument('--chunk-frames', type=int, default=None,
+                        help='Frames channelised per call')
+    parser.add_argument('--fft-backend', type=str, default=None)
+    parser.add_argument('--fft-workers', type=int, default=None)
+    parser.add_argument('--min-time', type=float, default=1.,
+                        help='Minimum time to run each configuration, in s')
+    parser.add_argument('--json', type=str, default=None,
+                        help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    sdr_config = {}
+    if args.yaml is not None:
+        with open(args.yaml, 'r') as f:
+            sdr_config = yaml.safe_load(f)['sdr']
+    mode = sdr_config.get('spectrometerMode', 'pfb')
+    mode_params = sdr_config.get(f'{mode}Params', {})
+    bandwidth = args.bandwidth or sdr_config.get('bandwidth', 10e6)
+    modes = args.modes or ['fft', 'pfb']
+    n_channels = args.n_channels or [sdr_config.get('nChannels', 4096)]
+    n_taps = args.n_taps or [sdr_config.get('pfbParams', {}).get('nTaps', 4)]
+    windows = args.windows or [mode_params.get('appliedWindow', 'Blackman')]
+    chunkFrames = args.chunk_frames or sdr_config.get('chunkFrames', 64)
+    fftBackend = args.fft_backend or sdr_config.get('fftBackend', 'numpy')
+    fftWorkers = args.fft_workers if args.fft_workers is not None \
+                 else sdr_config.get('fftWorkers', None)
+    spectrum.set_fft_backend(fftBackend, fftWorkers)
+
+    results = []
+    for spectrometerMode, nChannels, nTaps, appliedWindow, dtype, precision in \
+            itertools.product(modes, n_channels, n_taps, windows,
+                              args.dtypes, args.precisions):
+        if spectrometerMode == 'fft' and nTaps != n_taps[0]:
+            continue # taps only apply to the PFB
+        result = bench_config(spectrometerMode, nChannels, nTaps,
+                              appliedWindow, dtype, bandwidth, chunkFrames,
+                              args.min_time, precision)
+        results.append(result)
+        print(f"{spectrometerMode:>4} nChannels={nChannels:<6} "
+              f"nTaps={str(result['nTaps']):<4} {appliedWindow:<14} "
+              f"{result['dtype']:<10} {precision:<6}: "
+              f"{result['MSps']:7.2f} MS/s, "
+              f"headroom x{result['headroom']:.2f}")
+
+    if args.json is not None:
+        meta = {'bandwidth': bandwidth,
+                'fftBackend': fftBackend,
+                'fftWorkers': fftWorkers,
+                'machine': platform.machine(),
+                'processor': platform.processor(),
+                'cpu_count': os.cpu_count(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'time': time.time()}
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark the HDF5 storage profiles in `src/storage.py` on a recorded (or
+synthetic) SDR waterfall.
+
+For each profile this reports the write throughput, the file size, and the
+read speed for `read_obs.ObsObj`-style access: loading the whole waterfall,
+reading individual spectra (time slices) and reading a single channel's
+time series (channel slices).
+
+Example:
+    python3 benchmarks/bench_storage.py --input data/2025-01-01_00-00-00_obs.hdf5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+import h5py
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+import storage
+
+
+def synthetic_waterfall(n_times, n_channels, n_avg=7000, seed=0):
+    """
+    Radiometer-noise waterfall on a smooth bandpass, with `n_avg` spectra
+    averaged per time sample.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-1, 1, n_channels)
+    bandpass = 1e-7 * (1 - 0.8 * x**2)
+    noise = 1 + rng.standard_normal((n_times, n_channels)) / np.sqrt(n_avg)
+    return bandpass[np.newaxis, :] * noise
+
+
+def bench_profile(waterfall, storageProfile, directory, n_reads=50, seed=0):
+    rng = np.random.default_rng(seed)
+    path = os.path.join(directory, f'{storageProfile}.hdf5')
+
+    t0 = time.perf_counter()
+    with h5py.File(path, 'w') as f:
+        storage.create_dataset(f.create_group('sdr'), 'sdr_waterfall',
+                               waterfall, storageProfile)
+    t_write = time.perf_counter() - t0
+    size = os.path.getsize(path)
+
+    with h5py.File(path, 'r') as f:
+        ds = f['sdr']['sdr_waterfall']
+        chunks = ds.chunks
+
+        t0 = time.perf_counter()
+        np.mean(ds[()], axis=0)
+        t_full = time.perf_counter() - t0
+
+        rows = rng.integers(0, ds.shape[0], n_reads)
+        t0 = time.perf_counter()
+        for i in rows:
+            ds[i]
+        t_row = (time.perf_counter() - t0) / n_reads
+
+        cols = rng.integers(0, ds.shape[1], max(n_reads // 10, 1))
+        t0 = time.perf_counter()
+        for j in cols:
+            ds[:, j]
+        t_col = (time.perf_counter() - t0) / len(cols)
+
+    os.remove(path)
+    return {'profile': storageProfile,
+            'chunks': chunks,
+            'file_size_MB': size / 1e6,
+            'compression_ratio': waterfall.nbytes / size,
+            'write_MBps': waterfall.nbytes / 1e6 / t_write,
+            'full_read_s': t_full,
+            'time_slice_ms': t_row * 1e3,
+            'channel_slice_ms': t_col * 1e3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HDF5 storage profile '
+                                                 'benchmark')
+    parser.add_argument('--input', type=str, default=None,
+                        help='Recorded observation .hdf5 file to read '
+                             'sdr/sdr_waterfall from (synthetic if omitted)')
+    parser.add_argument('--n-times', type=int, default=7200,
+                        help='Time samples in the synthetic waterfall')
+    parser.add_argument('--n-channels', type=int, default=4069,
+                        help='Channels in the synthetic waterfall')
+    parser.add_argument('--profiles', type=str, nargs='+',
+                        default=['none', 'lzf', 'gzip-1', 'gzip-4',
+                                 'blosc-zstd-5'],
+                        help='Storage profiles to compare')
+    parser.add_argument('--tmpdir', type=str, default=None,
+                        help='Directory to write the test files in, e.g. '
+                             'on the USB stick')
+    parser.add_argument('--json', type=str, default=None,
+                        help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.input is not None:
+        with h5py.File(args.input, 'r') as f:
+            waterfall = f['sdr']['sdr_waterfall'][()]
+    else:
+        waterfall = synthetic_waterfall(args.n_times, args.n_channels)
+    print(f'Waterfall {waterfall.shape} {waterfall.dtype}, '
+          f'{waterfall.nbytes / 1e6:.1f} MB')
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as directory:
+        for storageProfile in args.profiles:
+            try:
+                result = bench_profile(waterfall, storageProfile, directory)
+            except ImportError as e:
+                print(f'{storageProfile}: skipped ({e})')
+                continue
+            results.append(result)
+            print(f"{storageProfile:>14}: "
+                  f"{result['file_size_MB']:8.1f} MB "
+                  f"(x{result['compression_ratio']:.2f}), "
+                  f"write {result['write_MBps']:7.1f} MB/s, "
+                  f"full read {result['full_read_s']:6.2f} s, "
+                  f"spectrum {result['time_slice_ms']:7.2f} ms, "
+                  f"channel {result['channel_slice_ms']:7.2f} ms")
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Check that single precision channelisation (`spectrum.set_precision`) is
+accurate enough, by comparing it with double precision on synthetic noise.
+
+For each channeliser, an integration of complex64 noise frames is
+channelised in both precisions (the double precision reference also has its
+samples upcast to complex128). The largest relative difference between the
+two PSDs must stay well below the radiometer noise, `1/sqrt(n_spectra)`, of
+the integration: `--max-fraction` of it (default 0.1). The script exits with
+status 1 if it does not.
+
+It also shows why the running PSD sum should stay in double precision for
+long integrations: the same chunk's PSD is summed up to `--n-chunks` times
+with single and double precision accumulators.
+
+Example:
+    python3 benchmarks/check_precision.py --n-channels 4096
+"""
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+import spectrum
+
+
+def synthetic_frames(n_frames, n_spec_points, seed=0):
+    """
+    Complex64 noise with a sloped spectrum and a CW tone, as from an SDR.
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal((n_frames, n_spec_points, 2),
+                                dtype=np.float32).view(np.complex64)[..., 0]
+    # Sloped bandpass: a short FIR along the (flattened) time axis
+    samples = noise.ravel()
+    samples[1:] += np.complex64(0.5) * samples[:-1]
+    t = np.arange(samples.size)
+    samples += (1e-2 * np.exp(2j * np.pi * 0.1234 * t)).astype(np.complex64)
+    return samples.reshape(n_frames, n_spec_points) * np.float32(0.05)
+
+
+def integrate(spectrometerMode, frame_set, nChannels, nTaps, precision):
+    spectrum.set_precision(precision)
+    win_coeffs = spectrum.get_window_coeffs(spectrometerMode, 'Blackman'
+                                            if spectrometerMode == 'fft'
+                                            else 'blackman', nChannels, nTaps)
+    if precision == 'double':
+        frame_set = frame_set.astype(np.complex128)
+    accumulator = spectrum.PSDAccumulator(spectrometerMode, win_coeffs, nTaps,
+                                          nChannels=nChannels)
+    accumulator.add_chunk(frame_set)
+    return accumulator.finalize(), accumulator.n_spectra
+
+
+def check_channeliser(spectrometerMode, nChannels, nTaps, n_frames,
+                      max_fraction):
+    n_spec_points = nChannels if spectrometerMode == 'fft' \
+                    else nChannels * nTaps
+    frame_set = synthetic_frames(n_frames, n_spec_points)
+    psd_single, n_spectra = integrate(spectrometerMode, frame_set, nChannels,
+                                      nTaps, 'single')
+    psd_double, _ = integrate(spectrometerMode, frame_set, nChannels, nTaps,
+                              'double')
+    max_difference = np.max(np.abs(psd_single / psd_double - 1))
+    radiometer = 1 / np.sqrt(n_spectra)
+    ok = max_difference < max_fraction * radiometer
+    print(f'{spectrometerMode:>4}: {n_spectra} spectra, max relative '
+          f'difference {max_difference:.2e}, radiometer noise '
+          f'{radiometer:.2e} ({max_difference / radiometer:.1e} of it) '
+          f'{"OK" if ok else "FAIL"}')
+    return ok
+
+
+def check_accumulator(nChannels, n_chunks):
+    """
+    Relative error of summing one chunk's PSD `n_chunks` times.
+    """
+    frame_set = synthetic_frames(64, nChannels)
+    spectrum.set_precision('single')
+    win_coeffs = spectrum.get_window_coeffs('fft', 'Blackman', nChannels)
+    psd, _ = spectrum.fft_power_sum(frame_set, win_coeffs, nChannels)
+    psd = psd.astype(np.float32)
+    for dtype in (np.float32, np.float64):
+        total = np.zeros(nChannels, dtype=dtype)
+        for _ in range(n_chunks):
+            total += psd.astype(dtype)
+        exact = psd.astype(np.float64) * n_chunks
+        error = np.max(np.abs(total / exact - 1))
+        print(f'{np.dtype(dtype).name} accumulator, {n_chunks} chunks: '
+              f'max relative error {error:.2e}, radiometer noise '
+              f'{1 / np.sqrt(64 * n_chunks):.2e}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Single vs double precision '
+                                                 'channelisation check')
+    parser.add_argument('--n-channels', type=int, default=4096)
+    parser.add_argument('--n-taps', type=int, default=4)
+    parser.add_argument('--n-frames', type=int, default=4096,
+                        help='Frames in the integration')
+    parser.add_argument('--n-chunks', type=int, default=100000,
+                        help='Chunks summed in the accumulator check')
+    parser.add_argument('--max-fraction', type=float, default=0.1,
+                        help='Largest allowed difference, as a fraction of '
+                             'the radiometer noise')
+    args = parser.parse_args()
+
+    ok = True
+    for spectrometerMode in ('fft', 'pfb'):
+        ok &= check_channeliser(spectrometerMode, args.n_channels,
+                                args.n_taps, args.n_frames, args.max_fraction)
+    check_accumulator(args.n_channels, args.n_chunks)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,27 @@ import sys, time
 import serial
 import nanovna
 from scipy.signal import windows
+from functools import lru_cache
+from src.fft_backend import get_fft_backend
+
+window_dict = {'Blackman':np.blackman,
+               'BlackmanHarris':windows.blackmanharris,
+               'Rectangular':np.ones,
+               'Cosine':windows.cosine}
+
+@lru_cache(maxsize=16)
+def cached_window(window_string, fft_length):
+    """
+    Window coefficients, computed once per window and length. Read-only, as 
+    the array is shared between observers.
+    """
+    window = window_dict[window_string](fft_length)
+    window.flags.writeable = False
+    return window
 
 class SDRObserver:
-    def __init__(self, sample_rate=8e6, centre_frequency=70e6, integration_time=5, fft_length=2048, window='Blackman', gain=36):
+    def __init__(self, sample_rate=8e6, centre_frequency=70e6, integration_time=5, fft_length=2048, window='Blackman', gain=36,
+                 fft_backend='numpy', fft_workers=None):
         self.sample_rate = sample_rate
         self.centre_frequency = centre_frequency
         self.integration_time = integration_time
@@ -20,18 +38,15 @@ class SDRObserver:
         self.window = np.ones(shape=(fft_length,))
         self.set_window(window)
         self.gain = gain
+        self.fft = get_fft_backend(fft_backend, fft_workers)
         self.freq_channels_mhz =  np.linspace(-sample_rate/2/1e6 + centre_frequency/1e6, 
                                               sample_rate/2/1e6 + centre_frequency/1e6,
                                               fft_length)
         pass
 
     def set_window(self, window_string='Blackman'):
-        window_dict = {'Blackman':np.blackman,
-                       'BlackmanHarris':windows.blackmanharris,
-                       'Rectangular':np.ones,
-                       'Cosine':windows.cosine}
         try:
-            self.window = window_dict[window_string](self.fft_length)
+            self.window = cached_window(window_string, self.fft_length)
         except:
             pass
     
@@ -105,8 +120,7 @@ class SDRObserver:
         #sdr.deactivateStream(rxStream) #stop streaming
 
         # Save output
-        spectra = [np.abs(np.fft.fft(d*self.window))**2 for d in buffs] # goes through the buffer and ffts and sqaures
-        spectra = np.array(spectra)
+        spectra = np.abs(self.fft(np.array(buffs)*self.window, axis=1))**2 # ffts the whole buffer set and sqaures
         spectra = np.mean(spectra, axis=0) # average along time-axis
         spectra = np.fft.fftshift(spectra)
         return spectra
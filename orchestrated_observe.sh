@@ -0,0 +1,11 @@
+#!/bin/bash
+# orchestrated_observe.sh
+# Single-process alternative to observe.sh, see src/orchestrator.py
+
+sudo date -s "$(wget --method=HEAD -qSO- --max-redirect=0 google.com 2>&1 | sed -n 's/^ *Date: *//p')"
+
+echo "Launching RHINO Observing Program"
+
+yaml_path="${1:-/rhino-daq/obs_config.yaml}" # Default to /rhino-daq/obs_config.yaml if no argument is provided
+
+python3 src/orchestrator.py --yaml $yaml_path --prerun --duration 126000
@@ -71,19 +71,15 @@ print(data[:,0].size)
 print("-"*40)
 """
 
-# Loop over unique times
-for i, t in enumerate(t_unique):
-    # Get entries with this unique time
-    idxs = np.where(d_time == t)[0]
-
-    # Get each row of data
-    for k in idxs:
-        j = np.argmin(np.abs(freqs - numin[k]))
-        print( j, numin[k], freqs[j] )
-        #print(data[:,k])
-        nsamp = freq_samples[(numin[k], numax[k])] # no. of freq. samples
-        print("nsamp =", nsamp)
-        wfall[i,j:j+nsamp] = data[:nsamp,k]
+# Place every row at once: the time index of each row, and the start index 
+# of its frequency range (the first match in freqs, as ranges share edges)
+t_index = np.unique(d_time, return_inverse=True)[1]
+j = np.searchsorted(freqs, numin)
+n_row = np.round((numax - numin) / freq_delta).astype(int) + 2 # as freq_samples
+cols = np.arange(data.shape[0])
+valid = cols[np.newaxis,:] < n_row[:,np.newaxis]
+rows = np.broadcast_to(t_index[:,np.newaxis], valid.shape)
+wfall[rows[valid], (j[:,np.newaxis] + cols)[valid]] = data.T[valid]
 
 # Plot waterfall
 plt.matshow(wfall, extent=[freqs[0]/1e6, freqs[-1]/1e6, 0, 1], aspect='auto')
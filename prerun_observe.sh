@@ -5,6 +5,10 @@ echo "Launching RHINO ReRun Observation..."
 
 yaml_path="${1:-/rhino-daq/obs_config.yaml}"
 
+# Tune the SDR gains on the live stream first (if sdr: gainSearch is active); 
+# the prerun below and the following blocks use the gains found
+python3 src/sdr_control.py --yaml $yaml_path --gain-search
+
 # Launch both SDR scripts in parallel and arduino script
 python3 src/sdr_control.py --yaml $yaml_path --prerun &
 PID1=$!
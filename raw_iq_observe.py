@@ -3,10 +3,13 @@ Script for getting raw IQ samples from the receiver.
 """
 
 import numpy as np
-import SoapySDR
-from SoapySDR import * #SOAPY_SDR_ constants
+try:
+    from SoapySDR import * #SOAPY_SDR_ constants
+except ImportError: # no bindings; only the simulated SDR (`sim`) is usable
+    from src.sim_sdr import *
 import time
 from src.arduino_funcs import Arduino
+from src.sdr_session import SDRSession
 import argparse
 import yaml
 
@@ -19,58 +22,28 @@ def initialise_sdr_and_sample(nsamps,
                               sdrRFGR,
                               sdrIFGR,
                               delay=10,
+                              simParams=None,
+                              session=None,
                               ):
     print('nsamp', nsamps)
-    rx_chan = 0 # only 1 channel on RSP1A
-    sdr = SoapySDR.Device(dict(driver=sdrDriver, label=sdrLabel))
-    sdr.setSampleRate(SOAPY_SDR_RX, rx_chan, bandwidth)
-    sdr.setFrequency(SOAPY_SDR_RX, rx_chan, centre_frequency)
-    sdr.setBandwidth(SOAPY_SDR_RX, rx_chan, int(bandwidth)) # intialises the SDR with settings
-
-    print("SDR:","hardware info", sdr.getHardwareInfo())
-
-    sdr.setGainMode(SOAPY_SDR_RX, rx_chan, False) # turn ON AGC
-
-    
-    sdr.setGain(SOAPY_SDR_RX, rx_chan, "RFGR", sdrRFGR) # set RF gain
-    sdr.setGain(SOAPY_SDR_RX, rx_chan, "IFGR", sdrIFGR) # set IF gain
-
-    print("Current RF Gain:", sdr.getGain(SOAPY_SDR_RX, rx_chan, "RFGR"))
-    print("Current IF Gain:", sdr.getGain(SOAPY_SDR_RX, rx_chan, "IFGR"))
-
-    rxStream = sdr.setupStream(SOAPY_SDR_RX, SOAPY_SDR_CF32, [rx_chan])
-
-    print("hardware info", sdr.getHardwareInfo())
-
-    status = sdr.activateStream(rxStream) #start streaming
-    print("Stream MTU:", sdr.getStreamMTU(rxStream))
-    print("Activate status:", status)
-    print("Current gain:", sdr.getGain(SOAPY_SDR_RX, rx_chan))
-    print("Current Gain Mode, AGC:", sdr.getGainMode(SOAPY_SDR_RX, rx_chan)) # check if AGC is on
-    print("")
-
-    sdr.writeSetting("rfnotch_ctrl", "true") # set notches
-    sdr.writeSetting("dabnotch_ctrl", "true")
-    #sdr.writeSetting("biasT_ctrl", "false")
-
-    sdr.writeSetting(SOAPY_SDR_RX, rx_chan, "rfnotch_ctrl", "true")
-    sdr.writeSetting(SOAPY_SDR_RX, rx_chan, "dabnotch_ctrl", "true")
-
-    # Enable RF notch filters
-
-    sdr.writeSetting(SOAPY_SDR_RX, rx_chan,"fmmnotch_ctrl", "true")  # FM broadcast notch
-
+    # Reuse the open session if given, applying only the changed settings
+    own_session = session is None
+    if own_session:
+        session = SDRSession(sdrDriver, sdrLabel, simParams)
+    session.configure(bandwidth, centre_frequency,
+                      sdrRFGR=sdrRFGR, sdrIFGR=sdrIFGR)
+    sdr, rxStream = session.sdr, session.rxStream
+
+    print("Current RF Gain:", sdr.getGain(SOAPY_SDR_RX, session.rx_chan, "RFGR"))
+    print("Current IF Gain:", sdr.getGain(SOAPY_SDR_RX, session.rx_chan, "IFGR"))
     print("RF gain idx:", sdr.readSetting("rfgain_sel"))
 
-    #final_gain = 0 # FIXME
-    sdr.deactivateStream(rxStream) #stop streaming
-
-    if sdr.getStreamMTU(rxStream) < nStream:
-        nStream = sdr.getStreamMTU(rxStream)
+    if session.mtu < nStream:
+        nStream = session.mtu
 
     time.sleep(delay)
 
-    sdr.activateStream(rxStream)
+    session.start()
 
     buff = np.zeros((nStream,), np.complex64)
 
@@ -97,8 +70,9 @@ def initialise_sdr_and_sample(nsamps,
 
     iq_buffs = np.array(buffs)
     
-    sdr.deactivateStream(rxStream) #stop streaming
-    sdr.closeStream(rxStream)
+    session.stop() #stop streaming
+    if own_session:
+        session.close()
 
     return iq_buffs
 
@@ -133,12 +107,16 @@ def main():
             obs_config = yaml.safe_load(f) # load the .yaml as a list to get settings
             pass
 
-    arduino_object = Arduino(n__temp_sens=obs_config['arduino']['temperatureMonitoring']['nProbes'],
-                             com_port=obs_config['arduino']['comPort'],
-                             baud_rate=obs_config['arduino']['baudRate'],
-                             switch_dictionary=obs_config['arduino']['switchDictionary'])
-    
-    arduino_object.set_switch_state(args.target)
+    simParams = dict(obs_config['sdr'].get('simParams') or {})
+    if obs_config['sdr']['sdrDriver'] == 'sim':
+        simParams['state'] = args.target # no switches to set
+    else:
+        arduino_object = Arduino(n__temp_sens=obs_config['arduino']['temperatureMonitoring']['nProbes'],
+                                 com_port=obs_config['arduino']['comPort'],
+                                 baud_rate=obs_config['arduino']['baudRate'],
+                                 switch_dictionary=obs_config['arduino']['switchDictionary'])
+        
+        arduino_object.set_switch_state(args.target)
     print('Target Set')
 
 
@@ -150,7 +128,8 @@ def main():
                                         centre_frequency=obs_config['sdr']['centreFrequency'],
                                         sdrIFGR=obs_config['sdr']['sdrIFGR'],
                                         sdrRFGR=obs_config['sdr']['sdrRFGR'],
-                                        delay=args.sdr_delay)
+                                        delay=args.sdr_delay,
+                                        simParams=simParams)
     
     np.savez(file=f'{args.savedir}/{args.target}.npz',
              iq_samples=samples,
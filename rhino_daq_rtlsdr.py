@@ -5,6 +5,7 @@ import time
 import h5py
 import nanovna
 from rtlsdr import *
+from src.fft_backend import get_fft_backend
 
 
 # establish observing stratergy
@@ -84,13 +85,15 @@ class Thermomotry:
 
 class RtlSdrLogger:
     def __init__(self, averaging_time_seconds, sample_rate, 
-                 centre_frequency, fft_length, sdr_gain_set, window_function, averaging=True):
+                 centre_frequency, fft_length, sdr_gain_set, window_function, averaging=True,
+                 fft_backend='numpy', fft_workers=None):
         self.averaging = averaging
         self.sample_rate = sample_rate
         self.centre_frequency = centre_frequency
         self.fft_length = fft_length
         self.sdr_gain_set = sdr_gain_set
         self.averaging_time_seconds = averaging_time_seconds
+        self.fft = get_fft_backend(fft_backend, fft_workers)
 
         if window_function == 'Blackman':
             self.fft_filter = np.blackman(self.fft_length)
@@ -110,7 +113,7 @@ class RtlSdrLogger:
         spectra = []
         for i in np.arange(self.num_rows_to_average):
             x = self.sdr.read_samples(self.fft_length) * self.fft_filter
-            spectra.append(np.abs(np.fft.fft(x))**2)
+            spectra.append(np.abs(self.fft(x))**2)
         spectra = np.array(spectra)
         spectra = np.mean(spectra, axis=0)
         if return_std:
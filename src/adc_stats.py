@@ -0,0 +1,226 @@
+"""
+ADC health statistics of each integration, accumulated chunk-by-chunk
+alongside the PSD, so gain settings can be checked from the observation
+data without capturing raw IQ samples.
+
+The statistics come from reductions that only read the samples, with no
+chunk-sized temporaries: per frame, the power `sum(|x|**2)` (a BLAS dot
+product of the real view with itself, also used to reject frames, see
+`spectrum.reject_frames()`), the sums of `x` and of `x**2` (BLAS products
+of the complex frames), and the largest and smallest I/Q values (giving
+the peak magnitude), plus the amplitude histogram of every
+`HISTOGRAM_STRIDE`-th frame. The chunk is reduced a block of frames
+(`BLOCK_BYTES`) at a time, with every reduction run on a block while it is
+in cache, so the chunk is streamed from memory once. The I and Q RMS, DC
+offsets and the I/Q gain and phase imbalance follow from the sums.
+Magnitudes are only taken of the frames whose peak reaches the clip level
+(to count the clipped values) and of the one or two frames searched for
+the largest `|I|` and `|Q|`.
+"""
+import threading
+import numpy as np
+
+
+# Statistics returned by `ADCStats.finalize()`, one value (or histogram) per
+# integration
+STAT_KEYS = ('adc_rms_i', 'adc_rms_q', 'adc_dc_i', 'adc_dc_q',
+             'adc_iq_gain', 'adc_iq_phase', 'adc_clip_fraction',
+             'adc_histogram')
+
+# ADC magnitude counted as clipped, relative to the full scale of 1
+CLIP_LEVEL = 0.99
+
+# Bins of the amplitude histogram, one per bit below the full scale
+HISTOGRAM_BINS = 16
+
+# Every HISTOGRAM_STRIDE-th frame is binned into the histogram
+HISTOGRAM_STRIDE = 8
+
+# Size of the blocks of frames reduced together, small enough (about half 
+# a typical L2 cache) to stay in cache across the reductions of 
+# `ADCStats.add_chunk()`. A frame larger than this is a block of its own.
+BLOCK_BYTES = 1024 * 1024
+
+
+def frame_power_peak(frame_set):
+    """
+    Mean power and peak ADC magnitude of each frame, computed on a real
+    view of the IQ samples rather than on their (strided) real and
+    imaginary parts, without making a copy of them.
+
+    Parameters:
+        frame_set (array_like):
+            Complex array of IQ samples from the ADC, of shape
+            `(n_frames, n_spec_points)`, C-contiguous along each frame.
+
+    Returns:
+        power (array_like):
+            Mean `|x|**2` of each frame, of length `n_frames`.
+        peak (array_like):
+            Largest `|I|` or `|Q|` in each frame.
+    """
+    iq = frame_set.view(frame_set.real.dtype) # I, Q interleaved
+    power = np.matmul(iq[:, np.newaxis, :],
+                      iq[:, :, np.newaxis]).ravel() / frame_set.shape[1]
+    peak = np.maximum(iq.max(axis=1), -iq.min(axis=1))
+    return power, peak
+
+
+def component_max(iq, peak, component):
+    """
+    Largest `|I|` (`component` 0) or `|Q|` (1) of a set of frames, from
+    their interleaved I and Q values. Frames are searched in order of their
+    overall `peak`, stopping once no remaining frame can hold a larger
+    value, so usually only one or two frames are reduced.
+    """
+    best = -np.inf
+    for row in np.argsort(peak)[::-1]:
+        if peak[row] <= best:
+            break
+        best = max(best, np.abs(iq[row, component::2]).max())
+    return best
+
+
+def bit_histogram(magnitude, nBins=HISTOGRAM_BINS):
+    """
+    Count ADC magnitudes by the highest bit set: bin `k` holds magnitudes
+    in `[2**-(k+1), 2**-k)` of the full scale, bin 0 also holds anything
+    above the full scale, and the last bin everything below, including 0.
+
+    Parameters:
+        magnitude (array_like):
+            ADC magnitudes, `|I|` or `|Q|`, or the signed I and Q values
+            themselves, which fall in the same bins.
+        nBins (int):
+            Number of bins.
+
+    Returns:
+        counts (array_like):
+            Number of magnitudes in each bin.
+    """
+    # frexp gives |v| = m * 2**e with 0.5 <= m < 1, so bin = -e
+    bins = -np.frexp(magnitude)[1].ravel()
+    bins[magnitude.ravel() == 0] = nBins - 1
+    np.clip(bins, 0, nBins - 1, out=bins)
+    return np.bincount(bins, minlength=nBins)
+
+
+class ADCStats:
+    """
+    Running ADC statistics of one integration. `add_chunk()` may be called
+    from several threads at once; only the fold into the sums is
+    serialised.
+
+    Parameters:
+        clipLevel (float):
+            ADC magnitude counted as clipped.
+        nBins (int):
+            Number of bins in the amplitude histogram.
+    """
+    def __init__(self, clipLevel=CLIP_LEVEL, nBins=HISTOGRAM_BINS):
+        self.clipLevel = clipLevel
+        self.nBins = nBins
+        self.n_samples = 0
+        self.max_i = self.max_q = -np.inf # peak |I| and |Q|
+        self.sum_x = 0j # sum of x, I + jQ
+        self.sum_abs2 = 0. # sum of |x|**2
+        self.sum_x2 = 0j # sum of x**2, (I**2 - Q**2) + 2jIQ
+        self.n_clipped = 0
+        self.histogram = np.zeros(nBins, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def add_chunk(self, frame_set):
+        """
+        Fold a chunk of frames into the statistics.
+
+        Parameters:
+            frame_set (array_like):
+                Complex array of IQ samples, of shape
+                `(n_frames, n_spec_points)`.
+
+        Returns:
+            power, peak (array_like):
+                Mean power and peak ADC magnitude of each frame, from
+                `frame_power_peak()`.
+        """
+        n_frames, n_spec_points = frame_set.shape
+        iq = frame_set.view(frame_set.real.dtype)
+        ones = np.ones(n_spec_points, dtype=frame_set.dtype)
+        power = np.empty(n_frames, dtype=iq.dtype)
+        peak = np.empty(n_frames, dtype=iq.dtype)
+        sum_x = np.empty(n_frames, dtype=frame_set.dtype)
+        sum_x2 = np.empty(n_frames, dtype=frame_set.dtype)
+        n_clipped = 0
+        histogram = np.zeros(self.nBins, dtype=np.int64)
+        # Per-frame sums keep the single precision partial sums short
+        step = max(1, BLOCK_BYTES // (n_spec_points * frame_set.itemsize))
+        for start in range(0, n_frames, step):
+            stop = min(start + step, n_frames)
+            block, block_iq = frame_set[start:stop], iq[start:stop]
+            power[start:stop], peak[start:stop] = frame_power_peak(block)
+            sum_x[start:stop] = np.matmul(block, ones)
+            sum_x2[start:stop] = np.matmul(block[:, np.newaxis, :],
+                                           block[:, :, np.newaxis]).ravel()
+            hot = peak[start:stop] >= self.clipLevel
+            if hot.any():
+                n_clipped += int(np.count_nonzero(
+                                    np.abs(block_iq[hot]) >= self.clipLevel))
+            first = -start % HISTOGRAM_STRIDE # next frame on the stride
+            if first < stop - start:
+                histogram += bit_histogram(block_iq[first::HISTOGRAM_STRIDE],
+                                           self.nBins)
+        n_samples = frame_set.size
+        max_i = component_max(iq, peak, 0)
+        max_q = component_max(iq, peak, 1)
+        sum_abs2 = float(power.sum(dtype=np.float64)) * n_spec_points
+        sum_x = complex(sum_x.sum(dtype=np.complex128))
+        sum_x2 = complex(sum_x2.sum(dtype=np.complex128))
+        with self._lock:
+            self.n_samples += n_samples
+            self.max_i = max(self.max_i, max_i)
+            self.max_q = max(self.max_q, max_q)
+            self.sum_x += sum_x
+            self.sum_abs2 += sum_abs2
+            self.sum_x2 += sum_x2
+            self.n_clipped += n_clipped
+            self.histogram += histogram
+        return power, peak
+
+    def finalize(self):
+        """
+        Returns:
+            stats (dict):
+                The statistics in `STAT_KEYS`: RMS and DC offset of I and Q,
+                I/Q gain imbalance (`10*log10(var(I)/var(Q))`, dB) and phase
+                imbalance (degrees from quadrature), fraction of I and Q
+                values at the clip level, and the fraction of values in each
+                bin of the amplitude histogram (see `bit_histogram()`,
+                estimated from every `HISTOGRAM_STRIDE`-th frame). NaN if no
+                samples were added.
+        """
+        with self._lock:
+            n = self.n_samples
+            if n == 0:
+                stats = {key: np.nan for key in STAT_KEYS}
+                stats['adc_histogram'] = np.full(self.nBins, np.nan)
+                return stats
+            dc_i, dc_q = self.sum_x.real / n, self.sum_x.imag / n
+            mean_i2 = (self.sum_abs2 + self.sum_x2.real) / (2 * n)
+            mean_q2 = (self.sum_abs2 - self.sum_x2.real) / (2 * n)
+            var_i = mean_i2 - dc_i**2
+            var_q = mean_q2 - dc_q**2
+            cov_iq = self.sum_x2.imag / (2 * n) - dc_i * dc_q
+            with np.errstate(divide='ignore', invalid='ignore'):
+                iq_gain = 10 * np.log10(var_i / var_q)
+                iq_phase = np.degrees(np.arcsin(cov_iq
+                                                / np.sqrt(var_i * var_q)))
+            return {'adc_rms_i': np.sqrt(max(mean_i2, 0.)),
+                    'adc_rms_q': np.sqrt(max(mean_q2, 0.)),
+                    'adc_dc_i': dc_i,
+                    'adc_dc_q': dc_q,
+                    'adc_iq_gain': iq_gain,
+                    'adc_iq_phase': iq_phase,
+                    'adc_clip_fraction': self.n_clipped / (2 * n),
+                    'adc_histogram': (self.histogram
+                                      / max(self.histogram.sum(), 1)
+                                      ).astype(np.float32)}
@@ -4,28 +4,25 @@ import arduino_funcs
 import config
 import prerun_config
 
-def main():
-    parser = argparse.ArgumentParser(description="Arduino Control") # Set up parser
-
-    # Add more arguments for lone-running
 
-    # Point to yaml file for configuration
-    parser.add_argument('--yaml', type=str,
-                        default='/rhino-daq/obs_config.yaml',
-                        help='Config .yaml filepath')
-    
-    parser.add_argument('--prerun',
-                        action='store_true',
-                        help='Runs the Script in Prerun Mode')
-    
-    args = parser.parse_args()
-    yaml_path = args.yaml
-
-    if args.prerun:
-        params = prerun_config.return_arduino_params(yaml_path)
-    else:
-        params = config.return_arduino_params(yaml_path)
-    
+def cache_observation(params, arduino_object=None, switch_gate=None,
+                      close=True):
+    """
+    Run the temperature monitoring and/or switching for one observation 
+    block and save the results to the cache folder.
+
+    Parameters:
+        params (dict):
+            Arduino parameters from `config.return_arduino_params()`.
+        arduino_object (arduino_funcs.Arduino):
+            Already open Arduino to reuse, e.g. across observation blocks. 
+            Opened from `params` if not given.
+        switch_gate (capture.SwitchGate):
+            Optional gate told about each switch (general observing only).
+        close (bool):
+            Whether to close the serial port at the end (general observing 
+            only).
+    """
     # Observation Parameters
     runLength = params['runLength']
     obsCachePath = params['obsCachePath']
@@ -52,10 +49,11 @@ def main():
     dickeSwitchCycle = params['dickeSwitchCycle']
     DickeSwitchCycleLength = params['DickeSwitchCycleLength']
 
-    arduino_object = arduino_funcs.Arduino(n__temp_sens=n_temp_sens,
-                                           com_port=com_port,
-                                           baud_rate=baud_rate,
-                                           switch_dictionary=switch_dictionary)
+    if arduino_object is None:
+        arduino_object = arduino_funcs.Arduino(n__temp_sens=n_temp_sens,
+                                               com_port=com_port,
+                                               baud_rate=baud_rate,
+                                               switch_dictionary=switch_dictionary)
 
     if temp_monitoring_status and switch_status:
         print('|| arduino_control.py Begining General Observing ||')
@@ -65,7 +63,9 @@ def main():
                                                                       temperature_cadence=temp_cadence,
                                                                       dickeSwitchCycleLength=DickeSwitchCycleLength,
                                                                       switchSourceTargets=switchSourceTargets,
-                                                                      dickeSwitchCycle=dickeSwitchCycle)
+                                                                      dickeSwitchCycle=dickeSwitchCycle,
+                                                                      switch_gate=switch_gate,
+                                                                      close=close)
         np.save(f'{obsCachePath}/temperature_array.npy', arr=temperatures)
         np.save(f'{obsCachePath}/temperature_times.npy', arr=temperature_times)
         np.save(f'{obsCachePath}/switch_states.npy', arr=switch_states)
@@ -98,6 +98,31 @@ def main():
         return
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Arduino Control") # Set up parser
+
+    # Add more arguments for lone-running
+
+    # Point to yaml file for configuration
+    parser.add_argument('--yaml', type=str,
+                        default='/rhino-daq/obs_config.yaml',
+                        help='Config .yaml filepath')
+    
+    parser.add_argument('--prerun',
+                        action='store_true',
+                        help='Runs the Script in Prerun Mode')
+    
+    args = parser.parse_args()
+    yaml_path = args.yaml
+
+    if args.prerun:
+        params = prerun_config.return_arduino_params(yaml_path)
+    else:
+        params = config.return_arduino_params(yaml_path)
+    
+    cache_observation(params)
+
+
 if __name__ == "__main__":
     main()
 
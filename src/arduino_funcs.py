@@ -80,7 +80,9 @@ def general_observing(arduino: Arduino,
                       temperature_cadence,
                       dickeSwitchCycleLength,
                       switchSourceTargets,
-                      dickeSwitchCycle):
+                      dickeSwitchCycle,
+                      switch_gate=None,
+                      close=True):
     """
     Docstring for general_observing
     
@@ -92,6 +94,8 @@ def general_observing(arduino: Arduino,
     :param dickeSwitchCycleLength: Length of Each Dicke Switch Cycle
     :param switchSourceTargets: List of sources to observe, list of strings
     :param dickeSwitchCycle: List of targets to use in every switch sycle e.g ['source', 'load', 'noise_diode', 'heated_load']
+    :param switch_gate: Optional capture.SwitchGate told about each switch, for gated SDR acquisition in the same process
+    :param close: Close the serial port at the end; set False to keep it open for the next block
     """
     # split time between the dicke-switch targets
     targetTime = dickeSwitchCycleLength / len(dickeSwitchCycle)
@@ -115,12 +119,14 @@ def general_observing(arduino: Arduino,
             if t > t_end:
                 pass # break the loop if t exceeds the observing time
             else:
-                if d == 'source':
-                    arduino.set_switch_state(sourceTarget)
-                    switch_states.append(sourceTarget) # set the target to the source
-                else:
-                    arduino.set_switch_state(d)
-                    switch_states.append(d) # set the target to the dicke-switch target d
+                # set the target to the source or the dicke-switch target d
+                target = sourceTarget if d == 'source' else d
+                if switch_gate is not None:
+                    switch_gate.begin_switch()
+                arduino.set_switch_state(target)
+                if switch_gate is not None:
+                    switch_gate.end_switch(target)
+                switch_states.append(target)
                 t = time.time()
                 switch_times.append(t) # get the time
                 t_switch = t + targetTime
@@ -144,7 +150,8 @@ def general_observing(arduino: Arduino,
     switch_states = np.array(switch_states, dtype='S')
     switch_times = np.array(switch_times)
 
-    arduino.close() # Close arduino
+    if close:
+        arduino.close() # Close arduino
     return temperatures, temperature_times, switch_states, switch_times
 
 
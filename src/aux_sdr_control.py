@@ -1,13 +1,18 @@
 import time
 import numpy as np
 import os
-import SoapySDR
-from SoapySDR import * #SOAPY_SDR_ constants
+try:
+    from SoapySDR import * #SOAPY_SDR_ constants
+except ImportError: # no bindings; only the simulated SDR (`sim`) is usable
+    from sim_sdr import *
 from scipy.signal import windows
 import argparse
 import yaml
-import fft_funcs
-import pfb_funcs
+import spectrum
+import fft_backend
+import adc_stats
+from sdr_session import SDRSession
+from stream_clock import StreamClock
 import prerun_config
 import config
 
@@ -22,55 +27,55 @@ def measure_spectra(sampleIntegrationTime,
                     sdrLabel,
                     spectrometerMode,
                     nTaps,
-                    appliedWindow):
+                    appliedWindow,
+                    sdrRFGR=None,
+                    sdrIFGR=None,
+                    fftBackend='numpy',
+                    fftWorkers=None,
+                    fftWisdomPath=None,
+                    windowCachePath=None,
+                    precision='single',
+                    accumulatorPrecision='double',
+                    simParams=None,
+                    session=None):
     
+    # Per-measurement FFT backend and precision; the main SDR may be 
+    # channelising with different ones in the same process
+    fft = fft_backend.get_fft_backend(fftBackend, fftWorkers, fftWisdomPath)
+    window_dtype = spectrum.precision_dict[precision]
     if spectrometerMode == 'fft':
-        win_coeffs = fft_funcs.window_dict[appliedWindow](nChannels) # get fft window
+        win_coeffs = spectrum.get_window_coeffs(spectrometerMode, appliedWindow, nChannels,
+                                                dtype=window_dtype,
+                                                windowCachePath=windowCachePath) # get fft window
         nsamp = int(sampleIntegrationTime * bandwidth / nChannels) # fft_case number of frames for each fft
-        spectrometer_func = fft_funcs.buffs_to_powers
+        spectrometer_func = spectrum.buffer_to_psd_fft
         nStream = nChannels
         nTaps = None
     else:
-        win_coeffs = pfb_funcs.create_window(appliedWindow, nChannels, nTaps)
+        win_coeffs = spectrum.get_window_coeffs(spectrometerMode, appliedWindow, nChannels, nTaps,
+                                                dtype=window_dtype,
+                                                windowCachePath=windowCachePath)
         nsamp = int(sampleIntegrationTime * bandwidth / (nChannels*nTaps)) # pfb number of frames for each pfb
-        spectrometer_func = pfb_funcs.buffs_to_powers
+        spectrometer_func = spectrum.buffer_to_psd_pfb
         nStream = nChannels * nTaps
 
     nthin = 1
     print('nsamp', nsamp)
-    rx_chan = 0 # only 1 channel on RSP1A
-    sdr = SoapySDR.Device(dict(driver=sdrDriver, label=sdrLabel))
-    sdr.setSampleRate(SOAPY_SDR_RX, rx_chan, bandwidth)
-    sdr.setFrequency(SOAPY_SDR_RX, rx_chan, centre_frequency)
-    sdr.setBandwidth(SOAPY_SDR_RX, rx_chan, int(bandwidth)) # intialises the SDR with settings
-
-    print("auxSDR:","hardware info", sdr.getHardwareInfo())
-
-    sdr.setGainMode(SOAPY_SDR_RX, rx_chan, False) # turn ON AGC
-    sdr.setGain(SOAPY_SDR_RX, rx_chan, sdrGain)
-    rxStream = sdr.setupStream(SOAPY_SDR_RX, SOAPY_SDR_CF32, [rx_chan])
-
-    print("hardware info", sdr.getHardwareInfo())
-
-    status = sdr.activateStream(rxStream) #start streaming
-    print("Stream MTU:", sdr.getStreamMTU(rxStream))
-    print("Activate status:", status)
-    print("Current gain:", sdr.getGain(SOAPY_SDR_RX, rx_chan))
-    print("Current Gain Mode, AGC:", sdr.getGainMode(SOAPY_SDR_RX, rx_chan)) # check if AGC is on
-    print("")
-
-    sdr.writeSetting("rfnotch_ctrl", "true") # set notches
-    sdr.writeSetting("dabnotch_ctrl", "true")
+    # Reuse the open session if given, applying only the changed settings. 
+    # The aux SDR only takes the overall gain; sdrRFGR/sdrIFGR are not set
+    own_session = session is None
+    if own_session:
+        session = SDRSession(sdrDriver, sdrLabel, simParams)
+    session.configure(bandwidth, centre_frequency, sdrGain=sdrGain,
+                      notches=("rfnotch_ctrl", "dabnotch_ctrl"))
+    sdr, rxStream = session.sdr, session.rxStream
 
     print("RF gain idx:", sdr.readSetting("rfgain_sel"))
 
-    #final_gain = 0 # FIXME
-    sdr.deactivateStream(rxStream) #stop streaming
-
-    if sdr.getStreamMTU(rxStream) < nStream:
-        nStream = sdr.getStreamMTU(rxStream)
+    if session.mtu < nStream:
+        raise NotImplementedError("The SoapySDR MTU is smaller than the requested spectrum length, nStream.")
 
-    sdr.activateStream(rxStream)
+    session.start()
 
     buff = np.zeros((nStream,), np.complex64)
 
@@ -79,14 +84,32 @@ def measure_spectra(sampleIntegrationTime,
     waterfall_spectra = []
     times = []
     max_adc = []
+    stream_stats = {'samples_received': [],
+                    'samples_expected': [],
+                    'n_overflows': [],
+                    'n_timeouts': [],
+                    'capture_time': [],
+                    'time_start': [],
+                    'time_stop': [],
+                    **{key: [] for key in adc_stats.STAT_KEYS}}
+    daq_status = np.zeros(nsamp, dtype=int)
+    clock = StreamClock(bandwidth)
     t = time.time()
     while t < t_f:
         buffs = []
+        t_start = time.monotonic()
+        t_first = t_last = None
         for i in range(nsamp):
             # Receive some samples
             t0 = time.perf_counter_ns()
             sr = sdr.readStream(rxStream, [buff], len(buff), timeoutUs=int(100e3))
             tend = time.perf_counter_ns()
+            span = clock.stamp(sr)
+            daq_status[i] = int(sr.ret)
+            if span is not None:
+                if t_first is None:
+                    t_first = span[0]
+                t_last = span[1]
 
             if int(sr.ret) < 0:
                 print("Error status encountered: %d (%d)" % (sr.ret, i))
@@ -99,19 +122,39 @@ def measure_spectra(sampleIntegrationTime,
             buff[:] = 0.
 
             # Save output
-        spectra = spectrometer_func(buffs, win_coeffs, nChannels, nTaps)
+        capture_time = time.monotonic() - t_start
+        stream_stats['samples_received'].append(
+                                    daq_status[daq_status > 0].sum())
+        stream_stats['samples_expected'].append(nsamp * nStream)
+        stream_stats['n_overflows'].append(
+                        np.count_nonzero(daq_status == SOAPY_SDR_OVERFLOW))
+        stream_stats['n_timeouts'].append(
+                        np.count_nonzero(daq_status == SOAPY_SDR_TIMEOUT))
+        stream_stats['capture_time'].append(capture_time)
+        if t_first is None: # nothing received
+            t_first = t_last = time.time()
+        stream_stats['time_start'].append(t_first)
+        stream_stats['time_stop'].append(t_last)
+        buffs = np.array(buffs)
+        spectra = spectrometer_func(buffs, win_coeffs, nChannels, nTaps, fft=fft,
+                                    accumulatorPrecision=accumulatorPrecision)
         waterfall_spectra.append(spectra)
-        times.append(time.time())
+        times.append((t_first + t_last) / 2) # middle of the samples
         t = time.time()
-        max_adc_i = np.max(np.abs(np.array(buffs)))
+        stats = adc_stats.ADCStats()
+        stats.add_chunk(buffs)
+        for key, value in stats.finalize().items():
+            stream_stats[key].append(value)
+        max_adc_i = max(stats.max_i, stats.max_q)
         max_adc.append(max_adc_i)
         print(t)
         print(f"Max Aux ADC: {max_adc_i}")
         print(f'Remaining Aux: {t_f - t} s')
         pass
 
-    sdr.deactivateStream(rxStream) #stop streaming
-    sdr.closeStream(rxStream)
+    session.stop() #stop streaming
+    if own_session:
+        session.close()
 
     print('SDRPlay Stream Deactivated')
     waterfall_spectra = np.array(waterfall_spectra)
@@ -120,31 +163,23 @@ def measure_spectra(sampleIntegrationTime,
                                               bandwidth/2/1e6 + centre_frequency/1e6,
                                               nChannels)
     max_adc = np.array(max_adc)
-    return waterfall_spectra, times, freqs, max_adc
-
-
-def main():
-    parser = argparse.ArgumentParser(description="Dual SDR Observation (RTLSDR + SDRplay)")
-
-    # Add more arguments for lone-running
-    parser.add_argument('--yaml', type=str,
-                        default='/rhino-daq/obs_config.yaml',
-                        help='Config .yaml filepath')
-    
-    parser.add_argument('--prerun',
-                        action='store_true',
-                        help='Runs the Script in Prerun Mode')
-
-    args = parser.parse_args()
-
-    yaml_path = args.yaml
-    pre_run_status = args.prerun
-
-    if pre_run_status:
-        params = prerun_config.return_aux_sdr_params(yaml_path)
-    else:
-        params = config.return_aux_sdr_params(yaml_path)
-
+    stream_stats = {key: np.array(value) 
+                    for key, value in stream_stats.items()}
+    return waterfall_spectra, times, freqs, max_adc, stream_stats
+
+
+def cache_observation(params, session=None):
+    """
+    Run `measure_spectra()` for one observation block with the parameters 
+    from `config.return_aux_sdr_params()`, and save the results to the 
+    cache folder.
+
+    Parameters:
+        params (dict):
+            Aux SDR parameters from `config.return_aux_sdr_params()`.
+        session (sdr_session.SDRSession):
+            Open SDR session to reuse, e.g. across observation blocks.
+    """
     runLength = params['runLength']
     obsCachePath = params['obsCachePath']
     active = params['active']
@@ -162,6 +197,13 @@ def main():
     delay = params['delay']
     nTaps = params['nTaps']
     appliedWindow = params['appliedWindow']
+    fftBackend = params['fftBackend']
+    fftWorkers = params['fftWorkers']
+    fftWisdomPath = params['fftWisdomPath']
+    windowCachePath = params['windowCachePath']
+    precision = params['precision']
+    accumulatorPrecision = params['accumulatorPrecision']
+    simParams = params['simParams']
     if not active: # returns from main if the program is not active
         return
     # add delay , runLength = runLength - delay
@@ -169,7 +211,7 @@ def main():
 
     time.sleep(delay)
 
-    waterfall_spectra, times, freqs, max_i_adc, max_q_adc = measure_spectra(sampleIntegrationTime = sampleIntegrationTime,
+    waterfall_spectra, times, freqs, max_adc, stream_stats = measure_spectra(sampleIntegrationTime = sampleIntegrationTime,
                                                       runLength = runLength,
                                                       centre_frequency = centreFrequency,
                                                       bandwidth = bandwidth,
@@ -182,17 +224,52 @@ def main():
                                                       sdrLabel = sdrLabel,
                                                       spectrometerMode = spectrometerMode,
                                                       nTaps = nTaps,
-                                                      appliedWindow = appliedWindow)
+                                                      appliedWindow = appliedWindow,
+                                                      fftBackend = fftBackend,
+                                                      fftWorkers = fftWorkers,
+                                                      fftWisdomPath = fftWisdomPath,
+                                                      windowCachePath = windowCachePath,
+                                                      precision = precision,
+                                                      accumulatorPrecision = accumulatorPrecision,
+                                                      simParams = simParams,
+                                                      session = session)
 
     np.save(f'{obsCachePath}/aux_sdr_waterfall.npy', arr=waterfall_spectra)
     np.save(f'{obsCachePath}/aux_sdr_times.npy', arr=times)
     np.save(f'{obsCachePath}/aux_sdr_freqs.npy', arr=freqs)
-    np.save(f'{obsCachePath}/aux_max_i_adc.npy', arr=max_i_adc)
-    np.save(f'{obsCachePath}/aux_max_q_adc.npy', arr=max_q_adc)
+    np.save(f'{obsCachePath}/aux_max_adc.npy', arr=max_adc)
+    for key, value in stream_stats.items():
+        np.save(f'{obsCachePath}/aux_{key}.npy', arr=value)
 
     np.save(f'{obsCachePath}/new_data_bool.npy', True)
     print('Aux SDR Data Cached')
     pass
 
+
+def main():
+    parser = argparse.ArgumentParser(description="Dual SDR Observation (RTLSDR + SDRplay)")
+
+    # Add more arguments for lone-running
+    parser.add_argument('--yaml', type=str,
+                        default='/rhino-daq/obs_config.yaml',
+                        help='Config .yaml filepath')
+    
+    parser.add_argument('--prerun',
+                        action='store_true',
+                        help='Runs the Script in Prerun Mode')
+
+    args = parser.parse_args()
+
+    yaml_path = args.yaml
+    pre_run_status = args.prerun
+
+    if pre_run_status:
+        params = prerun_config.return_aux_sdr_params(yaml_path)
+    else:
+        params = config.return_aux_sdr_params(yaml_path)
+
+    cache_observation(params)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
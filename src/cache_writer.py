@@ -0,0 +1,89 @@
+"""
+Streaming writer for the observation cache, so that each integration is
+written to disk as soon as it is produced rather than at the end of a block.
+"""
+import time
+import numpy as np
+import h5py
+
+
+class StreamingWriter:
+    """
+    Append rows to chunked, resizable HDF5 datasets, flushing to disk
+    periodically.
+
+    Datasets are created on the first `append()` call that includes them,
+    with a shape of `(0,) + row.shape` and an unlimited first axis. If the
+    acquisition is interrupted, at most `flush_interval` seconds of data
+    are lost.
+
+    Parameters:
+        filepath (str):
+            Path of the HDF5 cache file. An existing file is overwritten.
+        flush_interval (float):
+            Maximum time between flushes to disk, in seconds.
+        chunk_rows (int):
+            Number of rows in each HDF5 chunk.
+    """
+    def __init__(self, filepath, flush_interval=10., chunk_rows=16):
+        self.filepath = filepath
+        self.flush_interval = flush_interval
+        self.chunk_rows = chunk_rows
+        self.file = h5py.File(filepath, 'w')
+        self.datasets = {}
+        self.n_rows = 0
+        self.last_flush = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _create(self, name, row):
+        if row.dtype.kind in 'US': # e.g. switch states
+            dtype = h5py.string_dtype()
+        else:
+            dtype = row.dtype
+        return self.file.create_dataset(name,
+                                        shape=(0,) + row.shape,
+                                        maxshape=(None,) + row.shape,
+                                        chunks=(self.chunk_rows,) + row.shape,
+                                        dtype=dtype)
+
+    def append(self, **rows):
+        """
+        Append one row to each of the named datasets, e.g.
+        `writer.append(sdr_waterfall=spectra, sdr_times=t)`.
+        """
+        for name, value in rows.items():
+            row = np.asarray(value)
+            if name not in self.datasets:
+                self.datasets[name] = self._create(name, row)
+            ds = self.datasets[name]
+            ds.resize(self.n_rows + 1, axis=0)
+            ds[self.n_rows] = value if isinstance(value, str) else row
+        self.n_rows += 1
+
+        if time.time() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def write(self, name, data):
+        """
+        Write a complete (non-streamed) dataset, e.g. the frequency axis.
+        """
+        if name in self.file:
+            del self.file[name]
+        self.file.create_dataset(name, data=np.asarray(data))
+
+    def flush(self):
+        """
+        Flush all written rows to disk.
+        """
+        self.file.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        self.file = None
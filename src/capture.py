@@ -0,0 +1,530 @@
+"""
+Threads for gap-free acquisition: a capture thread that only reads from the
+SoapySDR stream, and channeliser workers that consume the filled chunks of
+frames and fold them into per-integration accumulators.
+"""
+import threading
+import time
+import collections
+import numpy as np
+from sim_sdr import SOAPY_SDR_TIMEOUT, SOAPY_SDR_OVERFLOW # same as SoapySDR
+from stream_clock import StreamClock
+import spectrum
+import adc_stats
+
+
+class CaptureThread(threading.Thread):
+    """
+    Read frames from a SoapySDR stream into the blocks of a `FrameRing`
+    until the run length has elapsed, publishing each filled chunk of frames
+    to the channeliser workers.
+
+    Each integration of `n_frames` frames is split into chunks of up to
+    `ring.n_frames` frames. After the last chunk of an integration, a marker
+    carrying the number of chunks published for it is sent, so the workers
+    know when the integration is complete.
+
+    If the workers fall behind and no free block is available, the chunk is
+    still read (into a scratch block) so that the driver buffer keeps
+    draining, but it is discarded and counted in `n_chunks_dropped`.
+
+    Each frame is filled with as many `readStream` calls as it takes (see
+    `frame_ring.read_row()`), so short reads do not lose data; only frames
+    cut short by an overflow, timeout or stream error are dropped. The
+    number of samples received, overflows and timeouts of each integration
+    are passed on with the end-of-integration marker along with the number
+    of samples expected and the elapsed capture time. Each integration is
+    also timestamped with the start and stop times of its samples, from the
+    stream clock (see `stream_clock.StreamClock`).
+
+    If a `SwitchGate` is given, integrations are also closed early whenever
+    the switches move, and frames read while the switches are moving are
+    discarded (counted in `n_frames_discarded`), so no integration straddles
+    a switch transition. Each integration is labelled with its switch state.
+
+    Parameters:
+        sdr (SoapySDR.Device):
+            The SDR device.
+        rxStream (SoapySDR.Stream):
+            An active receive stream.
+        ring (FrameRing):
+            Ring of chunk-sized blocks shared with the workers.
+        runLength (float):
+            How long to capture for, in seconds.
+        n_frames (int):
+            Number of frames in each integration.
+        sampleRate (float):
+            Complex sample rate of the stream, in Hz.
+        n_workers (int):
+            Number of workers to signal at the end of the stream.
+        timeoutUs (int):
+            `readStream` timeout, in microseconds.
+        gate (SwitchGate):
+            Optional switch gate, shared with the switch controller.
+    """
+    def __init__(self, sdr, rxStream, ring, runLength, n_frames, sampleRate,
+                 n_workers=1, timeoutUs=int(100e3), gate=None):
+        super().__init__(name='sdr-capture', daemon=True)
+        self.sdr = sdr
+        self.rxStream = rxStream
+        self.ring = ring
+        self.runLength = runLength
+        self.n_frames = n_frames
+        self.n_workers = n_workers
+        self.timeoutUs = timeoutUs
+        self.clock = StreamClock(sampleRate)
+        self.gate = gate
+
+        self.scratch = np.zeros((ring.n_frames, ring.n_spec_points),
+                                dtype=ring.blocks.dtype)
+        self.scratch_status = np.zeros(ring.n_frames, dtype=int)
+        self.n_integrations = 0
+        self.n_chunks_dropped = 0
+        self.n_frames_discarded = 0
+        self.after_gap = False
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        """
+        Ask the thread to finish after the current integration.
+        """
+        self.stop_event.set()
+
+    def _wait_for_gate(self, t_f):
+        """
+        Read and discard frames until the switches have settled, so the
+        driver buffer keeps draining.
+
+        Returns:
+            epoch (int):
+                Gate epoch of the settled switch state, or `None` if the run
+                ended first.
+            state (str):
+                The settled switch state.
+        """
+        while time.time() < t_f and not self.stop_event.is_set():
+            epoch, state, settled = self.gate.snapshot()
+            if settled:
+                return epoch, state
+            self.ring.read_frame(self.sdr, self.rxStream, self.scratch,
+                                 self.scratch_status, 0, self.timeoutUs,
+                                 self.clock)
+            self.n_frames_discarded += 1
+            self.after_gap = True
+        return None, None
+
+    def run(self):
+        ring = self.ring
+        gate = self.gate
+        t_f = time.time() + self.runLength
+        try:
+            while time.time() < t_f and not self.stop_event.is_set():
+                epoch = state = None
+                if gate is not None:
+                    epoch, state = self._wait_for_gate(t_f)
+                    if epoch is None:
+                        break
+                seq = self.n_integrations
+                n_chunks = 0
+                n_dropped = 0
+                n_read = 0
+                samples_received = 0
+                n_overflows = 0
+                n_timeouts = 0
+                t_first = t_last = None
+                t_capture = time.monotonic()
+                switched = False
+                while n_read < self.n_frames and not switched:
+                    n_rows = min(ring.n_frames, self.n_frames - n_read)
+                    index = ring.acquire(timeout=0)
+                    if index is None:
+                        frame_set, daq_status = self.scratch, \
+                                                self.scratch_status
+                    else:
+                        frame_set, daq_status = ring.blocks[index], \
+                                                ring.status[index]
+
+                    for i in range(n_rows):
+                        if gate is not None and gate.epoch != epoch:
+                            switched = True # close the integration early
+                            n_rows = i
+                            break
+                        n_received, span = ring.read_frame(
+                                                self.sdr, self.rxStream,
+                                                frame_set, daq_status, i,
+                                                self.timeoutUs, self.clock)
+                        samples_received += n_received
+                        if span is not None:
+                            if t_first is None:
+                                t_first = span[0]
+                            t_last = span[1]
+                    n_read += n_rows
+
+                    status = daq_status[:n_rows]
+                    n_overflows += int(np.count_nonzero(
+                                            status == SOAPY_SDR_OVERFLOW))
+                    n_timeouts += int(np.count_nonzero(
+                                            status == SOAPY_SDR_TIMEOUT))
+
+                    if n_rows == 0: # switched at the start of the chunk
+                        if index is not None:
+                            ring.release(index)
+                        continue
+                    if index is None:
+                        self.n_chunks_dropped += 1
+                        n_dropped += n_rows
+                        self.after_gap = True
+                        continue
+                    ring.publish(index, {'seq': seq, 'n_rows': n_rows,
+                                         'after_gap': self.after_gap})
+                    self.after_gap = False
+                    n_chunks += 1
+
+                if n_read == 0:
+                    continue # switched before any frames were read
+
+                # Mark the end of the integration
+                if t_first is None: # nothing received
+                    t_first = t_last = time.time()
+                ring.publish(None, {'seq': seq,
+                                    'n_chunks': n_chunks,
+                                    'n_dropped': n_dropped,
+                                    'samples_received': samples_received,
+                                    'samples_expected': n_read
+                                                        * ring.n_spec_points,
+                                    'n_overflows': n_overflows,
+                                    'n_timeouts': n_timeouts,
+                                    'capture_time': time.monotonic()
+                                                    - t_capture,
+                                    'time_start': t_first,
+                                    'time_stop': t_last,
+                                    'time': (t_first + t_last) / 2,
+                                    'state': state})
+                self.n_integrations += 1
+        finally:
+            for _ in range(self.n_workers):
+                ring.publish(None)
+
+
+class SwitchGate:
+    """
+    Event channel between the switch controller and the capture thread, for
+    acquiring spectra gated by the switch state in a single process.
+
+    The switch controller calls `begin_switch()` before commanding the
+    switches and `end_switch(state)` once they have moved. The capture
+    thread closes its current integration as soon as the gate epoch
+    changes, discards frames until the switches have settled, and then
+    labels the next integration with the new state.
+
+    Parameters:
+        settleTime (float):
+            Extra time to wait after the switch command returns before
+            samples are used, in seconds.
+    """
+    def __init__(self, settleTime=0.):
+        self.settleTime = settleTime
+        self.epoch = 0
+        self.state = None
+        self.settled = False
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, func):
+        """
+        Call `func(state)` whenever the switches have settled in a new state,
+        e.g. `sim_sdr.SimDevice.set_source`.
+        """
+        self.listeners.append(func)
+
+    def begin_switch(self):
+        """
+        Mark the start of a switch transition.
+        """
+        with self._lock:
+            self.settled = False
+            self.epoch += 1
+
+    def end_switch(self, state):
+        """
+        Mark the switches as settled in `state`.
+        """
+        if self.settleTime:
+            time.sleep(self.settleTime)
+        for func in self.listeners:
+            func(state)
+        with self._lock:
+            self.state = state
+            self.settled = True
+
+    def snapshot(self):
+        """
+        Returns:
+            epoch, state, settled:
+                Consistent snapshot of the gate.
+        """
+        with self._lock:
+            return self.epoch, self.state, self.settled
+
+
+class IntegrationCollector:
+    """
+    Per-integration accumulators shared by the channeliser workers.
+
+    Parameters:
+        make_accumulator (callable):
+            Function returning a new `spectrum.PSDAccumulator`, already
+            initialised, for each integration.
+        emit (callable):
+            Function called with a result dict for each completed
+            integration, in capture order, e.g. `list.append` or a function
+            writing the result to the cache file. It is called outside the
+            accumulator lock, so the other workers are not held up by it.
+        verbose (bool):
+            Whether to print ADC statistics for each integration.
+        clipLevel (float):
+            Frames with an I or Q magnitude at or above this level are
+            rejected as clipped, if not `None` (see
+            `spectrum.reject_frames()`).
+        madThreshold (float):
+            Frames whose power exceeds the median of their chunk by more
+            than this many robust standard deviations are rejected, if not
+            `None`.
+        minFrames (int):
+            Integrations with fewer frames kept than this are dropped
+            (counted in `n_short`), e.g. the runts closed early by a switch
+            edge, which would otherwise carry the same weight as a full
+            integration wherever spectra are averaged.
+    """
+    def __init__(self, make_accumulator, emit, verbose=False, clipLevel=None,
+                 madThreshold=None, minFrames=1):
+        self.make_accumulator = make_accumulator
+        self.emit = emit
+        self.verbose = verbose
+        self.clipLevel = clipLevel
+        self.madThreshold = madThreshold
+        self.minFrames = minFrames
+        self.n_short = 0
+        self.pending = {}
+        self.completed = {}
+        self.next_seq = 0
+        self.ready = collections.deque()
+        self._lock = threading.Lock()
+        self._emit_lock = threading.Lock()
+
+    def _entry(self, seq):
+        with self._lock:
+            if seq not in self.pending:
+                self.pending[seq] = {'acc': self.make_accumulator(),
+                                     'chunks_done': 0,
+                                     'n_chunks': None,
+                                     'samples_channelised': 0,
+                                     'n_frames_kept': 0,
+                                     'n_frames_clipped': 0,
+                                     'n_frames_rfi': 0,
+                                     'adc': adc_stats.ADCStats(
+                                                self.clipLevel or
+                                                adc_stats.CLIP_LEVEL)}
+            return self.pending[seq]
+
+    def add_chunk(self, info, frame_set, daq_status=None):
+        """
+        Fold a chunk of frames into the accumulator for its integration.
+
+        Frames that `readStream` could not fill (cut short by an overflow,
+        timeout or stream error, per `daq_status`) are left out, so the
+        zero-filled samples do not bias the time-averaged PSD. So are
+        frames that clip the ADC or carry a burst of power, per `clipLevel`
+        and `madThreshold`. The ADC statistics (`adc_stats.ADCStats`) are
+        taken before these frames are removed.
+
+        The frames kept are channelised as runs of consecutive frames, and
+        the overlapping PFB's tap history is reset at every gap between
+        runs, so no spectrum spans samples that were not contiguous.
+        """
+        entry = self._entry(info['seq'])
+        n_rows, n_spec_points = frame_set.shape
+        if daq_status is not None:
+            keep = daq_status == n_spec_points
+        else:
+            keep = np.ones(n_rows, dtype=bool)
+        n_clipped = n_rfi = 0
+        if keep.any():
+            complete = frame_set if keep.all() else frame_set[keep]
+            # ADC statistics, and the power and peak of every frame, in one 
+            # set of reductions over the chunk
+            power, peak = entry['adc'].add_chunk(complete)
+            clipped, outliers = spectrum.reject_frames(
+                                        power, peak, self.clipLevel,
+                                        self.madThreshold)
+            n_clipped = int(np.count_nonzero(clipped))
+            n_rfi = int(np.count_nonzero(outliers))
+            if n_clipped or n_rfi:
+                keep[np.flatnonzero(keep)[clipped | outliers]] = False
+
+        # Channelise the kept frames in runs of consecutive frames
+        kept_index = np.flatnonzero(keep)
+        runs = np.split(kept_index, np.flatnonzero(np.diff(kept_index) != 1)
+                                    + 1)
+        streaming_pfb = entry['acc'].streaming_pfb
+        gap = info['after_gap']
+        for run in runs:
+            if run.size == 0:
+                continue
+            if streaming_pfb is not None and (gap or run[0] > 0):
+                streaming_pfb.reset() # stream is not continuous
+            entry['acc'].add_chunk(frame_set[run[0]:run[-1] + 1])
+            gap = True
+        if streaming_pfb is not None and not keep[-1:].all():
+            streaming_pfb.reset() # the next chunk does not follow on
+        n_kept = kept_index.size
+        with self._lock:
+            entry['chunks_done'] += 1
+            entry['samples_channelised'] += n_kept * n_spec_points
+            entry['n_frames_kept'] += n_kept
+            entry['n_frames_clipped'] += n_clipped
+            entry['n_frames_rfi'] += n_rfi
+            self._finish_if_complete(info['seq'])
+        self._emit_ready()
+
+    def end_integration(self, info):
+        """
+        Record the end-of-integration marker from the capture thread.
+        """
+        entry = self._entry(info['seq'])
+        with self._lock:
+            entry.update(info)
+            self._finish_if_complete(info['seq'])
+        self._emit_ready()
+
+    def _finish_if_complete(self, seq):
+        entry = self.pending[seq]
+        if entry['n_chunks'] is None \
+           or entry['chunks_done'] < entry['n_chunks']:
+            return
+        del self.pending[seq]
+        if entry['samples_channelised'] == 0:
+            self.completed[seq] = None # every chunk or frame was dropped
+        elif entry['n_frames_kept'] < self.minFrames:
+            self.completed[seq] = None
+            self.n_short += 1
+        else:
+            acc = entry['acc']
+            sk, sk_flags = acc.spectral_kurtosis() \
+                           if acc.spectralKurtosis else (None, None)
+            self.completed[seq] = {'seq': seq,
+                                   'time': entry['time'],
+                                   'time_start': entry['time_start'],
+                                   'time_stop': entry['time_stop'],
+                                   'state': entry['state'],
+                                   'spectra': acc.finalize(),
+                                   'sk': sk,
+                                   'sk_flags': sk_flags,
+                                   'max_i_adc': entry['adc'].max_i,
+                                   'max_q_adc': entry['adc'].max_q,
+                                   **entry['adc'].finalize(),
+                                   'n_dropped': entry['n_dropped'],
+                                   'samples_received':
+                                        entry['samples_received'],
+                                   'samples_expected':
+                                        entry['samples_expected'],
+                                   'samples_channelised':
+                                        entry['samples_channelised'],
+                                   'n_frames_kept': entry['n_frames_kept'],
+                                   'n_frames_clipped':
+                                        entry['n_frames_clipped'],
+                                   'n_frames_rfi': entry['n_frames_rfi'],
+                                   'n_overflows': entry['n_overflows'],
+                                   'n_timeouts': entry['n_timeouts'],
+                                   'capture_time': entry['capture_time']}
+
+        # Integrations can complete out of order with several workers, so 
+        # hold them back until all earlier ones are ready to be emitted
+        while self.next_seq in self.completed:
+            result = self.completed.pop(self.next_seq)
+            self.next_seq += 1
+            if result is not None:
+                self.ready.append(result)
+
+    def _emit_ready(self):
+        # Results join `ready` in capture order under `_lock`, and are 
+        # emitted in that order by whichever worker holds `_emit_lock`
+        with self._emit_lock:
+            while self.ready:
+                self._emit(self.ready.popleft())
+
+    def _emit(self, result):
+        self.emit(result)
+        if self.verbose:
+            print(result['time'])
+            print(f"Max ADC I: {result['max_i_adc']}")
+            print(f"Max ADC Q: {result['max_q_adc']}")
+            print(f"ADC RMS I/Q: {result['adc_rms_i']:.4f}/"
+                  f"{result['adc_rms_q']:.4f}, clipped: "
+                  f"{result['adc_clip_fraction']:.2e}")
+            if result['n_dropped']:
+                print(f"Frames dropped: {result['n_dropped']}")
+            if result['n_overflows'] or result['n_timeouts']:
+                print(f"Overflows: {result['n_overflows']}, "
+                      f"timeouts: {result['n_timeouts']}")
+            if result['n_frames_clipped'] or result['n_frames_rfi']:
+                print(f"Frames rejected: "
+                      f"{result['n_frames_clipped']} clipped, "
+                      f"{result['n_frames_rfi']} RFI")
+            if result['sk_flags'] is not None \
+               and result['sk_flags'].any():
+                print(f"SK flagged channels: "
+                      f"{np.count_nonzero(result['sk_flags'])}")
+
+
+class ChanneliserWorker(threading.Thread):
+    """
+    Channelise filled chunks of frames from a `FrameRing` into an
+    `IntegrationCollector`.
+
+    numpy and scipy release the GIL inside the FFT, so several workers can
+    run on separate cores alongside the capture thread.
+
+    If channelising or emitting fails, the exception is kept in `error`, 
+    `on_error` is called (e.g. `CaptureThread.stop`) and the worker exits, 
+    so the caller can raise it once the threads have been joined.
+
+    Parameters:
+        ring (FrameRing):
+            Ring of blocks shared with the capture thread.
+        collector (IntegrationCollector):
+            Accumulators shared between the workers.
+        on_error (callable):
+            Function called with no arguments if the worker fails.
+    """
+    def __init__(self, ring, collector, on_error=None):
+        super().__init__(name='sdr-channeliser', daemon=True)
+        self.ring = ring
+        self.collector = collector
+        self.on_error = on_error
+        self.error = None
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            self.error = e
+            if self.on_error is not None:
+                self.on_error()
+
+    def _run(self):
+        ring = self.ring
+        while True:
+            item = ring.get_filled()
+            if item is None:
+                return
+            index, info = item
+            if index is None:
+                self.collector.end_integration(info)
+                continue
+            try:
+                n_rows = info['n_rows']
+                self.collector.add_chunk(info, ring.blocks[index][:n_rows],
+                                         ring.status[index][:n_rows])
+            finally:
+                ring.release(index)
@@ -2,6 +2,81 @@ import numpy as np
 import h5py
 import yaml
 import datetime
+import os
+import time
+import hashlib
+
+# Settings for the prerun gain search (`sdr_control.gain_search()`), 
+# overridden by `sdr: gainSearch` in the .yaml. Results older than `maxAge` 
+# seconds are not used.
+DEFAULT_GAIN_SEARCH = {'active': False,
+                       'rfgrValues': [0, 2, 4, 6, 8, 10],
+                       'ifgrValues': [20, 25, 30, 35, 40, 45, 50, 55],
+                       'dwellTime': 0.1,
+                       'settleTime': 0.05,
+                       'targetRMS': 0.1,
+                       'maxClipFraction': 1e-6,
+                       'maxAge': 172800}
+
+# File in the cache folder holding the gains chosen by the gain search
+GAIN_SETTINGS_FILE = 'sdr_gain_settings.yaml'
+
+# SDR settings a gain search result depends on, see `gain_search_hash()`
+GAIN_SEARCH_KEYS = ('sdrDriver', 'sdrLabel', 'sdrId', 'centreFrequency', 
+                    'bandwidth', 'nChannels', 'spectrometerMode', 'nTaps')
+
+
+def gain_search_hash(params):
+    """
+    Hash of the SDR settings (`GAIN_SEARCH_KEYS`) and gain search settings 
+    that a gain search result was found with, stored with the result so 
+    that it is not used once they have changed.
+    
+    Parameters:
+        params (dict):
+            SDR parameters from `return_sdr_params()`.
+    """
+    search = {key: value for key, value in params['gainSearch'].items()
+              if key not in ('active', 'maxAge')}
+    settings = {key: params[key] for key in GAIN_SEARCH_KEYS}
+    settings['gainSearch'] = search
+    text = yaml.safe_dump(settings, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def load_gain_settings(params):
+    """
+    Gains chosen by the last gain search (`sdr_control.tune_gains()`), from 
+    `GAIN_SETTINGS_FILE` in the cache folder. A result is only used if it 
+    was found with the current settings (see `gain_search_hash()`) within 
+    the last `gainSearch: maxAge` seconds.
+    
+    Parameters:
+        params (dict):
+            SDR parameters from `return_sdr_params()`.
+    
+    Returns:
+        gain_settings (dict):
+            The saved `sdrRFGR`, `sdrIFGR`, `rms`, `clip_fraction`, `time` 
+            and `configHash`, or `None` if there is no usable result.
+    """
+    path = f"{params['obsCachePath']}/{GAIN_SETTINGS_FILE}"
+    if not os.path.exists(path):
+        print(f'No gain search result in {path}; using sdrRFGR/sdrIFGR')
+        return None
+    with open(path, 'r') as f:
+        gain_settings = yaml.safe_load(f) or {}
+    if gain_settings.get('configHash') != gain_search_hash(params):
+        print(f'Gain search result in {path} was found with other settings; '
+              f'using sdrRFGR/sdrIFGR')
+        return None
+    age = time.time() - gain_settings.get('time', 0)
+    if age > params['gainSearch']['maxAge']:
+        print(f'Gain search result in {path} is {age/3600:.1f} h old; '
+              f'using sdrRFGR/sdrIFGR')
+        return None
+    return gain_settings
+
 
 def return_sdr_params(yaml_path):
     """
@@ -31,16 +106,36 @@ def return_sdr_params(yaml_path):
     delay = sdr_config['delay']
     if not isinstance(sdrGain, int) or not isinstance(sdrGain, float):
         sdrGain = None
+    fftBackend = sdr_config.get('fftBackend', 'numpy')
+    fftWorkers = sdr_config.get('fftWorkers', None)
+    fftWisdomPath = sdr_config.get('fftWisdomPath', None)
+    windowCachePath = sdr_config.get('windowCachePath', None)
+    precision = sdr_config.get('precision', 'single')
+    accumulatorPrecision = sdr_config.get('accumulatorPrecision', 'double')
+    spectralKurtosis = sdr_config.get('spectralKurtosis', False)
+    skThreshold = sdr_config.get('skThreshold', 3.)
+    clipLevel = sdr_config.get('clipLevel', None)
+    madThreshold = sdr_config.get('madThreshold', None)
+    minIntegrationFraction = sdr_config.get('minIntegrationFraction', 0.5)
+    gainSearch = dict(DEFAULT_GAIN_SEARCH)
+    gainSearch.update(sdr_config.get('gainSearch', None) or {})
+    chunkFrames = sdr_config.get('chunkFrames', 64)
+    nBuffers = sdr_config.get('nBuffers', 8)
+    nWorkers = sdr_config.get('nWorkers', 1)
+    cacheFlushInterval = sdr_config.get('cacheFlushInterval', 10)
+    simParams = sdr_config.get('simParams', None) or {}
 
     if spectrometerMode == 'pfb':
         nTaps = sdr_config['pfbParams']['nTaps']
         appliedWindow = sdr_config['pfbParams']['appliedWindow']
+        pfbOverlap = sdr_config['pfbParams'].get('overlap', False)
     else:
         nTaps = None
         appliedWindow = sdr_config['fftParams']['appliedWindow']
+        pfbOverlap = False
 
 
-    return {'centreFrequency': centreFrequency,
+    params = {'centreFrequency': centreFrequency,
             'bandwidth': bandwidth,
             'nChannels': nChannels,
             'sdrDriver': sdrDriver,
@@ -56,9 +151,35 @@ def return_sdr_params(yaml_path):
             'obsCachePath': obsCachePath,
             'active': active,
             'nTaps': nTaps,
-            'appliedWindow': appliedWindow
+            'appliedWindow': appliedWindow,
+            'fftBackend': fftBackend,
+            'fftWorkers': fftWorkers,
+            'fftWisdomPath': fftWisdomPath,
+            'windowCachePath': windowCachePath,
+            'precision': precision,
+            'accumulatorPrecision': accumulatorPrecision,
+            'spectralKurtosis': spectralKurtosis,
+            'skThreshold': skThreshold,
+            'clipLevel': clipLevel,
+            'madThreshold': madThreshold,
+            'minIntegrationFraction': minIntegrationFraction,
+            'gainSearch': gainSearch,
+            'chunkFrames': chunkFrames,
+            'nBuffers': nBuffers,
+            'nWorkers': nWorkers,
+            'cacheFlushInterval': cacheFlushInterval,
+            'pfbOverlap': pfbOverlap,
+            'simParams': simParams
             }
 
+    # Use the gains found by the prerun gain search, if they are current
+    if gainSearch['active']:
+        gain_settings = load_gain_settings(params)
+        if gain_settings is not None:
+            params['sdrRFGR'] = gain_settings['sdrRFGR']
+            params['sdrIFGR'] = gain_settings['sdrIFGR']
+    return params
+
 def return_aux_sdr_params(yaml_path):
     """
     Returns the SDR parameters from the .yaml file 
@@ -89,6 +210,13 @@ def return_aux_sdr_params(yaml_path):
     delay = sdr_config['delay']
     if not isinstance(sdrGain, int) or not isinstance(sdrGain, float):
         sdrGain = None
+    fftBackend = sdr_config.get('fftBackend', 'numpy')
+    fftWorkers = sdr_config.get('fftWorkers', None)
+    fftWisdomPath = sdr_config.get('fftWisdomPath', None)
+    windowCachePath = sdr_config.get('windowCachePath', None)
+    precision = sdr_config.get('precision', 'single')
+    accumulatorPrecision = sdr_config.get('accumulatorPrecision', 'double')
+    simParams = sdr_config.get('simParams', None) or {}
 
     if spectrometerMode == 'pfb':
         nTaps = sdr_config['pfbParams']['nTaps']
@@ -114,7 +242,14 @@ def return_aux_sdr_params(yaml_path):
             'obsCachePath': obsCachePath,
             'active': active,
             'nTaps': nTaps,
-            'appliedWindow': appliedWindow
+            'appliedWindow': appliedWindow,
+            'fftBackend': fftBackend,
+            'fftWorkers': fftWorkers,
+            'fftWisdomPath': fftWisdomPath,
+            'windowCachePath': windowCachePath,
+            'precision': precision,
+            'accumulatorPrecision': accumulatorPrecision,
+            'simParams': simParams
             }
 
 def return_arduino_params(yaml_path):
@@ -149,6 +284,7 @@ def return_arduino_params(yaml_path):
     switchSourceTargets = obs_config['arduino']['switches']['switchSourceTargets']
     dickeSwitchCycle = obs_config['arduino']['switches']['dickeSwitchCycle']
     DickeSwitchCycleLength = obs_config['arduino']['switches']['DickeSwitchCycleLength']
+    switchSettleTime = obs_config['arduino']['switches'].get('settleTime', 0.)
 
     return {'baudRate': baud_rate,
             'comPort': com_port,
@@ -162,7 +298,8 @@ def return_arduino_params(yaml_path):
             'active': active,
             'switchSourceTargets': switchSourceTargets,
             'dickeSwitchCycle': dickeSwitchCycle,
-            'DickeSwitchCycleLength': DickeSwitchCycleLength}
+            'DickeSwitchCycleLength': DickeSwitchCycleLength,
+            'switchSettleTime': switchSettleTime}
     
 def return_cache_params(yaml_path):
     with open(yaml_path,'r') as f:
@@ -170,6 +307,8 @@ def return_cache_params(yaml_path):
         pass
     final_data_destination = obs_config['observationParams']['dataDirectory']
     cached_path = obs_config['observationParams']['obsCachePath']
+    storageProfile = obs_config['observationParams'].get('storageProfile',
+                                                         'none')
 
     if obs_config['observationParams']['customName'] is None:
         currentTime = datetime.datetime.now()
@@ -180,4 +319,5 @@ def return_cache_params(yaml_path):
     return {'final_data_destination': final_data_destination,
             'cached_path': cached_path,
             'filename': filename,
+            'storageProfile': storageProfile,
             'obs_config': obs_config}
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""
+Registry of FFT backends used by the channelisers.
+
+Each backend factory returns a function with the signature `fft(x, axis=-1)`.
+The backend is selected with `sdr.fftBackend` in `obs_config.yaml`; the
+optional backends fall back to `numpy` if their package is not installed.
+"""
+import os
+import pickle
+import threading
+import numpy as np
+
+
+def _numpy_backend(workers=None, wisdomPath=None):
+    """
+    Plain `numpy.fft`. Single-threaded, no planning. numpy < 2 computes in 
+    double precision, so the result is cast back to single precision for 
+    single precision input.
+    """
+    def fft(x, axis=-1):
+        out = np.fft.fft(x, axis=axis)
+        return out.astype(np.result_type(x.dtype, np.complex64), copy=False)
+    return fft
+
+
+def _scipy_backend(workers=None, wisdomPath=None):
+    """
+    `scipy.fft` (pocketfft). Multi-threaded over the non-transformed axis
+    when `workers` is set (-1 uses all cores), and keeps single precision
+    input in single precision. Twiddle factors are cached internally by
+    scipy between calls of the same length.
+    """
+    import scipy.fft
+    def fft(x, axis=-1):
+        return scipy.fft.fft(x, axis=axis, workers=workers)
+    return fft
+
+
+def _pyfftw_backend(workers=None, wisdomPath=None):
+    """
+    FFTW via `pyfftw`, with the interface plan cache enabled and FFTW wisdom
+    loaded from (and saved back to) `wisdomPath`, so plans are not
+    recomputed at the start of each observation block. The returned function
+    may be called from several channeliser threads; the record of planned
+    shapes and the wisdom file are updated under a lock.
+    """
+    import pyfftw
+    import pyfftw.interfaces.scipy_fft
+
+    if workers is None:
+        workers = 1
+    elif workers < 0:
+        # As in scipy.fft: -1 is every core, -2 all but one, ...
+        workers = max(1, os.cpu_count() + 1 + workers)
+
+    if wisdomPath is not None and os.path.exists(wisdomPath):
+        with open(wisdomPath, 'rb') as f:
+            pyfftw.import_wisdom(pickle.load(f))
+
+    pyfftw.interfaces.cache.enable()
+    pyfftw.interfaces.cache.set_keepalive_time(3600)
+    planned_shapes = set()
+    lock = threading.Lock()
+
+    def fft(x, axis=-1):
+        out = pyfftw.interfaces.scipy_fft.fft(x, axis=axis, workers=workers,
+                                              planner_effort='FFTW_MEASURE')
+
+        # Persist wisdom the first time a new transform shape is planned
+        key = (x.shape, x.dtype.str, axis)
+        if wisdomPath is not None and key not in planned_shapes:
+            with lock:
+                if key not in planned_shapes:
+                    planned_shapes.add(key)
+                    with open(wisdomPath, 'wb') as f:
+                        pickle.dump(pyfftw.export_wisdom(), f)
+        return out
+    return fft
+
+
+backend_dict = {
+                'numpy':    _numpy_backend,
+                'scipy':    _scipy_backend,
+                'pyfftw':   _pyfftw_backend
+               }
+
+
+def get_fft_backend(fftBackend='numpy', fftWorkers=None, fftWisdomPath=None):
+    """
+    Return an FFT function for the requested backend.
+
+    Parameters:
+        fftBackend (str):
+            Name of the backend. See `fft_backend.backend_dict` for options.
+        fftWorkers (int):
+            Number of threads to use for the `scipy` and `pyfftw` backends.
+            Negative values count back from the number of CPU cores, as in
+            `scipy.fft`.
+        fftWisdomPath (str):
+            Path of a file in which to persist FFTW wisdom (`pyfftw` only).
+
+    Returns:
+        fft (callable):
+            Function with signature `fft(x, axis=-1)`.
+    """
+    if fftBackend is None:
+        fftBackend = 'numpy'
+    try:
+        return backend_dict[fftBackend](workers=fftWorkers,
+                                        wisdomPath=fftWisdomPath)
+    except ImportError:
+        print(f'FFT backend {fftBackend} not available, using numpy')
+        return _numpy_backend()
@@ -0,0 +1,159 @@
+"""
+Preallocated frame buffers for reading IQ samples from SoapySDR.
+"""
+import queue
+import numpy as np
+
+
+class FrameRing:
+    """
+    Ring of preallocated `(n_frames, n_spec_points)` frame-set blocks.
+
+    `SoapySDR.Device.readStream` can write straight into a row of a block,
+    since each row is a contiguous view, so no per-frame copy, zeroing or
+    per-integration allocation is needed.
+
+    The ring is shared between a capture thread and channeliser workers:
+    the producer takes a free block with `acquire()`, fills it and hands it
+    over with `publish()`, and the consumer takes it with `get_filled()` and
+    returns it to the pool with `release()`. The number of filled blocks
+    waiting is bounded by the number of blocks in the ring.
+
+    Parameters:
+        n_blocks (int):
+            Number of frame-set blocks in the ring.
+        n_frames (int):
+            Number of frames (rows) in each block.
+        n_spec_points (int):
+            Number of samples in each frame.
+        dtype (dtype):
+            Sample data type. `np.complex64` matches the `SOAPY_SDR_CF32`
+            stream format.
+    """
+    def __init__(self, n_blocks, n_frames, n_spec_points, dtype=np.complex64):
+        self.n_blocks = n_blocks
+        self.n_frames = n_frames
+        self.n_spec_points = n_spec_points
+        self.blocks = np.zeros((n_blocks, n_frames, n_spec_points), dtype=dtype)
+        self.status = np.zeros((n_blocks, n_frames), dtype=int)
+
+        # Producer/consumer pool of block indices
+        self.free = queue.Queue()
+        for index in range(n_blocks):
+            self.free.put(index)
+        self.filled = queue.Queue()
+
+    def acquire(self, timeout=None):
+        """
+        Take a free block from the pool for filling.
+
+        Parameters:
+            timeout (float):
+                How long to wait for a free block, in seconds. `0` returns
+                immediately.
+
+        Returns:
+            index (int):
+                Index of the block, or `None` if no block became free.
+        """
+        try:
+            return self.free.get(timeout=timeout) if timeout \
+                   else self.free.get_nowait()
+        except queue.Empty:
+            return None
+
+    def publish(self, index, info=None):
+        """
+        Hand a filled block to the consumers, along with any metadata.
+        An `index` of `None` with `info` passes a marker without data, and
+        with no `info` signals the end of the stream.
+        """
+        self.filled.put((index, info) if index is not None or info is not None
+                        else None)
+
+    def get_filled(self):
+        """
+        Wait for the next filled block.
+
+        Returns:
+            item (tuple):
+                `(index, info)` for the block, or `None` at the end of the
+                stream.
+        """
+        return self.filled.get()
+
+    def release(self, index):
+        """
+        Return a block to the pool once it has been channelised.
+        """
+        self.free.put(index)
+
+    def read_frame(self, sdr, rxStream, frame_set, daq_status, i,
+                   timeoutUs=int(100e3), clock=None):
+        """
+        Read one frame from the stream directly into row `i` of a block,
+        with `read_row()`. The row's `daq_status` is `n_spec_points` if the
+        row was filled, or the error code that stopped it.
+
+        Any part of the row not filled is zeroed, so stale samples from a
+        previous pass around the ring are never channelised.
+
+        Returns:
+            n_received (int):
+                Number of samples received into the row.
+            span (tuple):
+                Time span of the samples, from `clock`, or `None`.
+        """
+        row = frame_set[i]
+        status, n_received, span = read_row(sdr, rxStream, row, timeoutUs,
+                                            clock)
+        daq_status[i] = status
+        if status != self.n_spec_points:
+            row[max(n_received, 0):] = 0.
+        return n_received, span
+
+
+def read_row(sdr, rxStream, row, timeoutUs=int(100e3), clock=None):
+    """
+    Fill a frame from the stream. `readStream` may return fewer samples than
+    requested (the SDRplay driver returns its USB packets as they arrive),
+    so it is called again with an offset into the row until the row is full
+    or it returns an error. An overflow drops samples, and a timeout or
+    stream error leaves the row unfinished, so in either case the row is not
+    a continuous frame.
+
+    Parameters:
+        sdr (SoapySDR.Device):
+            The SDR device.
+        rxStream (SoapySDR.Stream):
+            An active receive stream.
+        row (array_like):
+            Contiguous frame to fill.
+        timeoutUs (int):
+            `readStream` timeout, in microseconds.
+        clock (stream_clock.StreamClock):
+            Clock to timestamp the samples with, if given.
+
+    Returns:
+        status (int):
+            `len(row)` if the row was filled, or the `readStream` error code
+            that stopped it.
+        n_received (int):
+            Number of samples received into the row.
+        span (tuple):
+            `(t_start, t_stop)` of the samples received, or `None`.
+    """
+    n_spec_points = len(row)
+    filled = 0
+    span = None
+    while filled < n_spec_points:
+        sr = sdr.readStream(rxStream, [row[filled:]], n_spec_points - filled,
+                            timeoutUs=timeoutUs)
+        ret = int(sr.ret)
+        if ret <= 0:
+            return (ret if ret < 0 else filled), filled, span
+        if clock is not None:
+            stamp = clock.stamp(sr)
+            span = stamp if span is None else (span[0], stamp[1])
+        filled += ret
+    return filled, filled, span
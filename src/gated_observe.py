@@ -0,0 +1,68 @@
+"""
+Switch-gated observing: the SDR acquisition and the Arduino switching and
+temperature monitoring run in one process, sharing a `capture.SwitchGate`.
+
+Integrations are closed whenever the switches move and samples read during
+the transition are discarded, so every spectrum lies wholly within one
+switch state. Each is labelled with its state (`sdr_states`) and its exact
+sample count (`samples_channelised`), instead of being re-associated with
+the switch states by timestamp in `read_obs.py`.
+
+Replaces `sdr_control.py` and `arduino_control.py` in `block_observe.sh`;
+the cache files written are the same, plus `sdr_states`.
+"""
+import threading
+import argparse
+import numpy as np
+import arduino_control
+import capture
+import sdr_control
+import config
+import prerun_config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Switch-gated SDR and "
+                                                 "Arduino observation")
+    parser.add_argument('--yaml', type=str,
+                        default='/rhino-daq/obs_config.yaml',
+                        help='Config .yaml filepath')
+    parser.add_argument('--prerun',
+                        action='store_true',
+                        help='Runs the Script in Prerun Mode')
+    args = parser.parse_args()
+    yaml_path = args.yaml
+
+    if args.prerun:
+        sdr_params = prerun_config.return_sdr_params(yaml_path)
+        arduino_params = prerun_config.return_arduino_params(yaml_path)
+    else:
+        sdr_params = config.return_sdr_params(yaml_path)
+        arduino_params = config.return_arduino_params(yaml_path)
+
+    if not (sdr_params['active'] and arduino_params['active']
+            and arduino_params['switch_status']
+            and arduino_params['temp_monitoring_status']):
+        print('gated_observe.py needs the SDR, switches and temperature '
+              'monitoring to be active')
+        return
+
+    obsCachePath = arduino_params['obsCachePath']
+    runLength = arduino_params['runLength']
+    gate = capture.SwitchGate(settleTime=arduino_params['switchSettleTime'])
+
+    # The capture thread discards samples until the first switch has settled
+    sdr_thread = threading.Thread(target=sdr_control.cache_observation,
+                                  args=(sdr_params, runLength),
+                                  kwargs={'switchGate': gate},
+                                  name='sdr')
+    sdr_thread.start()
+    arduino_control.cache_observation(arduino_params, switch_gate=gate)
+    sdr_thread.join()
+    np.save(f'{obsCachePath}/new_data_bool.npy', True)
+
+    print('Gated SDR and Arduino Data Cached')
+
+
+if __name__ == "__main__":
+    main()
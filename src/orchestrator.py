@@ -0,0 +1,271 @@
+"""
+Long-lived observing program, replacing the separate Python interpreters
+launched for every block by `observe.sh`/`block_observe.sh`.
+
+The SDR, aux SDR and Arduino subsystems of each block run concurrently in
+threads of one process, and the devices are opened once and kept open
+across blocks (see `sdr_session.py`). Each block caches its data in its own subfolder of
+`obsCachePath`. Once a block's acquisition finishes, that subfolder is
+converted to an observation file (`process_cache.process_block`) in a
+separate process, while the next block is already acquiring. The gap
+between blocks is then only the time needed to restart the streams.
+
+The .yaml is re-read at the start of every block, so changes to the
+observation settings take effect from the next block.
+"""
+import os
+import time
+import shutil
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+import arduino_funcs
+import arduino_control
+import aux_sdr_control
+import capture
+import sdr_control
+from sdr_session import SDRSession
+import process_cache
+import config
+import prerun_config
+
+
+def load_params(yaml_path, prerun=False):
+    """
+    Load the parameters of every subsystem for one block.
+    """
+    params_module = prerun_config if prerun else config
+    return {'sdr': params_module.return_sdr_params(yaml_path),
+            'aux_sdr': params_module.return_aux_sdr_params(yaml_path),
+            'arduino': params_module.return_arduino_params(yaml_path),
+            'cache': params_module.return_cache_params(yaml_path)}
+
+
+def process_block_cache(obs_config, block_dir, final_data_destination,
+                        filename, storageProfile, remove_cache=True):
+    """
+    Convert a block's cache folder into an observation file and, if
+    `remove_cache`, delete the folder afterwards. Run in a separate process,
+    so the HDF5 compression does not compete with acquisition for the GIL.
+    """
+    process_cache.process_block(obs_config, block_dir, final_data_destination,
+                                filename, storageProfile)
+    if remove_cache:
+        shutil.rmtree(block_dir)
+
+
+class Orchestrator:
+    """
+    Runs observation blocks back to back in one long-lived process.
+
+    Parameters:
+        yaml_path (str):
+            Config .yaml filepath.
+        gated (bool):
+            Acquire spectra gated by the switch state (see
+            `gated_observe.py`) when the SDR, switches and temperature
+            monitoring are all active.
+        keep_cache (bool):
+            Keep each block's cache folder after it has been processed.
+    """
+    def __init__(self, yaml_path, gated=False, keep_cache=False):
+        self.yaml_path = yaml_path
+        self.gated = gated
+        self.keep_cache = keep_cache
+        self.devices = {}
+        self.processing = None
+        self.n_blocks = 0
+        self.block_index = 0
+        self.mp_context = multiprocessing.get_context('spawn')
+
+    def _device(self, name, params):
+        """
+        Return the open device for a subsystem, opening it on first use.
+        """
+        if name not in self.devices:
+            if name == 'arduino':
+                self.devices[name] = arduino_funcs.Arduino(
+                                n__temp_sens=params['n_temp_sens'],
+                                com_port=params['comPort'],
+                                baud_rate=params['baudRate'],
+                                switch_dictionary=params['switchDictionary'])
+            else:
+                self.devices[name] = SDRSession(params['sdrDriver'],
+                                                params['sdrLabel'],
+                                                params['simParams']).open()
+        return self.devices[name]
+
+    def _run_sdr(self, params, gate):
+        session = self._device('sdr', params)
+        # The delay lets a newly configured SDR settle; it is not needed if
+        # the session already has these settings from the previous block
+        unchanged = not session.pending(params['bandwidth'],
+                                        params['centreFrequency'],
+                                        params['sdrGain'], params['sdrRFGR'],
+                                        params['sdrIFGR'])
+        delay = 0 if gate is not None or unchanged else params['delay']
+        time.sleep(delay)
+        sdr_control.cache_observation(params, params['runLength'] - delay,
+                                      switchGate=gate, session=session)
+
+    def tune_gains(self):
+        """
+        Run the SDR gain search (`sdr_control.tune_gains()`) on the open 
+        session, if the SDR and `sdr: gainSearch` are active, so the 
+        following blocks use the gains found.
+        """
+        sdr_params = config.return_sdr_params(self.yaml_path)
+        if sdr_params['active'] and sdr_params['gainSearch']['active']:
+            sdr_control.tune_gains(sdr_params,
+                                   session=self._device('sdr', sdr_params))
+
+    def _new_block_dir(self, cached_path):
+        """
+        Create the cache folder of the next block. Folders left by an 
+        earlier run, which may still hold unprocessed data, are skipped.
+        """
+        while True:
+            block_dir = os.path.join(cached_path, 
+                                     f'block_{self.block_index:04d}')
+            self.block_index += 1
+            if not os.path.exists(block_dir):
+                os.makedirs(block_dir)
+                return block_dir
+
+    def run_block(self, prerun=False):
+        """
+        Acquire one observation block, then start converting its cache in
+        the background.
+
+        Parameters:
+            prerun (bool):
+                Run a prerun block, with the `prerun_config` parameters.
+        """
+        params = load_params(self.yaml_path, prerun)
+        block_dir = self._new_block_dir(params['cache']['cached_path'])
+        for key in ('sdr', 'aux_sdr', 'arduino'):
+            params[key]['obsCachePath'] = block_dir
+
+        sdr_params = params['sdr']
+        aux_params = params['aux_sdr']
+        arduino_params = params['arduino']
+        gate = None
+        if self.gated and sdr_params['active'] and arduino_params['active'] \
+           and arduino_params['switch_status'] \
+           and arduino_params['temp_monitoring_status']:
+            gate = capture.SwitchGate(arduino_params['switchSettleTime'])
+
+        # Open the devices here, so the threads never race to open them
+        threads = []
+        if sdr_params['active']:
+            self._device('sdr', sdr_params)
+            threads.append(threading.Thread(target=self._run_sdr,
+                                            args=(sdr_params, gate),
+                                            name='sdr'))
+        if aux_params['active']:
+            threads.append(threading.Thread(
+                            target=aux_sdr_control.cache_observation,
+                            args=(aux_params,
+                                  self._device('aux_sdr', aux_params)),
+                            name='aux_sdr'))
+        if arduino_params['active']:
+            threads.append(threading.Thread(
+                            target=arduino_control.cache_observation,
+                            args=(arduino_params,
+                                  self._device('arduino', arduino_params)),
+                            kwargs={'switch_gate': gate, 'close': False},
+                            name='arduino'))
+
+        print(f'|| orchestrator.py Block {self.n_blocks} '
+              f'({"prerun" if prerun else "observation"}) ||')
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        np.save(f'{block_dir}/new_data_bool.npy', True)
+        print('All obs programs completed.')
+
+        # Convert the cache while the next block is acquiring
+        self.wait_for_processing()
+        cache_params = params['cache']
+        self.processing = self.mp_context.Process(
+                                target=process_block_cache,
+                                args=(cache_params['obs_config'], block_dir,
+                                      cache_params['final_data_destination'],
+                                      cache_params['filename'],
+                                      cache_params['storageProfile'],
+                                      not self.keep_cache),
+                                name=f'process_cache-{self.n_blocks}')
+        self.processing.start()
+        self.n_blocks += 1
+
+    def wait_for_processing(self):
+        """
+        Wait for the previous block's cache to finish being processed.
+        """
+        if self.processing is not None:
+            self.processing.join()
+            if self.processing.exitcode != 0:
+                print(f'{self.processing.name} failed with exit code '
+                      f'{self.processing.exitcode}')
+            self.processing = None
+
+    def close(self):
+        """
+        Wait for any processing to finish, and close the devices.
+        """
+        self.wait_for_processing()
+        for device in self.devices.values():
+            device.close()
+        self.devices = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RHINO observing "
+                                                 "orchestrator")
+    parser.add_argument('--yaml', type=str,
+                        default='/rhino-daq/obs_config.yaml',
+                        help='Config .yaml filepath')
+    parser.add_argument('--prerun',
+                        action='store_true',
+                        help='Run a prerun block before observing')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='Stop starting new blocks after this many '
+                             'seconds (default: run until interrupted)')
+    parser.add_argument('--n-blocks', type=int, default=None,
+                        help='Number of observation blocks to run')
+    parser.add_argument('--gated',
+                        action='store_true',
+                        help='Gate the SDR integrations by switch state')
+    parser.add_argument('--keep-cache',
+                        action='store_true',
+                        help='Keep the per-block cache folders')
+    args = parser.parse_args()
+
+    t_end = np.inf if args.duration is None else time.time() + args.duration
+    n_blocks = np.inf if args.n_blocks is None else args.n_blocks
+
+    orchestrator = Orchestrator(args.yaml, gated=args.gated,
+                                keep_cache=args.keep_cache)
+    try:
+        if args.prerun:
+            # A failed search leaves no gain file, so the blocks use the 
+            # sdrRFGR/sdrIFGR from the .yaml
+            try:
+                orchestrator.tune_gains()
+            except Exception as e:
+                print(f'Gain search failed: {e}')
+            orchestrator.run_block(prerun=True)
+            print('||Pre Run Block Complete||')
+        n_observed = 0
+        while time.time() < t_end and n_observed < n_blocks:
+            orchestrator.run_block()
+            n_observed += 1
+            print('Observation Block Complete')
+    finally:
+        orchestrator.close()
+
+
+if __name__ == "__main__":
+    main()
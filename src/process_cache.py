@@ -1,6 +1,7 @@
 """
 Code to proces the numpy arrays from obsrvations and store in hd5f files
 """
+import os
 import numpy as np
 import h5py
 import yaml
@@ -10,6 +11,14 @@ import pickle
 from h5py import string_dtype
 import prerun_config
 import config
+import storage
+import adc_stats
+
+# Per-integration stream accounting and ADC statistics saved by
+# aux_sdr_control.py
+AUX_STREAM_STATS = ['samples_received', 'samples_expected', 'n_overflows',
+                    'n_timeouts', 'capture_time', 'time_start', 'time_stop',
+                    *adc_stats.STAT_KEYS]
 
 
 def save_dict_to_group(group: h5py.Group, data: dict, pickle_fallback: bool = True):
@@ -77,38 +86,24 @@ def save_dict_to_group(group: h5py.Group, data: dict, pickle_fallback: bool = Tr
 
 
 
-def main():
-# Base of actual obs_config.yaml
-    parser = argparse.ArgumentParser(description="Dual SDR Observation (RTLSDR + SDRplay)")
-
-    # Add more arguments for lone-running
-    parser.add_argument('--yaml', type=str,
-                        default='/rhino-daq/obs_config.yaml',
-                        help='Config .yaml filepath')
-    
-    parser.add_argument('--prerun',
-                        action='store_true',
-                        help='Runs the Script in Prerun Mode')
-
-    args = parser.parse_args()
-
-    yaml_path = args.yaml
-
-    if args.prerun:
-        params = prerun_config.return_cache_params(yaml_path)
-    else:
-        params = config.return_cache_params(yaml_path)
-
-
-    with open(yaml_path,'r') as f:
-        obs_config = yaml.safe_load(f) # load the .yaml as a list to get settings
-        pass
-
-    final_data_destination = params['final_data_destination']
-    cached_path = params['cached_path']
-    filename = params['filename']
-
-
+def process_block(obs_config, cached_path, final_data_destination, filename,
+                  storageProfile='none'):
+    """
+    Convert the data cached during an observation block into an `.hdf5` 
+    observation data file, if it has not been processed already.
+
+    Parameters:
+        obs_config (dict):
+            The loaded `obs_config.yaml`.
+        cached_path (str):
+            Cache folder of the block.
+        final_data_destination (str):
+            Directory to write the observation file to.
+        filename (str):
+            Name of the observation file, without the `.hdf5` extension.
+        storageProfile (str):
+            HDF5 storage profile, see `storage.py`.
+    """
     data_update_status = np.load(f'{cached_path}/new_data_bool.npy')
     # True if data has not been processed yet
     if not data_update_status:
@@ -123,20 +118,31 @@ def main():
 
         save_dict_to_group(config_group, obs_config)
 
-        if obs_config['sdr']['active']: # set up sdr group
+        if obs_config['sdr']['active'] \
+           and os.path.exists(f'{cached_path}/sdr_cache.hdf5'):
+            # streamed cache file; copied dataset-by-dataset in slabs, 
+            # without reading the whole waterfall into memory
+            with h5py.File(f'{cached_path}/sdr_cache.hdf5', 'r') as cache:
+                for key in cache:
+                    storage.copy_dataset(cache[key], sdr_group, key,
+                                         storageProfile)
+        elif obs_config['sdr']['active']: # set up sdr group
             sdr_waterfall = np.load(f'{cached_path}/sdr_waterfall.npy')
             sdr_freqs = np.load(f'{cached_path}/sdr_freqs.npy')
             sdr_times = np.load(f'{cached_path}/sdr_times.npy')
             max_i_adc = np.load(f'{cached_path}/max_i_adc.npy')
             max_q_adc = np.load(f'{cached_path}/max_q_adc.npy')
 
-            sdr_group.create_dataset('sdr_waterfall', data=sdr_waterfall, dtype=sdr_waterfall.dtype)
-            sdr_group.create_dataset('sdr_freqs', data=sdr_freqs, dtype=sdr_freqs.dtype)
-            sdr_group.create_dataset('sdr_times', data=sdr_times, dtype=sdr_times.dtype)
-            sdr_group.create_dataset('max_i_adc', data=max_i_adc,
-                                     dtype=max_i_adc.dtype)
-            sdr_group.create_dataset('max_q_adc',data=max_q_adc,
-                                     dtype=max_q_adc.dtype)
+            storage.create_dataset(sdr_group, 'sdr_waterfall',
+                                   sdr_waterfall, storageProfile)
+            storage.create_dataset(sdr_group, 'sdr_freqs',
+                                   sdr_freqs, storageProfile)
+            storage.create_dataset(sdr_group, 'sdr_times',
+                                   sdr_times, storageProfile)
+            storage.create_dataset(sdr_group, 'max_i_adc',
+                                   max_i_adc, storageProfile)
+            storage.create_dataset(sdr_group, 'max_q_adc',
+                                   max_q_adc, storageProfile)
             pass
         else: # else create empty data sets
             sdr_group.create_dataset('sdr_waterfall', dtype="f")
@@ -148,17 +154,19 @@ def main():
             aux_sdr_freqs = np.load(f'{cached_path}/aux_sdr_freqs.npy')
             aux_sdr_times = np.load(f'{cached_path}/aux_sdr_times.npy')
             aux_max_adc = np.load(f'{cached_path}/aux_max_adc.npy')
-            aux_sdr_group.create_dataset('aux_sdr_waterfall',
-                                         data=aux_sdr_waterfall,
-                                         dtype=aux_sdr_waterfall.dtype)
-            aux_sdr_group.create_dataset('aux_sdr_freqs',
-                                         data=aux_sdr_freqs,
-                                         dtype=aux_sdr_freqs.dtype)
-            aux_sdr_group.create_dataset('aux_sdr_times',
-                                         data=aux_sdr_times,
-                                         dtype=aux_sdr_times.dtype)
-            aux_sdr_group.create_dataset('aux_max_adc', data=aux_max_adc,
-                                         dtype=aux_max_adc.dtype)
+            storage.create_dataset(aux_sdr_group, 'aux_sdr_waterfall',
+                                   aux_sdr_waterfall, storageProfile)
+            storage.create_dataset(aux_sdr_group, 'aux_sdr_freqs',
+                                   aux_sdr_freqs, storageProfile)
+            storage.create_dataset(aux_sdr_group, 'aux_sdr_times',
+                                   aux_sdr_times, storageProfile)
+            storage.create_dataset(aux_sdr_group, 'aux_max_adc',
+                                   aux_max_adc, storageProfile)
+            for key in AUX_STREAM_STATS:
+                if os.path.exists(f'{cached_path}/aux_{key}.npy'):
+                    storage.create_dataset(aux_sdr_group, f'aux_{key}',
+                                np.load(f'{cached_path}/aux_{key}.npy'),
+                                storageProfile)
         else: # else create empty data sets
             aux_sdr_group.create_dataset('aux_sdr_waterfall', dtype="f")
             aux_sdr_group.create_dataset('aux_sdr_freqs', dtype="f")
@@ -167,12 +175,10 @@ def main():
         if obs_config['arduino']['temperatureMonitoring']['active']:
             temperatures = np.load(f'{cached_path}/temperature_array.npy')
             temperature_times = np.load(f'{cached_path}/temperature_times.npy')
-            temperature_group.create_dataset('temperatures',
-                                             data=temperatures,
-                                             dtype=temperatures.dtype)
-            temperature_group.create_dataset('temperature_times',
-                                             data=temperature_times,
-                                             dtype=temperature_times.dtype)
+            storage.create_dataset(temperature_group, 'temperatures',
+                                   temperatures, storageProfile)
+            storage.create_dataset(temperature_group, 'temperature_times',
+                                   temperature_times, storageProfile)
         else:
             temperature_group.create_dataset('temperatures',
                                              dtype='f')
@@ -182,12 +188,10 @@ def main():
         if obs_config['arduino']['switches']['active']:
             swtich_states = np.load(f'{cached_path}/switch_states.npy')
             switch_times = np.load(f'{cached_path}/switch_times.npy')
-            switching_group.create_dataset('switch_states',
-                                           data=swtich_states,
-                                           dtype=swtich_states.dtype)
-            switching_group.create_dataset('switch_times',
-                                           data=switch_times,
-                                           dtype=switch_times.dtype)
+            storage.create_dataset(switching_group, 'switch_states',
+                                   swtich_states, storageProfile)
+            storage.create_dataset(switching_group, 'switch_times',
+                                   switch_times, storageProfile)
         else:
             switching_group.create_dataset('switch_states',
                                            dtype='f')
@@ -203,6 +207,43 @@ def main():
 
     print('Data Processed into hdf5.')
     pass
+
+
+def main():
+# Base of actual obs_config.yaml
+    parser = argparse.ArgumentParser(description="Dual SDR Observation (RTLSDR + SDRplay)")
+
+    # Add more arguments for lone-running
+    parser.add_argument('--yaml', type=str,
+                        default='/rhino-daq/obs_config.yaml',
+                        help='Config .yaml filepath')
+    
+    parser.add_argument('--prerun',
+                        action='store_true',
+                        help='Runs the Script in Prerun Mode')
+
+    args = parser.parse_args()
+
+    yaml_path = args.yaml
+
+    if args.prerun:
+        params = prerun_config.return_cache_params(yaml_path)
+    else:
+        params = config.return_cache_params(yaml_path)
+
+
+    with open(yaml_path,'r') as f:
+        obs_config = yaml.safe_load(f) # load the .yaml as a list to get settings
+        pass
+
+    final_data_destination = params['final_data_destination']
+    cached_path = params['cached_path']
+    filename = params['filename']
+    storageProfile = params['storageProfile']
+
+
+    process_block(obs_config, cached_path, final_data_destination, filename,
+                  storageProfile)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,6 +3,13 @@ import matplotlib.pyplot as plt
 import h5py
 import pickle
 
+# Rows (integrations) of the waterfall read at a time by the chunked 
+# reductions, which keep the memory used bounded for a lazy `ObsObj`
+CHUNK_ROWS = 256
+
+# Log-spaced bins of the histogram used by `chunked_quantile()`
+QUANTILE_BINS = 4096
+
 def load_dict_from_group(group: h5py.Group):
     """
     Load a dictionary from a group previously written with save_dict_to_group.
@@ -48,21 +55,179 @@ def load_dict_from_group(group: h5py.Group):
     return _load(group)
 
 
+def iter_row_chunks(data, chunk_rows=CHUNK_ROWS):
+    """
+    Iterate over blocks of `chunk_rows` rows of an array or HDF5 dataset, 
+    reading only one block at a time.
+    """
+    for i in range(0, data.shape[0], chunk_rows):
+        yield np.asarray(data[i:i + chunk_rows])
+
+
+def chunked_mean(data, chunk_rows=CHUNK_ROWS):
+    """
+    Mean along the first (time) axis of an array or HDF5 dataset, 
+    accumulated `chunk_rows` rows at a time.
+    """
+    total = np.zeros(data.shape[1:])
+    n_rows = 0
+    for block in iter_row_chunks(data, chunk_rows):
+        total += block.sum(axis=0, dtype=np.float64)
+        n_rows += block.shape[0]
+    return total / n_rows if n_rows else np.full(data.shape[1:], np.nan)
+
+
+def chunked_quantile(data, q, chunk_rows=CHUNK_ROWS, bins=QUANTILE_BINS):
+    """
+    Approximate quantiles of all the positive, finite values of an array or 
+    HDF5 dataset (e.g. a waterfall of powers), in two passes of 
+    `chunk_rows` rows: one for the range, and one to build a histogram with 
+    `bins` log-spaced bins, from which the quantiles are interpolated. The 
+    error is within one bin, a fraction `log(max/min)/bins` of the value.
+    
+    Parameters:
+        data (array_like):
+            Array or HDF5 dataset.
+        q (float or array_like):
+            Quantile(s), between 0 and 1.
+        chunk_rows (int):
+            Rows read at a time.
+        bins (int):
+            Number of histogram bins.
+    
+    Returns:
+        quantiles (float or array_like):
+            The quantile(s) of the values.
+    """
+    low, high = np.inf, -np.inf
+    for block in iter_row_chunks(data, chunk_rows):
+        values = block[(block > 0) & np.isfinite(block)]
+        if values.size:
+            low = min(low, values.min())
+            high = max(high, values.max())
+    if low > high: # no positive values
+        return np.full(np.shape(q), np.nan)[()]
+    edges = np.geomspace(low, high, bins + 1) if high > low \
+            else np.array([low, high])
+    counts = np.zeros(len(edges) - 1)
+    for block in iter_row_chunks(data, chunk_rows):
+        values = block[(block > 0) & np.isfinite(block)]
+        counts += np.histogram(values, edges)[0]
+    cdf = np.concatenate(([0.], np.cumsum(counts) / counts.sum()))
+    return np.interp(q, cdf, edges)
+
+
+def segment_bounds(starts, stops, t_min, t_max):
+    """
+    Index ranges `[lo, hi)` of the rows whose span lies wholly within each 
+    `[t_min, t_max]` window, i.e. `starts >= t_min` and `stops <= t_max`, 
+    found by binary search. `starts` and `stops` must be ascending; 
+    `t_max` may be `inf`. Empty ranges have `hi == lo`.
+    """
+    lo = np.searchsorted(starts, t_min, 'left')
+    hi = np.searchsorted(stops, t_max, 'right')
+    return lo, np.maximum(hi, lo)
+
+
+def segment_means(data, lo, hi, weights=None):
+    """
+    Mean along the first axis of the rows `[lo, hi)` of each segment, NaN 
+    for empty segments. For a 1-D array with ordered, non-overlapping 
+    segments, all the sums come from one `np.add.reduceat`. Otherwise each 
+    segment is summed as a contiguous slice (which for rows of spectra is 
+    faster than `reduceat`, whose reduction along the first axis walks the 
+    array column by column), and read on its own from an HDF5 dataset.
+    
+    Parameters:
+        data (array_like):
+            Array or HDF5 dataset, with time along the first axis.
+        lo, hi (array_like):
+            Start and stop row of each segment, from `segment_bounds()`.
+        weights (array_like):
+            Optional weight of each row, e.g. its `samples_channelised`. 
+            Segments with zero total weight are NaN.
+    
+    Returns:
+        means (array_like):
+            Mean of each segment, of shape `(n_segments, *data.shape[1:])`.
+    """
+    counts = hi - lo
+    means = np.full((len(lo),) + data.shape[1:], np.nan)
+    full = np.flatnonzero(counts > 0)
+    if full.size == 0:
+        return means
+    if isinstance(data, np.ndarray) and data.ndim == 1 \
+       and np.all(lo[1:] >= hi[:-1]):
+        # Interleaved (lo, hi) bounds; the sum from each lo to the next 
+        # bound is the segment. Bounds at the end are left out, so the last 
+        # segment sums to the end.
+        bounds = np.stack((lo, hi), axis=1).ravel()
+        bounds = bounds[bounds < data.shape[0]]
+        if weights is None:
+            means[full] = np.add.reduceat(data, bounds)[2 * full] \
+                          / counts[full]
+        else:
+            total = np.add.reduceat(weights, bounds)[2 * full]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                means[full] = np.add.reduceat(data * weights, 
+                                              bounds)[2 * full] / total
+    else:
+        for i in full:
+            rows = data[lo[i]:hi[i]]
+            if weights is None:
+                means[i] = np.mean(rows, axis=0)
+            elif weights[lo[i]:hi[i]].sum() > 0:
+                means[i] = np.average(rows, axis=0, 
+                                      weights=weights[lo[i]:hi[i]])
+    return means
+
+
 class ObsObj: # object for working with 
     def __init__(self,
                  filepath : str,
                  target='ant',
                  switch_buffer = 1,
-                 noise_diode_ENR_dB = 9.6):
+                 noise_diode_ENR_dB = 9.6,
+                 lazy = False):
         """
         filepath: hd5f filepath 
+        lazy: keep the file open and leave `sdr_waterfall` (and the SK 
+              arrays) as HDF5 datasets, read on demand, e.g. with 
+              `waterfall()`; the means and quantiles of the waterfall are 
+              then computed chunkwise. Call `close()` (or use `with`) when 
+              done.
         """
+        self.lazy = lazy
+        self._file = None
         
         # read in
-        with h5py.File(filepath, 'r') as f:
-            self.sdr_waterfall = f['sdr']['sdr_waterfall'][()]
+        f = h5py.File(filepath, 'r')
+        try:
+            if lazy:
+                self._file = f
+                self.sdr_waterfall = f['sdr']['sdr_waterfall']
+            else:
+                self.sdr_waterfall = f['sdr']['sdr_waterfall'][()]
             self.sdr_times = f['sdr']['sdr_times'][()]
+            if 'sdr_time_start' in f['sdr']: # span of each integration
+                self.sdr_time_start = f['sdr']['sdr_time_start'][()]
+                self.sdr_time_stop = f['sdr']['sdr_time_stop'][()]
+            else:
+                self.sdr_time_start = self.sdr_times.copy()
+                self.sdr_time_stop = self.sdr_times.copy()
             self.sdr_freqs = f['sdr']['sdr_freqs'][()]
+            if 'sdr_sk_flags' in f['sdr']: # spectral kurtosis RFI flags
+                self.sdr_sk = f['sdr']['sdr_sk']
+                self.sdr_sk_flags = f['sdr']['sdr_sk_flags']
+                if not lazy:
+                    self.sdr_sk = self.sdr_sk[()]
+                    self.sdr_sk_flags = self.sdr_sk_flags[()]
+            else:
+                self.sdr_sk = self.sdr_sk_flags = None
+            if 'samples_channelised' in f['sdr']: # samples in each spectrum
+                self.sdr_samples = f['sdr']['samples_channelised'][()]
+            else:
+                self.sdr_samples = None
             self.switch_states = f['switches']['switch_states'][()]
             self.switch_times = f['switches']['switch_times'][()]
             self.temperatures = f['temperatures']['temperatures'][()] 
@@ -72,7 +237,11 @@ class ObsObj: # object for working with
                 self.obs_config = load_dict_from_group(config_group)
             except:
                 print('obs_config not accessible')
-            pass
+        except BaseException:
+            f.close()
+            raise
+        if not lazy:
+            f.close()
         
         # flag for temperature errors
         mask = ~np.isin(self.temperatures, -273)
@@ -87,6 +256,57 @@ class ObsObj: # object for working with
         self.processed_spectra_bool = False
         pass
     
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        """
+        Close the file kept open in lazy mode.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def waterfall(self, t_min=None, t_max=None, f_min=None, f_max=None):
+        """
+        The part of the waterfall with integration times (`sdr_times`, as 
+        currently zeroed) in `[t_min, t_max]` and channel frequencies (in 
+        the units of `sdr_freqs`) in `[f_min, f_max]`. Only that part is 
+        read from the file in lazy mode. Limits left as `None` are open.
+        """
+        rows = self._span(self.sdr_times, t_min, t_max)
+        cols = self._span(self.sdr_freqs, f_min, f_max)
+        return np.asarray(self.sdr_waterfall[rows, cols])
+    
+    @staticmethod
+    def _span(values, v_min, v_max):
+        # Slice of the (ascending) values within [v_min, v_max]
+        start = 0 if v_min is None else np.searchsorted(values, v_min, 'left')
+        stop = len(values) if v_max is None \
+               else np.searchsorted(values, v_max, 'right')
+        return slice(int(start), int(stop))
+    
+    def mean_spectrum(self):
+        """
+        Time-averaged spectrum of the whole waterfall (chunkwise in lazy 
+        mode).
+        """
+        if self.lazy:
+            return chunked_mean(self.sdr_waterfall)
+        return np.mean(self.sdr_waterfall, axis=0)
+    
+    def waterfall_quantile(self, q):
+        """
+        Quantile(s) of all the waterfall values (approximate, from 
+        `chunked_quantile()`, in lazy mode).
+        """
+        if self.lazy:
+            return chunked_quantile(self.sdr_waterfall, q)
+        return np.quantile(self.sdr_waterfall, q)
+    
     def zero_times(self, zero_to_sdr=True):
         if zero_to_sdr:
             t0 = self.sdr_times[0]
@@ -94,14 +314,20 @@ class ObsObj: # object for working with
             t0 = self.switch_times[0]
 
         self.sdr_times -= t0
+        self.sdr_time_start -= t0
+        self.sdr_time_stop -= t0
         self.temperature_times -= t0
         self.switch_times -= t0
 
-    def plot_all(self):
-        plt.imshow(10*np.log10(self.sdr_waterfall), aspect='auto', cmap='jet')
+    def plot_all(self, max_rows=2048):
+        # at most max_rows integrations are drawn (every n-th, if lazy)
+        step = max(1, -(-self.sdr_waterfall.shape[0] // max_rows)) \
+               if self.lazy else 1
+        plt.imshow(10*np.log10(self.sdr_waterfall[::step]), aspect='auto', 
+                   cmap='jet')
         plt.show()
 
-        plt.plot(np.mean(self.sdr_waterfall, axis=0))
+        plt.plot(self.mean_spectrum())
         plt.yscale('log')
         plt.show()
 
@@ -113,37 +339,40 @@ class ObsObj: # object for working with
         plt.show() # make more elaborate
 
     def process_and_seperate_sources(self):
+        # Each switch event is a segment from its time + switch_buffer to 
+        # the next event's time - switch_buffer (open-ended for the last)
+        t_min = self.switch_times + self.switch_buffer
+        t_max = np.append(self.switch_times[1:] - self.switch_buffer, np.inf)
+
+        # Spectra whose samples lie wholly in the state; rows are put in 
+        # time order first if they are not already. Each spectrum is 
+        # weighted by the samples channelised in it, where recorded, so 
+        # short integrations (e.g. closed early at a switch) count less
+        starts, stops = self.sdr_time_start, self.sdr_time_stop
+        waterfall, times = self.sdr_waterfall, self.sdr_times
+        weights = self.sdr_samples
+        if np.any(np.diff(starts) < 0):
+            order = np.argsort(starts, kind='stable')
+            starts, stops, times = starts[order], stops[order], times[order]
+            waterfall = np.asarray(waterfall)[order]
+            if weights is not None:
+                weights = weights[order]
+        lo, hi = segment_bounds(starts, stops, t_min, t_max)
+        spectra = segment_means(waterfall, lo, hi, weights) # averaged spectra
+        times = segment_means(times, lo, hi, weights) # average spectra time
+
+        lo, hi = segment_bounds(self.temperature_times, 
+                                self.temperature_times, t_min, t_max)
+        avg_temps = segment_means(self.temperatures, lo, hi) # averaged temperature
+
+        # Decode each distinct state once, in order of first appearance
+        states, first, index = np.unique(self.switch_states, 
+                                         return_index=True, 
+                                         return_inverse=True)
         observation_spectra_dict = {}
-        for state in self.switch_states:
-            state = self.strip_string(state)
-            if state not in observation_spectra_dict:
-                observation_spectra_dict[state] = [] # creates a list for a given switch state
-
-        avg_temps = []
-        times  = []
-
-        for i, (state, time) in enumerate(zip(self.switch_states, self.switch_times)):
-            state = self.strip_string(state) # the switch_state_observed
-            t_min = time + self.switch_buffer
-            # get corresponding spectra
-            if i != len(self.switch_times)-1:
-                t_max = self.switch_times[i+1] - self.switch_buffer
-                spectra_mask = (self.sdr_times >= t_min) & (self.sdr_times <= t_max)
-                temperatures_mask = (self.temperature_times >= t_min) & (self.temperature_times <= t_max)
-            else:
-                spectra_mask = (self.sdr_times >= t_min)
-                temperatures_mask = (self.temperature_times >= t_min)
-            ##
-            spectra = self.sdr_waterfall[spectra_mask]
-            temperatures = self.temperatures[temperatures_mask] # mask temperatures and spectra
-
-            spectra = np.mean(spectra, axis=0)
-            observation_spectra_dict[state].append(spectra)     # averaged spectra
-            avg_temps.append(np.mean(temperatures, axis=0))     # averaged temperature
-            times.append(np.mean(self.sdr_times[spectra_mask])) # average spectra time
-        
-        avg_temps = np.array(avg_temps)
-        times = np.array(times)
+        for k in np.argsort(first):
+            observation_spectra_dict[self.decode_state(states[k])] = \
+                list(spectra[index.ravel() == k])
 
         self.observation_spectra_dict = observation_spectra_dict
         self.times = times
@@ -162,8 +391,7 @@ class ObsObj: # object for working with
             plt.plot(self.sdr_freqs / 1e6, mean_spectra, label=state)
         plt.ylabel(r'$P$ [arb.]')
         plt.xlabel(r'$\nu$ [MHz]')
-        lower_quantile = np.quantile(self.sdr_waterfall, 0.05)
-        upper_quantile = np.quantile(self.sdr_waterfall, 0.95)
+        lower_quantile, upper_quantile = self.waterfall_quantile([0.05, 0.95])
         plt.ylim(lower_quantile, upper_quantile)
         plt.legend()
         plt.show()
@@ -269,4 +497,9 @@ class ObsObj: # object for working with
         
 
     def strip_string(self, string):
-        return str(string)[2:-1]
\ No newline at end of file
+        return str(string)[2:-1]
+
+    @staticmethod
+    def decode_state(state):
+        # as strip_string, for states read as bytes or as str
+        return state.decode() if isinstance(state, bytes) else str(state)
\ No newline at end of file
@@ -1,12 +1,21 @@
 import time
 import numpy as np
 import os
-import SoapySDR
-from SoapySDR import * #SOAPY_SDR_ constants
+try:
+    from SoapySDR import * #SOAPY_SDR_ constants
+except ImportError: # no bindings; only the simulated SDR (`sim`) is usable
+    from sim_sdr import *
 from scipy.signal import windows
 import argparse
 import yaml
 import spectrum
+import fft_backend
+from frame_ring import FrameRing, read_row
+import capture
+import adc_stats
+from sdr_session import SDRSession
+from stream_clock import StreamClock
+from cache_writer import StreamingWriter
 import prerun_config
 import config
 
@@ -25,11 +34,34 @@ def measure_spectra(sampleIntegrationTime,
                     spectrometerMode,
                     nTaps,
                     appliedWindow,
+                    pfbOverlap=False,
+                    fftBackend='numpy',
+                    fftWorkers=None,
+                    fftWisdomPath=None,
+                    windowCachePath=None,
+                    precision='single',
+                    accumulatorPrecision='double',
+                    spectralKurtosis=False,
+                    skThreshold=3.,
+                    clipLevel=None,
+                    madThreshold=None,
+                    minIntegrationFraction=0.5,
+                    chunkFrames=64,
+                    nBuffers=8,
+                    nWorkers=1,
+                    simParams=None,
+                    switchGate=None,
+                    session=None,
+                    writer=None,
                     verbose=True):
     """
     Acquire IQ samples from SoapySDR and transform to chanelised and time-
     averaged power spectra.
     
+    Reading from the stream and channelisation run in separate threads 
+    (see `capture.py`), so samples keep being read while previous chunks of 
+    frames are being channelised and accumulated.
+    
     Parameters:
         sampleIntegrationTime (float):
             Integration time for each time sample, in sec. This will not be an 
@@ -45,7 +77,8 @@ def measure_spectra(sampleIntegrationTime,
         nChannels (int):
             Number of frequency channels to divide the bandwidth into.
         sdrDriver (str):
-            Name of the SoapySDR SDR driver, e.g. `sdrplay'. 
+            Name of the SoapySDR SDR driver, e.g. `sdrplay'. Use `sim` for 
+            the hardware-free simulated SDR in `sim_sdr.py`.
         sdrId (int):
             ID number of the SDR. Will normally be `0` unless there are 
             multiple SDRs connected.
@@ -67,6 +100,89 @@ def measure_spectra(sampleIntegrationTime,
         appliedWindow (str):
             Name of the window function to apply when channelising. 
             See `spectrum.window_dict` for options.
+        pfbOverlap (bool):
+            If `True` and `pfb` channelisation is selected, use an 
+            overlapping PFB (`spectrum.StreamingPFB`) that carries the tap 
+            history between reads and produces one spectrum per `nChannels` 
+            samples, rather than one per `nTaps*nChannels` samples.
+        fftBackend (str):
+            FFT backend to use for channelisation. See 
+            `fft_backend.backend_dict` for options.
+        fftWorkers (int):
+            Number of threads for the FFT backend (-1 for all cores).
+        fftWisdomPath (str):
+            File to persist FFTW wisdom in (`pyfftw` backend only).
+        windowCachePath (str):
+            Folder to persist the window coefficients in, see 
+            `spectrum.get_window_coeffs()`.
+        precision, accumulatorPrecision (str):
+            `single` or `double` precision for the channelisation and for 
+            the integrated PSD sums, see `spectrum.set_precision()`. These 
+            and the FFT backend apply to this measurement only.
+        spectralKurtosis (bool):
+            Also compute the spectral kurtosis of each channel over each 
+            integration, and flag the channels with RFI (see 
+            `spectrum.PSDAccumulator.spectral_kurtosis()`). With a `writer`, 
+            these are written alongside the spectra as `sdr_sk` and 
+            `sdr_sk_flags`.
+        skThreshold (float):
+            Flagging threshold, in standard deviations of the spectral 
+            kurtosis of Gaussian noise.
+        clipLevel (float):
+            Frames with an I or Q magnitude at or above this level (1 is 
+            the ADC full scale) are rejected before accumulation, if not 
+            `None`.
+        madThreshold (float):
+            Frames whose power exceeds the median of their chunk by more 
+            than this many robust standard deviations (median absolute 
+            deviation), e.g. from impulsive RFI, are rejected before 
+            accumulation, if not `None`. Only used with a `switchGate`: 
+            otherwise a chunk can span a switch change, and the frames in 
+            the brighter state would be rejected too. With a `writer`, the frames kept and 
+            rejected in each integration are written as `n_frames_kept`, 
+            `n_frames_clipped` and `n_frames_rfi`, along with the ADC 
+            statistics of each integration (`adc_stats.STAT_KEYS`, before 
+            any frames are rejected).
+        minIntegrationFraction (float):
+            Integrations keeping fewer than this fraction of `n_frames` 
+            frames (and always those of a single frame) are dropped rather 
+            than written, e.g. the short integrations closed early at each 
+            switch edge by a `switchGate`, or ones that lost most of their 
+            frames to overflows or rejection.
+        chunkFrames (int):
+            Number of frames read into each chunk. Integrations are 
+            accumulated chunk-by-chunk, so peak memory scales with 
+            `chunkFrames * nBuffers` rather than with the integration time.
+        nBuffers (int):
+            Number of preallocated chunks shared between the capture thread 
+            and the channeliser workers. Chunks are dropped (and counted) 
+            only if all of them are waiting to be channelised.
+        nWorkers (int):
+            Number of channeliser worker threads. Forced to `1` for the 
+            overlapping PFB.
+        simParams (dict):
+            Keyword arguments for `sim_sdr.SimDevice`, if `sdrDriver` is 
+            `sim`.
+        switchGate (capture.SwitchGate):
+            If given, integrations are gated by the switch state (see 
+            `gated_observe.py`): they are closed early when the switches 
+            move, samples read during a switch transition are discarded, 
+            and each integration is labelled with its state (`sdr_states` 
+            with a `writer`).
+        session (sdr_session.SDRSession):
+            Open SDR session to reuse, e.g. across observation blocks (see 
+            `orchestrator.py`). Only the settings that have changed are 
+            applied, and the stream is stopped but left open afterwards. A 
+            session is opened and closed for this measurement if not given.
+        writer (StreamingWriter):
+            If given, each integration is appended to the cache file as 
+            soon as it is produced (see `cache_writer.py`) instead of being 
+            kept in memory, and the returned waterfall, time and ADC arrays 
+            are empty. The stream accounting for each integration is 
+            written alongside the spectra: `samples_received` and 
+            `samples_expected` from `readStream`, `samples_channelised` 
+            (complete frames only), `n_overflows`, `n_timeouts` and the 
+            elapsed `capture_time` in seconds.
         verbose (bool):
             Whether to print diagonostic messages.
     
@@ -74,150 +190,403 @@ def measure_spectra(sampleIntegrationTime,
         waterfall_spectra (array_like):
             Array of measured PSD values, of shape `(Ntimes, Nchannels)`.
         times (array_like):
-            Timestamps for each time sample, in seconds since the UNIX epoch.
+            Timestamps for the middle of each time sample, in seconds since 
+            the UNIX epoch, from the stream clock (see `stream_clock.py`). 
+            With a `writer`, the start and stop times of the samples in each 
+            integration are also written, as `sdr_time_start` and 
+            `sdr_time_stop`.
         freqs (array_like):
             Array of frequency channel centre values in MHz.
         max_i_adc, max_q_adc (array_like):
-            Arrays of maximum ADC values for the I and Q channels, for each 
+            Arrays of peak ADC magnitudes for the I and Q channels, for each 
             time sample.
     """
-    # Set up channelisation mode
+    # Set up channelisation mode. The FFT backend and precision are kept to 
+    # this measurement, rather than set process-wide, as another receiver 
+    # may be channelising in the same process (see orchestrator.py)
+    fft = fft_backend.get_fft_backend(fftBackend, fftWorkers, fftWisdomPath)
+    window_dtype = spectrum.precision_dict[precision]
     if spectrometerMode == 'fft':
         # Number of frames for each fft
         n_frames = int(sampleIntegrationTime * bandwidth / nChannels)
         
-        # Set spectrometer function and sampling parameters
-        spectrometer_func = spectrum.buffer_to_psd_fft
-        win_coeffs = spectrum.window_dict[appliedWindow](nChannels)
+        # Set window and sampling parameters
+        win_coeffs = spectrum.get_window_coeffs(
+                            spectrometerMode, appliedWindow, nChannels,
+                            dtype=window_dtype,
+                            windowCachePath=windowCachePath)
         n_spec_points = nChannels
         nTaps = None
     else:
-        # 
-        win_coeffs = spectrum.create_window(appliedWindow, nChannels, nTaps)
-        
-        # Set spectrometer function and sampling parameters
-        spectrometer_func = spectrum.buffer_to_psd_pfb
+        # Set window and sampling parameters
+        win_coeffs = spectrum.get_window_coeffs(
+                            spectrometerMode, appliedWindow, nChannels, nTaps,
+                            dtype=window_dtype,
+                            windowCachePath=windowCachePath)
         n_spec_points = nChannels * nTaps # no. 
         n_frames = int(sampleIntegrationTime * bandwidth / (nChannels*nTaps))
     
     # Set-up SDR sampling parameters
     if verbose:
         print('n_frames', n_frames)
-    rx_chan = 0 # only 1 channel on RSP1A
-    sdr = SoapySDR.Device(dict(driver=sdrDriver, label=sdrLabel))
-    sdr.setSampleRate(SOAPY_SDR_RX, rx_chan, bandwidth)
-    sdr.setFrequency(SOAPY_SDR_RX, rx_chan, centre_frequency)
-    sdr.setBandwidth(SOAPY_SDR_RX, rx_chan, int(bandwidth))
-    
-    # Set notch filters if available (some may be ignored; depends on SDR)
-    # FIXME: Commented out the first two
-    #sdr.writeSetting("rfnotch_ctrl", "true")
-    #sdr.writeSetting("dabnotch_ctrl", "true")
-    #sdr.writeSetting("biasT_ctrl", "false")
-    sdr.writeSetting(SOAPY_SDR_RX, rx_chan, "rfnotch_ctrl", "true")
-    sdr.writeSetting(SOAPY_SDR_RX, rx_chan, "dabnotch_ctrl", "true")
-    sdr.writeSetting(SOAPY_SDR_RX, rx_chan, "fmmnotch_ctrl", "true")
-    
-    # Set gain mode and settings manually, rather than using AGC
-    sdr.setGainMode(SOAPY_SDR_RX, rx_chan, False) # turn OFF AGC
-    sdr.setGain(SOAPY_SDR_RX, rx_chan, "RFGR", sdrRFGR) # set RF gain
-    sdr.setGain(SOAPY_SDR_RX, rx_chan, "IFGR", sdrIFGR) # set IF gain
+    # Open the SDR, unless an open session is being reused, and apply any 
+    # settings that differ from the ones it already has
+    own_session = session is None
+    if own_session:
+        session = SDRSession(sdrDriver, sdrLabel, simParams, verbose=verbose)
+    session.configure(bandwidth, centre_frequency, sdrGain=sdrGain,
+                      sdrRFGR=sdrRFGR, sdrIFGR=sdrIFGR)
+    sdr, rxStream = session.sdr, session.rxStream
     if verbose:
+        rx_chan = session.rx_chan
         print("Current RF Gain:", sdr.getGain(SOAPY_SDR_RX, rx_chan, "RFGR"))
         print("Current IF Gain:", sdr.getGain(SOAPY_SDR_RX, rx_chan, "IFGR"))
-    
-    # Set gain
-    if sdrGain is not None:
-        sdr.setGain(SOAPY_SDR_RX, rx_chan, sdrGain)
-    rxStream = sdr.setupStream(SOAPY_SDR_RX, SOAPY_SDR_CF32, [rx_chan])
-    
-    # Test-start the stream
-    status = sdr.activateStream(rxStream) # start streaming
-    if verbose:
-        # Output hardware info, stream data stats, and gain info
-        print("  Hardware info", sdr.getHardwareInfo())
-        print("  Stream MTU:", sdr.getStreamMTU(rxStream))
-        print("  Activate status:", status)
-        print("  Current gain:", sdr.getGain(SOAPY_SDR_RX, rx_chan))
         print("  RF gain idx:", sdr.readSetting("rfgain_sel"))
-        print("  Current Gain Mode, AGC:", sdr.getGainMode(SOAPY_SDR_RX, rx_chan))
         print("")
     
-    sdr.deactivateStream(rxStream) # stop streaming after test
-    
-    # Check that requested data frame size fits within the MTU (max. transmission unit)
-    if sdr.getStreamMTU(rxStream) < n_spec_points:
-        raise NotImplementedError("The SoapySDR MTU is smaller than the requested spectrum length, n_spec_points. Code to stitch togethe`r multiple packets has not yet been implemented.")
+    # Calculate frequency channel locations in MHz
+    freqs = np.linspace(-bandwidth/2/1e6 + centre_frequency/1e6, 
+                         bandwidth/2/1e6 + centre_frequency/1e6,
+                         nChannels)
     
-    # Set total observing time
-    t_f = time.time() + runLength
+    # Frames longer than the MTU (max. transmission unit) are filled by 
+    # several readStream calls, see frame_ring.read_row()
     
-    # Prepare data arrays/lists (complex64 == CF32 in Soapy driver)
-    buff = np.zeros((n_spec_points,), np.complex64) # buffer for each 
-    waterfall_spectra = []
-    times = []
-    max_i_adc = []
-    max_q_adc = []
+    # Prepare the ring of preallocated chunks of frames shared between the 
+    # capture thread and the channeliser workers. Each integration is folded 
+    # into a running sum chunk-by-chunk, so only nBuffers chunks are ever 
+    # held in memory (complex64 == CF32 in Soapy driver)
+    ring = FrameRing(nBuffers, min(chunkFrames, n_frames), n_spec_points)
+    results = []
+    if writer is None:
+        emit = results.append
+    else:
+        writer.write('sdr_freqs', freqs)
+        emit = lambda r: writer.append(
+                            sdr_waterfall=r['spectra'],
+                            sdr_times=r['time'],
+                            sdr_time_start=r['time_start'],
+                            sdr_time_stop=r['time_stop'],
+                            max_i_adc=r['max_i_adc'],
+                            max_q_adc=r['max_q_adc'],
+                            samples_received=r['samples_received'],
+                            samples_expected=r['samples_expected'],
+                            samples_channelised=r['samples_channelised'],
+                            n_frames_kept=r['n_frames_kept'],
+                            n_frames_clipped=r['n_frames_clipped'],
+                            n_frames_rfi=r['n_frames_rfi'],
+                            **{key: r[key] for key in adc_stats.STAT_KEYS},
+                            n_overflows=r['n_overflows'],
+                            n_timeouts=r['n_timeouts'],
+                            capture_time=r['capture_time'],
+                            **({} if r['sk'] is None 
+                               else {'sdr_sk': r['sk'].astype(np.float32),
+                                     'sdr_sk_flags': r['sk_flags']}),
+                            **({} if r['state'] is None 
+                               else {'sdr_states': r['state']}))
+    if spectrometerMode != 'fft' and pfbOverlap:
+        # The overlapping PFB carries its tap history between integrations 
+        # and needs the chunks in order
+        nWorkers = 1
+        streaming_pfb = spectrum.StreamingPFB(win_coeffs, nTaps, nChannels,
+                                              fft, accumulatorPrecision)
+    else:
+        streaming_pfb = None
+    make_accumulator = lambda: spectrum.PSDAccumulator(
+                                        spectrometerMode, win_coeffs, nTaps,
+                                        pfbOverlap=pfbOverlap, 
+                                        nChannels=nChannels,
+                                        streaming_pfb=streaming_pfb,
+                                        spectralKurtosis=spectralKurtosis,
+                                        skThreshold=skThreshold,
+                                        fft=fft,
+                                        accumulatorPrecision=
+                                            accumulatorPrecision)
+    if madThreshold is not None and switchGate is None:
+        print('madThreshold ignored: frame power is only comparable within '
+              'one switch state, which needs a switchGate')
+        madThreshold = None
+    minFrames = min(n_frames, max(2, int(np.ceil(minIntegrationFraction 
+                                                 * n_frames))))
+    collector = capture.IntegrationCollector(make_accumulator, emit, verbose,
+                                             clipLevel=clipLevel,
+                                             madThreshold=madThreshold,
+                                             minFrames=minFrames)
     
     # Prepare for streaming the data (assumes the previous gain values are OK)
-    sdr.activateStream(rxStream)
+    session.start()
     
-    # Loop for the full duration of the observation
-    while t < t_f:
-        
-        # Current time
-        t = time.time()
-        
-        # Allocate memory for set of frames for one time sample
-        frame_set = np.zeros((n_frames, n_spec_points), dtype=np.complex64)
-        daq_status = np.zeros(n_frames, dtype=int)
-        
-        # Loop over individual samples pulled from the ADC 
-        # (minimise operations within this inner loop to maintain performance)
-        for i in range(n_frames):
-            # Read set of samples for a single spectrum and store status 
-            sr = sdr.readStream(rxStream, [buff,], len(buff), timeoutUs=int(100e3))
-            daq_status[i] = int(sr.ret)
-            frame_set[i] = buff
-            buff[:] = 0. # zero buffer just in case
-        
-        # Save output
-        spectra = spectrometer_func(frame_set, 
-                                    win_coeffs, nChannels, nTaps, daq_status)
-        waterfall_spectra.append(spectra)
-        times.append(time.time())
-        
-        # Acquire ADC statistics
-        max_adc_i = frame_set.real.max()
-        max_adc_q = frame_set.imag.max()
-        max_i_adc.append(max_adc_i)
-        max_q_adc.append(max_adc_q)
-        
-        if verbose:
-            print(t)
-            print(f"Max ADC I: {max_adc_i}")
-            print(f'Max ADC Q: {max_adc_q}')
-            print(f'Remaining: {t_f - t} s')
+    # Capture continuously for the full duration of the observation, while 
+    # the workers channelise completed chunks in parallel
+    capture_thread = capture.CaptureThread(sdr, rxStream, ring, runLength,
+                                           n_frames, bandwidth,
+                                           n_workers=nWorkers,
+                                           gate=switchGate)
+    if switchGate is not None and hasattr(sdr, 'set_source'):
+        switchGate.add_listener(sdr.set_source) # simulated switch states
+    workers = [capture.ChanneliserWorker(ring, collector,
+                                         on_error=capture_thread.stop)
+               for _ in range(nWorkers)]
+    for worker in workers:
+        worker.start()
+    capture_thread.start()
+    try:
+        capture_thread.join()
+    except KeyboardInterrupt:
+        capture_thread.stop()
+        capture_thread.join()
+    for worker in workers:
+        worker.join()
+    
+    if verbose:
+        print(f'Integrations captured: {capture_thread.n_integrations}')
+        print(f'Chunks dropped (workers behind): '
+              f'{capture_thread.n_chunks_dropped}')
+        print(f'Integrations dropped (fewer than {minFrames} frames): '
+              f'{collector.n_short}')
+        if switchGate is not None:
+            print(f'Frames discarded during switching: '
+                  f'{capture_thread.n_frames_discarded}')
     
-    # Stop observation and close stream
-    sdr.deactivateStream(rxStream)
-    sdr.closeStream(rxStream)
+    # Stop observation, and close the stream unless the session is reused
+    session.stop()
+    if own_session:
+        session.close()
     if verbose:
         print('SDRPlay stream deactivated')
     
-    # Convert waterfall and metadata into arrays
-    waterfall_spectra = np.array(waterfall_spectra)
-    times = np.array(times)
-    max_i_adc = np.array(max_i_adc)
-    max_q_adc = np.array(max_q_adc)
+    # A failed worker stopped the capture early, so the block is incomplete
+    for worker in workers:
+        if worker.error is not None:
+            raise worker.error
     
-    # Calculate frequency channel locations in MHz
-    freqs = np.linspace(-bandwidth/2/1e6 + centre_frequency/1e6, 
-                         bandwidth/2/1e6 + centre_frequency/1e6,
-                         nChannels)
+    # Convert waterfall and metadata into arrays
+    waterfall_spectra = np.array([r['spectra'] for r in results])
+    times = np.array([r['time'] for r in results])
+    max_i_adc = np.array([r['max_i_adc'] for r in results])
+    max_q_adc = np.array([r['max_q_adc'] for r in results])
     return waterfall_spectra, times, freqs, max_i_adc, max_q_adc
 
 
+def gain_search(session, bandwidth, centre_frequency, nSpecPoints,
+                rfgrValues, ifgrValues, dwellTime=0.1, settleTime=0.05,
+                targetRMS=0.1, maxClipFraction=1e-6, verbose=True):
+    """
+    Sweep the RF and IF gain reduction on the live stream, measuring the 
+    ADC statistics (see `adc_stats.py`) for `dwellTime` at each setting, 
+    and pick the setting whose I/Q RMS is closest to `targetRMS` (in dB) 
+    without more than `maxClipFraction` of the values clipping. The stream 
+    is left running between settings; samples read within `settleTime` of 
+    each change are discarded. The input measured is whichever the 
+    switches are set to.
+    
+    Parameters:
+        session (sdr_session.SDRSession):
+            Open SDR session.
+        bandwidth (float):
+            Sample rate and bandwidth, in Hz.
+        centre_frequency (float):
+            Centre frequency, in Hz.
+        nSpecPoints (int):
+            Samples per read.
+        rfgrValues, ifgrValues (list):
+            RF and IF gain reductions to try. Earlier RF values are 
+            preferred when settings are equally good.
+        dwellTime (float):
+            Time measured at each setting, in seconds.
+        settleTime (float):
+            Time discarded after each change, in seconds.
+        targetRMS (float):
+            I/Q RMS to aim for, relative to the ADC full scale.
+        maxClipFraction (float):
+            Largest acceptable fraction of clipped I/Q values.
+        verbose (bool):
+            Whether to print each measurement.
+    
+    Returns:
+        best (dict):
+            `sdrRFGR` and `sdrIFGR` of the chosen setting, with its `rms` 
+            and `clip_fraction`.
+        sweep (dict):
+            Arrays of `sdrRFGR`, `sdrIFGR`, `rms` and `clip_fraction` for 
+            every setting tried.
+    """
+    n_frames = max(int(dwellTime * bandwidth / nSpecPoints), 1)
+    frame_set = np.zeros((n_frames, nSpecPoints), dtype=np.complex64)
+    clock = StreamClock(bandwidth)
+    sdr, rxStream = session.sdr, session.rxStream
+    sweep = {'sdrRFGR': [], 'sdrIFGR': [], 'rms': [], 'clip_fraction': []}
+    
+    session.start()
+    try:
+        for sdrRFGR in rfgrValues:
+            for sdrIFGR in ifgrValues:
+                session.configure(bandwidth, centre_frequency, 
+                                  sdrRFGR=sdrRFGR, sdrIFGR=sdrIFGR)
+                t_settled = time.time() + settleTime
+                row = 0
+                n_reads = 0
+                # Bounded, in case the stream returns only errors
+                while row < n_frames and n_reads < 10 * n_frames:
+                    status, _, span = read_row(sdr, rxStream, 
+                                               frame_set[row], int(1e6), 
+                                               clock)
+                    if status != nSpecPoints: # overflow, timeout or error
+                        n_reads += 1
+                        continue
+                    # Settling, by the sample time or the time of the read
+                    if span[0] < t_settled or time.time() < t_settled:
+                        continue
+                    n_reads += 1
+                    row += 1
+                stats = adc_stats.ADCStats()
+                if row > 0:
+                    stats.add_chunk(frame_set[:row])
+                result = stats.finalize()
+                rms = np.sqrt((result['adc_rms_i']**2 
+                               + result['adc_rms_q']**2) / 2)
+                sweep['sdrRFGR'].append(sdrRFGR)
+                sweep['sdrIFGR'].append(sdrIFGR)
+                sweep['rms'].append(rms)
+                sweep['clip_fraction'].append(result['adc_clip_fraction'])
+                if verbose:
+                    print(f'  RFGR {sdrRFGR}, IFGR {sdrIFGR}: RMS {rms:.4f}, '
+                          f'clipped {result["adc_clip_fraction"]:.2e}')
+    finally:
+        session.stop()
+    
+    sweep = {key: np.array(value) for key, value in sweep.items()}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost = np.abs(20 * np.log10(sweep['rms'] / targetRMS))
+    cost[~np.isfinite(cost)] = np.inf
+    ok = sweep['clip_fraction'] <= maxClipFraction
+    if ok.any():
+        index = np.argmin(np.where(ok, cost, np.inf)) # first of any ties
+    else:
+        print('Warning: every gain setting clips; using the least clipped')
+        index = np.argmin(np.nan_to_num(sweep['clip_fraction'], nan=np.inf))
+    best = {'sdrRFGR': sweep['sdrRFGR'][index].item(),
+            'sdrIFGR': sweep['sdrIFGR'][index].item(),
+            'rms': sweep['rms'][index].item(),
+            'clip_fraction': sweep['clip_fraction'][index].item()}
+    return best, sweep
+
+
+def tune_gains(params, session=None):
+    """
+    Run `gain_search()` with the parameters from 
+    `config.return_sdr_params()`, and save the chosen gains to the cache 
+    folder (`config.GAIN_SETTINGS_FILE`), with the time and a hash of the 
+    settings (`config.gain_search_hash()`), from where the following blocks 
+    read them. Any previous result is removed first, so if the search fails 
+    the blocks fall back to `sdrRFGR`/`sdrIFGR`. The sweep itself is saved 
+    as `gain_search.npz`.
+    
+    Parameters:
+        params (dict):
+            SDR parameters from `config.return_sdr_params()`.
+        session (sdr_session.SDRSession):
+            Open SDR session to reuse (see `orchestrator.py`). A session is 
+            opened and closed for the search if not given.
+    
+    Returns:
+        best (dict):
+            The chosen settings, see `gain_search()`.
+    """
+    search = params['gainSearch']
+    n_spec_points = params['nChannels'] if params['spectrometerMode'] == 'fft' \
+                    else params['nChannels'] * params['nTaps']
+    obsCachePath = params['obsCachePath']
+    gain_settings_path = f'{obsCachePath}/{config.GAIN_SETTINGS_FILE}'
+    if os.path.exists(gain_settings_path):
+        os.remove(gain_settings_path)
+    
+    t_start = time.monotonic()
+    own_session = session is None
+    if own_session:
+        session = SDRSession(params['sdrDriver'], params['sdrLabel'], 
+                             params['simParams']).open()
+    try:
+        session.configure(params['bandwidth'], params['centreFrequency'],
+                          sdrRFGR=search['rfgrValues'][0],
+                          sdrIFGR=search['ifgrValues'][0])
+        best, sweep = gain_search(session, params['bandwidth'], 
+                                  params['centreFrequency'], 
+                                  min(n_spec_points, session.mtu),
+                                  search['rfgrValues'], search['ifgrValues'],
+                                  dwellTime=search['dwellTime'],
+                                  settleTime=search['settleTime'],
+                                  targetRMS=search['targetRMS'],
+                                  maxClipFraction=search['maxClipFraction'])
+    finally:
+        if own_session:
+            session.close()
+    
+    os.makedirs(obsCachePath, exist_ok=True)
+    with open(gain_settings_path, 'w') as f:
+        yaml.safe_dump({**best, 'time': time.time(),
+                        'configHash': config.gain_search_hash(params)}, f)
+    np.savez(f'{obsCachePath}/gain_search.npz', **sweep)
+    print(f'Gain search took {time.monotonic() - t_start:.1f} s; chosen '
+          f'RFGR {best["sdrRFGR"]}, IFGR {best["sdrIFGR"]} (RMS '
+          f'{best["rms"]:.4f}, clipped {best["clip_fraction"]:.2e})')
+    return best
+
+
+def cache_observation(params, runLength, **kwargs):
+    """
+    Run `measure_spectra()` with the parameters from 
+    `config.return_sdr_params()`, streaming each integration to 
+    `sdr_cache.hdf5` in the cache folder.
+    
+    Parameters:
+        params (dict):
+            SDR parameters from `config.return_sdr_params()`.
+        runLength (float):
+            How long to run the data acquisition for, in seconds.
+        **kwargs:
+            Further keyword arguments for `measure_spectra()`, e.g. 
+            `switchGate`.
+    """
+    obsCachePath = params['obsCachePath']
+    with StreamingWriter(f'{obsCachePath}/sdr_cache.hdf5',
+                         flush_interval=params['cacheFlushInterval']) \
+            as writer:
+        measure_spectra(
+                  sampleIntegrationTime=params['sampleIntegrationTime'],
+                  runLength = runLength,
+                  centre_frequency = params['centreFrequency'],
+                  bandwidth = params['bandwidth'],
+                  nChannels = params['nChannels'],
+                  sdrDriver = params['sdrDriver'],
+                  sdrId = params['sdrId'],
+                  sdrGain=params['sdrGain'],
+                  sdrRFGR=params['sdrRFGR'],
+                  sdrIFGR=params['sdrIFGR'],
+                  sdrLabel=params['sdrLabel'],
+                  spectrometerMode=params['spectrometerMode'],
+                  nTaps = params['nTaps'],
+                  appliedWindow = params['appliedWindow'],
+                  pfbOverlap = params['pfbOverlap'],
+                  fftBackend = params['fftBackend'],
+                  fftWorkers = params['fftWorkers'],
+                  fftWisdomPath = params['fftWisdomPath'],
+                  windowCachePath = params['windowCachePath'],
+                  precision = params['precision'],
+                  accumulatorPrecision = params['accumulatorPrecision'],
+                  spectralKurtosis = params['spectralKurtosis'],
+                  skThreshold = params['skThreshold'],
+                  clipLevel = params['clipLevel'],
+                  madThreshold = params['madThreshold'],
+                  minIntegrationFraction = params['minIntegrationFraction'],
+                  chunkFrames = params['chunkFrames'],
+                  nBuffers = params['nBuffers'],
+                  nWorkers = params['nWorkers'],
+                  simParams = params['simParams'],
+                  writer = writer,
+                  **kwargs)
+
+
 def main():
     parser = argparse.ArgumentParser(
                         description="Dual SDR Observation (RTLSDR + SDRplay)"
@@ -230,6 +599,11 @@ def main():
     parser.add_argument('--prerun',
                         action='store_true',
                         help='Runs the Script in Prerun Mode')
+    parser.add_argument('--gain-search',
+                        action='store_true',
+                        help='Tune sdrRFGR/sdrIFGR on the live stream and '
+                             'save them for the following blocks, instead '
+                             'of observing')
     
     # Parse arguments
     args = parser.parse_args()
@@ -244,36 +618,20 @@ def main():
 
     if not params['active']: # returns from main if the program is not active
         return
+    
+    if args.gain_search:
+        if params['gainSearch']['active']:
+            tune_gains(params)
+        return
         
     # Add a delay before starting the observation
     runLength = params['runLength'] - params['delay']
     time.sleep(params['delay'])
     
-    # Run the data acquisition
-    waterfall_spectra, times, freqs, max_i_adc, max_q_adc = \
-            measure_spectra(
-                      sampleIntegrationTime=params['sampleIntegrationTime'],
-                      runLength = runLength,
-                      centre_frequency = params['centreFrequency'],
-                      bandwidth = params['bandwidth'],
-                      nChannels = params['nChannels'],
-                      sdrDriver = params['sdrDriver'],
-                      sdrId = params['sdrId'],
-                      sdrGain=params['sdrGain'],
-                      sdrRFGR=params['sdrRFGR'],
-                      sdrIFGR=params['sdrIFGR'],
-                      sdrLabel=params['sdrLabel'],
-                      spectrometerMode=params['spectrometerMode'],
-                      nTaps = params['nTaps'],
-                      appliedWindow = params['appliedWindow'])
-    
-    # Save the results to files
+    # Run the data acquisition, streaming each integration to the cache file
     obsCachePath = params['obsCachePath']
-    np.save(f'{obsCachePath}/sdr_waterfall.npy', arr=waterfall_spectra)
-    np.save(f'{obsCachePath}/sdr_times.npy', arr=times)
-    np.save(f'{obsCachePath}/sdr_freqs.npy', arr=freqs)
-    np.save(f'{obsCachePath}/max_i_adc.npy', arr=max_i_adc)
-    np.save(f'{obsCachePath}/max_q_adc.npy', arr=max_q_adc)
+    cache_observation(params, runLength)
+    
     np.save(f'{obsCachePath}/new_data_bool.npy', True)
     
     print('SDR Data Cached')
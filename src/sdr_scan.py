@@ -1,9 +1,66 @@
+import time
 import numpy as np
-from sdr_control import measure_spectra
+import spectrum
+import stitch
+from sdr_session import SDRSession
+from stream_clock import StreamClock
+from frame_ring import read_row
 import datetime
 
 SAVE_DIR = 'data'
 
+
+def subband_layout(start_frequency, stop_frequency, safe_bandwidth, 
+                   bandwidth, nChannels):
+    """
+    Centre frequencies of the sub-bands of a scan, and the channels of each 
+    sub-band kept when stitching.
+    
+    The step between centre frequencies is `safe_bandwidth` rounded down to 
+    a whole number of channels, and the same number of central channels is 
+    kept from each sub-band, so the kept channels tile the scanned range 
+    without overlapping.
+    
+    Returns:
+        centre_frequencies (array_like):
+            Centre frequency of each sub-band, in Hz.
+        keep (slice):
+            Channels of each (fftshifted) sub-band spectrum to keep.
+    """
+    channel_width = bandwidth / nChannels
+    n_keep = min(int(safe_bandwidth // channel_width), nChannels)
+    step = n_keep * channel_width
+    n_steps = int(np.ceil((stop_frequency - start_frequency) / step))
+    centre_frequencies = start_frequency + step * (np.arange(n_steps) + 0.5)
+    first = nChannels // 2 - n_keep // 2
+    return centre_frequencies, slice(first, first + n_keep)
+
+
+def wideband_grid(subband_freqs, keep, start_frequency, stop_frequency):
+    """
+    Output channels of a stitched scan: the centres of the kept sub-band 
+    channels (see `subband_layout()`), which tile the scanned range one 
+    channel width apart, up to `stop_frequency`. With an odd number of 
+    channels kept, they sit half a channel above `start_frequency`, so the 
+    grid is taken from the channels themselves rather than from 
+    `start_frequency`, which would leave every kept channel halfway between 
+    two grid channels.
+    
+    Parameters:
+        subband_freqs (array_like):
+            Channel frequencies of each sub-band, of shape 
+            `(n_steps, nChannels)`, in Hz.
+        keep (slice):
+            Channels of each sub-band kept, from `subband_layout()`.
+    
+    Returns:
+        grid (array_like):
+            Output channel frequencies, in Hz.
+    """
+    grid = subband_freqs[:, keep].ravel()
+    return grid[grid < stop_frequency]
+
+
 def scan_measure(safe_bandwidth,
                  start_frequency,
                  stop_frequency,
@@ -17,54 +74,192 @@ def scan_measure(safe_bandwidth,
                  sdrLabel,
                  spectrometerMode,
                  nTaps=None,
-                 appliedWindow=None):
-
-    centre_frequencies = np.arange(start_frequency,
-                                   stop_frequency,
-                                   safe_bandwidth/2)
+                 appliedWindow=None,
+                 sdrRFGR=None,
+                 sdrIFGR=None,
+                 simParams=None,
+                 settleTime=0.05,
+                 chunkFrames=64,
+                 windowCachePath=None,
+                 session=None):
+    """
+    Scan the SDR across a wide frequency range and stitch the sub-bands 
+    into one spectrum.
+    
+    One stream is kept running for the whole scan, and the SDR is retuned 
+    between sub-bands with `setFrequency`. Samples timestamped (see 
+    `stream_clock.py`) within `settleTime` of each retune are discarded. 
+    Each sub-band is measured for `runLength` seconds, in integrations of 
+    `sampleIntegrationTime`, with the same window and gains, so the 
+    sub-bands share one power scale. The central `safe_bandwidth` of each 
+    sub-band is kept when stitching, dropping the filter roll-off at the 
+    band edges.
+    
+    Frames cut short by an overflow, timeout or stream error are read 
+    again (and counted in `n_read_errors`), up to ten attempts per frame 
+    of each chunk; if a chunk still cannot be filled, the stream is taken 
+    to have failed and a `RuntimeError` is raised.
     
-    spectrometer_powers = []
-    spectrometer_freqs = []
-    spectrometer_times = []
-    adc_max_i = []
-    adc_max_q = []
-
-
-    for centre_frequency in centre_frequencies:
-        print(f'Measuring at centre frequency: {centre_frequency/1e6} MHz')
-
-        waterfall_spectra, times, freqs, max_i_adc, max_q_adc = measure_spectra(sampleIntegrationTime = sampleIntegrationTime,
-                                                      runLength = runLength,
-                                                      centre_frequency = centre_frequency,
-                                                      bandwidth = bandwidth,
-                                                      nChannels = nChannels,
-                                                      sdrDriver = sdrDriver,
-                                                      sdrId = sdrId,
-                                                      sdrGain = sdrGain,
-                                                      sdrLabel = sdrLabel,
-                                                      spectrometerMode = spectrometerMode,
-                                                      nTaps = nTaps,
-                                                      appliedWindow = appliedWindow)
-        spectra = np.mean(waterfall_spectra, axis=0)
-        time = np.mean(times)
-        spectrometer_powers.append(spectra)
-        spectrometer_freqs.append(freqs)
-        spectrometer_times.append(time)
-        adc_max_i.append(np.max(max_i_adc))
-        adc_max_q.append(np.max(max_q_adc))
+    Parameters:
+        safe_bandwidth (float):
+            Bandwidth kept from each sub-band, and the step between 
+            centre frequencies, in Hz.
+        settleTime (float):
+            Time to discard after each retune, in seconds.
+        chunkFrames (int):
+            Number of frames read and channelised at a time.
+        windowCachePath (str):
+            Folder to persist the window coefficients in, see 
+            `spectrum.get_window_coeffs()`.
+        session (sdr_session.SDRSession):
+            Open SDR session to reuse. A session is opened and closed for 
+            the scan if not given.
+        The other parameters are as for `sdr_control.measure_spectra()`.
     
-    spectrometer_powers = np.array(spectrometer_powers)
-    spectrometer_freqs = np.array(spectrometer_freqs)
-    spectrometer_times = np.array(spectrometer_times)
-    adc_max_i = np.array(adc_max_i)
-    adc_max_q = np.array(adc_max_q)
+    Returns:
+        return_dict (dict):
+            Sub-band spectra (`spectrometer_powers`, time-averaged, and 
+            `spectrometer_waterfalls`, per integration), channel frequencies 
+            in MHz, integration `time_start`/`time_stop` and mean 
+            `spectrometer_times`, ADC maxima, the numbers of frames 
+            discarded while settling and of failed reads, and the stitched 
+            `wideband_powers`, `wideband_waterfall` and `wideband_freqs` 
+            (MHz), limited to the scanned range.
+    """
+    if spectrometerMode == 'fft':
+        n_spec_points = nChannels
+        nTaps = None
+    else:
+        n_spec_points = nChannels * nTaps
+    win_coeffs = spectrum.get_window_coeffs(spectrometerMode, appliedWindow, 
+                                            nChannels, nTaps, 
+                                            windowCachePath=windowCachePath)
+    n_frames = max(int(sampleIntegrationTime * bandwidth / n_spec_points), 1)
+    n_integrations = max(int(runLength / sampleIntegrationTime), 1)
+
+    centre_frequencies, keep = subband_layout(start_frequency, 
+                                              stop_frequency,
+                                              safe_bandwidth, bandwidth, 
+                                              nChannels)
+    # Channel centres, in the fftshifted order of the PSDs
+    channel_offsets = np.fft.fftshift(np.fft.fftfreq(nChannels, 
+                                                     1 / bandwidth))
+    n_steps = len(centre_frequencies)
+
+    spectrometer_waterfalls = np.zeros((n_steps, n_integrations, nChannels))
+    time_start = np.zeros((n_steps, n_integrations))
+    time_stop = np.zeros((n_steps, n_integrations))
+    adc_max_i = np.zeros(n_steps)
+    adc_max_q = np.zeros(n_steps)
+    n_frames_discarded = 0
+    n_read_errors = 0
+
+    own_session = session is None
+    if own_session:
+        session = SDRSession(sdrDriver, sdrLabel, simParams)
+    session.configure(bandwidth, centre_frequencies[0], sdrGain=sdrGain,
+                      sdrRFGR=sdrRFGR, sdrIFGR=sdrIFGR)
+    sdr, rxStream = session.sdr, session.rxStream
+    chunk = np.zeros((min(chunkFrames, n_frames), n_spec_points), 
+                     dtype=np.complex64)
+    clock = StreamClock(bandwidth)
+
+    t_scan = time.monotonic()
+    session.start()
+    try:
+        for k, centre_frequency in enumerate(centre_frequencies):
+            print(f'Measuring at centre frequency: {centre_frequency/1e6} MHz')
+            session.configure(bandwidth, centre_frequency, sdrGain=sdrGain,
+                              sdrRFGR=sdrRFGR, sdrIFGR=sdrIFGR)
+            t_settled = time.time() + settleTime
+            for j in range(n_integrations):
+                accumulator = spectrum.PSDAccumulator(spectrometerMode, 
+                                                      win_coeffs, nTaps,
+                                                      nChannels=nChannels)
+                t_first = None
+                n_read = 0
+                while n_read < n_frames:
+                    n_rows = min(len(chunk), n_frames - n_read)
+                    row = 0
+                    n_reads = 0
+                    # Bounded, in case the stream returns only errors
+                    while row < n_rows and n_reads < 10 * n_rows:
+                        status, _, span = read_row(sdr, rxStream, chunk[row],
+                                                   int(1e6), clock)
+                        if status != n_spec_points: # overflow, timeout, error
+                            n_reads += 1
+                            n_read_errors += 1
+                            continue
+                        # Settling, by the sample time or (in case the 
+                        # clock anchor is late) the time the read returned
+                        if span[0] < t_settled or time.time() < t_settled:
+                            n_frames_discarded += 1
+                            continue
+                        if t_first is None:
+                            t_first = span[0]
+                        t_last = span[1]
+                        n_reads += 1
+                        row += 1
+                    if row < n_rows:
+                        raise RuntimeError(
+                            f'Stream failed at {centre_frequency/1e6} MHz: '
+                            f'{n_read_errors} reads returned an overflow, '
+                            f'timeout or error (last status {status})')
+                    frames = chunk[:n_rows]
+                    accumulator.add_chunk(frames)
+                    adc_max_i[k] = max(adc_max_i[k], 
+                                       np.abs(frames.real).max())
+                    adc_max_q[k] = max(adc_max_q[k], 
+                                       np.abs(frames.imag).max())
+                    n_read += n_rows
+                spectrometer_waterfalls[k, j] = accumulator.finalize()
+                time_start[k, j] = t_first
+                time_stop[k, j] = t_last
+    finally:
+        session.stop()
+        if own_session:
+            session.close()
+    print(f'Scanned {n_steps} sub-bands in {time.monotonic() - t_scan:.1f} s '
+          f'({n_frames_discarded} frames discarded while settling, '
+          f'{n_read_errors} failed reads)')
+
+    spectrometer_powers = spectrometer_waterfalls.mean(axis=1)
+    subband_freqs = centre_frequencies[:, np.newaxis] \
+                    + channel_offsets[np.newaxis, :]
+    spectrometer_freqs = subband_freqs / 1e6
+
+    # Stitch the sub-bands, integration by integration, onto channels 
+    # spanning the requested range. Cropping each sub-band to its central 
+    # safe_bandwidth is a top-hat passband
+    wideband_freqs = wideband_grid(subband_freqs, keep, start_frequency, 
+                                   stop_frequency)
+    crop = np.zeros(nChannels, dtype=bool)
+    crop[keep] = True
+    stitcher = stitch.Stitcher(subband_freqs, passband=crop,
+                               grid=wideband_freqs)
+    # The kept channels do not overlap, so each output channel must be 
+    # filled by exactly one of them
+    if np.any(stitcher.coverage != 1):
+        raise RuntimeError(f'{np.count_nonzero(stitcher.coverage != 1)} of '
+                           f'{wideband_freqs.size} output channels are not '
+                           f'covered by exactly one sub-band channel')
+    wideband_waterfall = stitcher(np.moveaxis(spectrometer_waterfalls, 1, 0))
+    wideband_freqs = wideband_freqs / 1e6
 
     return_dict = {'spectrometer_powers': spectrometer_powers,
+                   'spectrometer_waterfalls': spectrometer_waterfalls,
                    'spectrometer_freqs': spectrometer_freqs,
-                   'spectrometer_times': spectrometer_times,
+                   'spectrometer_times': (time_start + time_stop).mean(axis=1) / 2,
+                   'time_start': time_start,
+                   'time_stop': time_stop,
                    'adc_max_i': adc_max_i,
                    'adc_max_q': adc_max_q,
-                   'centre_frequencies': centre_frequencies}
+                   'centre_frequencies': centre_frequencies,
+                   'wideband_powers': wideband_waterfall.mean(axis=0),
+                   'wideband_waterfall': wideband_waterfall,
+                   'wideband_freqs': wideband_freqs,
+                   'n_frames_discarded': n_frames_discarded,
+                   'n_read_errors': n_read_errors}
 
     return return_dict
 
@@ -88,7 +283,7 @@ def main():
     parser.add_argument('--bandwidth', type=float, default=8e6,
                         help='Bandwidth for each measurement (Hz)')
     parser.add_argument('--sdrDriver', type=str, default='sdrplay',
-                        help='SDR driver to use (e.g., "sdrplay", "rtlsdr")')
+                        help='SDR driver to use (e.g., "sdrplay", "rtlsdr", or "sim" for the simulated SDR)')
     parser.add_argument('--sdrId', type=int, default=2302031848,
                         help='SDR ID to use for the measurement')
     parser.add_argument('--sdrGain', type=int, default=39,
@@ -101,6 +296,10 @@ def main():
                         help='Number of taps to use for PFB spectrometer mode')
     parser.add_argument('--appliedWindow', type=str, default='blackman',
                         help='Window function to apply to the samples (e.g., "blackman", "hann")')
+    parser.add_argument('--settleTime', type=float, default=0.05,
+                        help='Time discarded after each retune (s)')
+    parser.add_argument('--chunkFrames', type=int, default=64,
+                        help='Frames read and channelised at a time')
     args = parser.parse_args()
 
     measure_dict = scan_measure(safe_bandwidth=args.safe_bandwidth,
@@ -116,7 +315,9 @@ def main():
                                 sdrLabel=args.sdrLabel,
                                 spectrometerMode=args.spectrometerMode,
                                 nTaps=args.nTaps,
-                                appliedWindow=args.appliedWindow)
+                                appliedWindow=args.appliedWindow,
+                                settleTime=args.settleTime,
+                                chunkFrames=args.chunkFrames)
     
     current_time = datetime.datetime.now()
 
@@ -136,7 +337,14 @@ def main():
              adc_max_i=adc_max_i,
              adc_max_q=adc_max_q,
              centre_frequencies=centre_frequencies,
-             safe_bandwidth=args.safe_bandwidth)
+             safe_bandwidth=args.safe_bandwidth,
+             time_start=measure_dict['time_start'],
+             time_stop=measure_dict['time_stop'],
+             spectrometer_waterfalls=measure_dict['spectrometer_waterfalls'],
+             wideband_powers=measure_dict['wideband_powers'],
+             wideband_waterfall=measure_dict['wideband_waterfall'],
+             wideband_freqs=measure_dict['wideband_freqs'],
+             n_read_errors=measure_dict['n_read_errors'])
     
     print('Observation complete. Data saved to:', f'{SAVE_DIR}/{filename}')
 
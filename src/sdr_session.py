@@ -0,0 +1,203 @@
+"""
+Persistent connection to an SDR, kept open across measurements and
+observation blocks.
+
+Opening an SDRplay device (enumeration, API start-up and settling) takes
+seconds, and every measurement used to repeat it, along with all of the
+device settings and a test start of the stream. An `SDRSession` opens the
+device and sets up its RX stream once. Each measurement calls `configure()`
+with the settings it needs, and only those that differ from the settings
+already applied are written to the device.
+"""
+try:
+    from sim_sdr import make_device, SOAPY_SDR_RX, SOAPY_SDR_CF32 # same as SoapySDR
+except ImportError: # imported as src.sdr_session from the repo root
+    from src.sim_sdr import make_device, SOAPY_SDR_RX, SOAPY_SDR_CF32
+
+
+# Notch filters switched on by the observing scripts (SDRplay settings)
+DEFAULT_NOTCHES = ('rfnotch_ctrl', 'dabnotch_ctrl', 'fmmnotch_ctrl')
+GAIN_KEYS = ('RFGR', 'IFGR', 'gain')
+
+
+class SDRSession:
+    """
+    An open SDR device and RX stream, reconfigured by differences.
+
+    Use as a context manager, or call `open()` and `close()`:
+
+        with SDRSession('sdrplay', label) as session:
+            session.configure(bandwidth=10e6, centre_frequency=70e6,
+                              sdrRFGR=8, sdrIFGR=39)
+            session.start()
+            sr = session.sdr.readStream(session.rxStream, [buff], len(buff))
+            session.stop()
+
+    Parameters:
+        sdrDriver (str):
+            SoapySDR driver, or `sim` for the simulated SDR in `sim_sdr.py`.
+        sdrLabel (str):
+            SoapySDR device label.
+        simParams (dict):
+            Keyword arguments for `sim_sdr.SimDevice`, if `sdrDriver` is
+            `sim`.
+        rx_chan (int):
+            RX channel to stream from.
+        verbose (bool):
+            Whether to print the settings as they are applied.
+    """
+    def __init__(self, sdrDriver, sdrLabel, simParams=None, rx_chan=0,
+                 verbose=True):
+        self.sdrDriver = sdrDriver
+        self.sdrLabel = sdrLabel
+        self.simParams = simParams
+        self.rx_chan = rx_chan
+        self.verbose = verbose
+        self.sdr = None
+        self.rxStream = None
+        self.active = False
+        self.applied = {}
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """
+        Open the device, if it is not open already.
+        """
+        if self.sdr is None:
+            self.sdr = make_device(dict(driver=self.sdrDriver,
+                                        label=self.sdrLabel),
+                                   self.simParams)
+            self.applied = {}
+            if self.verbose:
+                print("  Hardware info", self.sdr.getHardwareInfo())
+        return self
+
+    def close(self):
+        """
+        Stop and close the stream, and release the device.
+        """
+        if self.sdr is None:
+            return
+        self._close_stream()
+        self.sdr = None
+        self.applied = {}
+
+    def pending(self, bandwidth, centre_frequency, sdrGain=None,
+                sdrRFGR=None, sdrIFGR=None, notches=DEFAULT_NOTCHES):
+        """
+        Settings that `configure()` would change, as a dictionary of the
+        new values. Empty if the device is already configured as requested.
+        """
+        settings = self._settings(bandwidth, centre_frequency, sdrGain,
+                                  sdrRFGR, sdrIFGR, notches)
+        changed = {key: value for key, value in settings.items()
+                   if self.applied.get(key) != value}
+        # The overall gain is split between the gain reduction stages, so
+        # the gains are always applied together and in order
+        if changed.keys() & GAIN_KEYS:
+            changed.update({key: settings[key] for key in GAIN_KEYS
+                            if key in settings})
+        return changed
+
+    @staticmethod
+    def _settings(bandwidth, centre_frequency, sdrGain, sdrRFGR, sdrIFGR,
+                  notches):
+        settings = {'sampleRate': float(bandwidth),
+                    'frequency': float(centre_frequency),
+                    'bandwidth': int(bandwidth),
+                    'gainMode': False} # AGC off
+        settings.update({notch: 'true' for notch in notches})
+        # Gains left as None are not set
+        for name, value in (('RFGR', sdrRFGR), ('IFGR', sdrIFGR),
+                            ('gain', sdrGain)):
+            if value is not None:
+                settings[name] = value
+        return settings
+
+    def configure(self, bandwidth, centre_frequency, sdrGain=None,
+                  sdrRFGR=None, sdrIFGR=None, notches=DEFAULT_NOTCHES):
+        """
+        Apply the settings that differ from those already applied, and set
+        up the RX stream if needed.
+
+        Parameters:
+            bandwidth (float):
+                Complex sample rate, also used as the analogue bandwidth.
+            centre_frequency (float):
+                Centre frequency in Hz.
+            sdrGain (float):
+                Overall gain, if not `None`.
+            sdrRFGR, sdrIFGR (float):
+                RF and IF gain reduction (SDRplay), if not `None`.
+            notches (tuple):
+                Notch filter settings to switch on.
+
+        Returns:
+            changed (dict):
+                The settings that were written to the device.
+        """
+        self.open()
+        changed = self.pending(bandwidth, centre_frequency, sdrGain,
+                               sdrRFGR, sdrIFGR, notches)
+        if 'sampleRate' in changed and self.rxStream is not None:
+            self._close_stream() # drivers size their buffers to the rate
+
+        sdr, rx = self.sdr, self.rx_chan
+        for key, value in changed.items():
+            if key == 'sampleRate':
+                sdr.setSampleRate(SOAPY_SDR_RX, rx, value)
+            elif key == 'frequency':
+                sdr.setFrequency(SOAPY_SDR_RX, rx, value)
+            elif key == 'bandwidth':
+                sdr.setBandwidth(SOAPY_SDR_RX, rx, value)
+            elif key == 'gainMode':
+                sdr.setGainMode(SOAPY_SDR_RX, rx, value)
+            elif key in ('RFGR', 'IFGR'):
+                sdr.setGain(SOAPY_SDR_RX, rx, key, value)
+            elif key == 'gain':
+                sdr.setGain(SOAPY_SDR_RX, rx, value)
+            else:
+                sdr.writeSetting(SOAPY_SDR_RX, rx, key, value)
+            self.applied[key] = value
+        if self.verbose and changed:
+            print("  SDR settings changed:", changed)
+
+        if self.rxStream is None:
+            self.rxStream = sdr.setupStream(SOAPY_SDR_RX, SOAPY_SDR_CF32,
+                                            [rx])
+            self.mtu = sdr.getStreamMTU(self.rxStream)
+            if self.verbose:
+                print("  Stream MTU:", self.mtu)
+                print("  Current gain:", sdr.getGain(SOAPY_SDR_RX, rx))
+                print("  Current Gain Mode, AGC:",
+                      sdr.getGainMode(SOAPY_SDR_RX, rx))
+        return changed
+
+    def start(self):
+        """
+        Activate the stream, if it is not active already.
+        """
+        if not self.active:
+            status = self.sdr.activateStream(self.rxStream)
+            self.active = True
+            return status
+        return 0
+
+    def stop(self):
+        """
+        Deactivate the stream, leaving it set up for the next `start()`.
+        """
+        if self.active:
+            self.sdr.deactivateStream(self.rxStream)
+            self.active = False
+
+    def _close_stream(self):
+        self.stop()
+        if self.rxStream is not None:
+            self.sdr.closeStream(self.rxStream)
+            self.rxStream = None
@@ -0,0 +1,319 @@
+"""
+Hardware-free stand-in for `SoapySDR.Device`, selected with
+`sdrDriver: sim` in `obs_config.yaml`.
+
+`SimDevice` implements the subset of the SoapySDR device API used by
+`sdr_control.py`, `aux_sdr_control.py`, `sdr_scan.py` and
+`raw_iq_observe.py`. It synthesises complex Gaussian noise (with a power that
+depends on the current switch state), CW tones and ADC clipping, paces
+`readStream` at the configured sample rate, honours the `readStream` timeout
+and stream MTU, and can inject overflows, so the acquisition code can be
+benchmarked on any Linux box.
+
+The SoapySDR constants used by the acquisition code are also defined here,
+so `from sim_sdr import *` can stand in for `from SoapySDR import *` when the
+SoapySDR Python bindings are not installed.
+"""
+import time
+import numpy as np
+
+__all__ = ['SOAPY_SDR_TX', 'SOAPY_SDR_RX', 'SOAPY_SDR_CF32',
+           'SOAPY_SDR_TIMEOUT', 'SOAPY_SDR_STREAM_ERROR',
+           'SOAPY_SDR_OVERFLOW', 'SOAPY_SDR_END_BURST', 'SOAPY_SDR_HAS_TIME']
+
+# Same values as SoapySDR/Constants.h and SoapySDR/Errors.h
+SOAPY_SDR_TX = 0
+SOAPY_SDR_RX = 1
+SOAPY_SDR_CF32 = 'CF32'
+SOAPY_SDR_TIMEOUT = -1
+SOAPY_SDR_STREAM_ERROR = -2
+SOAPY_SDR_OVERFLOW = -4
+SOAPY_SDR_END_BURST = (1 << 1)
+SOAPY_SDR_HAS_TIME = (1 << 2)
+
+
+def make_device(args, simParams=None):
+    """
+    Open an SDR device, returning a `SimDevice` if `args['driver']` is
+    `sim` and a `SoapySDR.Device` otherwise.
+
+    Parameters:
+        args (dict):
+            SoapySDR device arguments, e.g. `dict(driver=..., label=...)`.
+        simParams (dict):
+            Keyword arguments for `SimDevice`, used only by the simulator.
+    """
+    if args.get('driver') == 'sim':
+        return SimDevice(**(simParams or {}))
+    import SoapySDR
+    return SoapySDR.Device(args)
+
+
+class StreamResult:
+    """
+    Mimics the `StreamResult` returned by `SoapySDR.Device.readStream`.
+    """
+    def __init__(self, ret, flags=0, timeNs=0):
+        self.ret = ret
+        self.flags = flags
+        self.timeNs = timeNs
+
+    def __repr__(self):
+        return f'ret={self.ret}, flags={self.flags}, timeNs={self.timeNs}'
+
+
+class SimDevice:
+    """
+    Simulated SoapySDR receiver.
+
+    Parameters:
+        noisePower (float):
+            Mean noise power per complex sample at the ADC, at the reference
+            total gain reduction `refGainReduction`.
+        statePowers (dict):
+            Noise power multiplier for each switch state, e.g.
+            `{'load': 1.0, 'noise_diode': 10.0}`. States not listed use 1.
+        stateCycle (list):
+            If given, the simulator cycles through these switch states by
+            itself, spending `stateDuration` seconds in each, to emulate the
+            Dicke switching when the Arduino runs in a separate process.
+        stateDuration (float):
+            Time spent in each state of `stateCycle`, in seconds.
+        tones (list):
+            CW tones as `[offset_frequency_Hz, amplitude]` pairs, relative
+            to the centre frequency. Offsets are rounded to the nearest
+            frequency that is periodic in the internal sample pool.
+        refGainReduction (float):
+            Total RFGR + IFGR gain reduction (dB) at which `noisePower` and
+            the tone amplitudes apply. Other settings scale the signal.
+        overflowProbability (float):
+            Probability that a `readStream` call reports an overflow and
+            drops a buffer of samples.
+        realtime (bool):
+            Pace `readStream` at the sample rate. If `False`, samples are
+            returned as fast as they can be generated.
+        mtu (int):
+            Maximum number of samples returned by one `readStream` call.
+        readSize (int):
+            If given, `readStream` returns at most this many samples per
+            call, emulating drivers (like the SDRplay's) that return fewer
+            samples than requested below the MTU.
+        bufferLength (float):
+            Length of the emulated driver buffer, in seconds. If the reader
+            falls further behind than this, an overflow is reported and the
+            oldest samples are dropped.
+        poolLength (int):
+            Number of precomputed noise samples that reads are drawn from.
+        seed (int):
+            Random number generator seed.
+        state (str):
+            Initial switch state, see `set_source()`.
+    """
+    def __init__(self, noisePower=2.5e-3, statePowers=None, stateCycle=None,
+                 stateDuration=30., tones=None, refGainReduction=47,
+                 overflowProbability=0., realtime=True, mtu=65536,
+                 readSize=None, bufferLength=0.5, poolLength=2**22, seed=None,
+                 state=None):
+        self.noisePower = noisePower
+        self.statePowers = statePowers or {}
+        self.stateCycle = stateCycle
+        self.stateDuration = stateDuration
+        self.tones = tones or []
+        self.refGainReduction = refGainReduction
+        self.overflowProbability = overflowProbability
+        self.realtime = realtime
+        self.mtu = mtu
+        self.readSize = readSize
+        self.bufferLength = bufferLength
+        self.poolLength = poolLength
+        self.rng = np.random.default_rng(seed)
+
+        self.sampleRate = 2e6
+        self.frequency = 100e6
+        self.bandwidth = 2e6
+        self.gains = {'RFGR': 0, 'IFGR': 40}
+        self.gainMode = False
+        self.settings = {}
+        self.state = state
+        self.active = False
+        self.t_start = None
+        self.n_samples = 0
+
+        # Unit-power complex Gaussian noise, drawn from at random offsets
+        noise = self.rng.standard_normal((poolLength, 2), dtype=np.float32)
+        self.noise_pool = noise.view(np.complex64)[:, 0] / np.sqrt(2)
+        self.tone_pool = None
+
+    # --- Settings ----------------------------------------------------------
+
+    def getHardwareInfo(self):
+        return {'driver': 'sim', 'origin': 'rhino-daq sim_sdr'}
+
+    def setSampleRate(self, direction, channel, rate):
+        self.sampleRate = float(rate)
+        self.tone_pool = None
+
+    def getSampleRate(self, direction, channel):
+        return self.sampleRate
+
+    def setFrequency(self, direction, channel, frequency):
+        self.frequency = float(frequency)
+
+    def getFrequency(self, direction, channel):
+        return self.frequency
+
+    def setBandwidth(self, direction, channel, bandwidth):
+        self.bandwidth = float(bandwidth)
+
+    def getBandwidth(self, direction, channel):
+        return self.bandwidth
+
+    def listAntennas(self, direction, channel):
+        return ['RX']
+
+    def listGains(self, direction, channel):
+        return list(self.gains)
+
+    def setGainMode(self, direction, channel, automatic):
+        self.gainMode = bool(automatic)
+
+    def getGainMode(self, direction, channel):
+        return self.gainMode
+
+    def setGain(self, direction, channel, *args):
+        """
+        `setGain(dir, chan, value)` sets the overall gain, which for the
+        SDRplay driver is split between the gain reduction stages;
+        `setGain(dir, chan, name, value)` sets a named stage.
+        """
+        if len(args) == 2:
+            self.gains[args[0]] = float(args[1])
+        else:
+            self.gains['IFGR'] = max(self.refGainReduction
+                                     - float(args[0]) - self.gains['RFGR'], 0)
+
+    def getGain(self, direction, channel, name=None):
+        if name is not None:
+            return self.gains[name]
+        return self.refGainReduction - sum(self.gains.values())
+
+    def writeSetting(self, *args):
+        """
+        Accepts both `writeSetting(key, value)` and
+        `writeSetting(dir, chan, key, value)`.
+        """
+        self.settings[args[-2]] = args[-1]
+
+    def readSetting(self, *args):
+        return self.settings.get(args[-1], '')
+
+    def set_source(self, state):
+        """
+        Set the switch state, selecting the noise power from `statePowers`.
+        """
+        self.state = state
+
+    # --- Streaming ---------------------------------------------------------
+
+    def setupStream(self, direction, fmt, channels=None):
+        if fmt != SOAPY_SDR_CF32:
+            raise NotImplementedError('SimDevice only supports CF32 streams')
+        return 'sim-stream'
+
+    def getStreamMTU(self, stream):
+        return self.mtu
+
+    def activateStream(self, stream, *args):
+        self.active = True
+        self.t_start = time.time()
+        self.n_samples = 0
+        return 0
+
+    def deactivateStream(self, stream, *args):
+        self.active = False
+        return 0
+
+    def closeStream(self, stream):
+        self.active = False
+
+    def _current_state(self):
+        if self.stateCycle:
+            elapsed = self.n_samples / self.sampleRate
+            return self.stateCycle[int(elapsed // self.stateDuration)
+                                   % len(self.stateCycle)]
+        return self.state
+
+    def _make_tone_pool(self):
+        t = np.arange(self.poolLength)
+        tone_pool = np.zeros(self.poolLength, dtype=np.complex64)
+        for offset, amplitude in self.tones:
+            # Round to a frequency periodic in the pool, for continuous phase
+            k = round(offset / self.sampleRate * self.poolLength)
+            tone_pool += (amplitude * np.exp(2j * np.pi * k * t
+                                             / self.poolLength)
+                          ).astype(np.complex64)
+        return tone_pool
+
+    def _copy_from_pool(self, pool, start, out):
+        """
+        Copy `len(out)` samples from `pool` starting at `start`, wrapping.
+        """
+        n = out.shape[0]
+        start = start % self.poolLength
+        n_first = min(n, self.poolLength - start)
+        out[:n_first] = pool[start:start + n_first]
+        if n_first < n:
+            self._copy_from_pool(pool, 0, out[n_first:])
+
+    def readStream(self, stream, buffs, numElems, flags=0, timeoutUs=100000):
+        if not self.active:
+            time.sleep(timeoutUs / 1e6)
+            return StreamResult(SOAPY_SDR_TIMEOUT)
+        n = min(int(numElems), self.mtu, self.readSize or self.mtu)
+
+        if self.realtime:
+            # Wait until the requested samples would have been received
+            t_ready = self.t_start + (self.n_samples + n) / self.sampleRate
+            wait = t_ready - time.time()
+            if wait > timeoutUs / 1e6:
+                time.sleep(timeoutUs / 1e6)
+                return StreamResult(SOAPY_SDR_TIMEOUT)
+            if wait > 0:
+                time.sleep(wait)
+            elif -wait > self.bufferLength:
+                # Reader fell behind by more than the driver buffer: drop
+                # the backlog, as the hardware would
+                behind = int(-wait * self.sampleRate)
+                self.n_samples += behind
+                return StreamResult(SOAPY_SDR_OVERFLOW)
+
+        if self.overflowProbability \
+           and self.rng.random() < self.overflowProbability:
+            self.n_samples += n
+            return StreamResult(SOAPY_SDR_OVERFLOW)
+
+        time_ns = int(self.n_samples / self.sampleRate * 1e9)
+        out = buffs[0][:n]
+        self._copy_from_pool(self.noise_pool,
+                             int(self.rng.integers(self.poolLength)), out)
+
+        gain_reduction = self.gains['RFGR'] + self.gains['IFGR']
+        scale = 10**(-(gain_reduction - self.refGainReduction) / 20)
+        power = self.noisePower * self.statePowers.get(self._current_state(),
+                                                       1.)
+        out *= np.float32(scale * np.sqrt(power))
+
+        if self.tones:
+            if self.tone_pool is None:
+                self.tone_pool = self._make_tone_pool()
+            tone = np.empty_like(out)
+            self._copy_from_pool(self.tone_pool, self.n_samples, tone)
+            tone *= np.float32(scale)
+            out += tone
+
+        # ADC saturation at full scale
+        iq = out.view(np.float32)
+        np.clip(iq, -1., 1., out=iq)
+
+        self.n_samples += n
+        return StreamResult(n, SOAPY_SDR_HAS_TIME, time_ns)
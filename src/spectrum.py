@@ -1,6 +1,10 @@
 
+import os
+import threading
+from functools import lru_cache
 import numpy as np
 from scipy.signal import windows, firwin, freqz, lfilter, get_window
+import fft_backend
 
 
 window_dict = {
@@ -10,8 +14,188 @@ window_dict = {
                 'Cosine':            windows.cosine
               }
 
+# Number of distinct window coefficient sets kept by `get_window_coeffs()`
+WINDOW_CACHE_SIZE = 16
 
-def buffer_to_psd_fft(frame_set, win_coeffs, nChannels, nTaps=None):
+# Real dtypes of the window coefficients (and hence of the channelisation, 
+# which follows the window for complex64 samples), and of the PSD sums
+precision_dict = {
+                  'single':   np.float32,
+                  'double':   np.float64
+                 }
+
+# Median absolute deviation to standard deviation, for Gaussian data, and the 
+# fewest frames that `reject_frames()` estimates a robust threshold from
+MAD_SCALE = 1.4826
+MIN_FRAMES_MAD = 8
+
+# Default FFT function of the channelisers; see `set_fft_backend()`
+_fft = fft_backend.get_fft_backend('numpy')
+
+# Default precision policy; see `set_precision()`
+_window_dtype = np.float32
+_accumulator_dtype = np.float64
+
+
+def set_fft_backend(fftBackend='numpy', fftWorkers=None, fftWisdomPath=None):
+    """
+    Select the default FFT backend of the channelisers in this module, used 
+    wherever no `fft` function is passed in. This is process-wide, so code 
+    running several receivers in one process (e.g. `orchestrator.py`) 
+    passes each its own `fft` from `fft_backend.get_fft_backend()` instead.
+    
+    Parameters:
+        fftBackend (str):
+            Name of the backend. See `fft_backend.backend_dict` for options.
+        fftWorkers (int):
+            Number of threads for multi-threaded backends (-1 for all cores).
+        fftWisdomPath (str):
+            File in which to persist FFTW wisdom, if using `pyfftw`.
+    """
+    global _fft
+    _fft = fft_backend.get_fft_backend(fftBackend, fftWorkers, fftWisdomPath)
+
+
+def set_precision(precision='single', accumulatorPrecision='double'):
+    """
+    Select the default precision policy of the channelisers in this module. 
+    Like `set_fft_backend()`, this is process-wide; the precision can also 
+    be given per receiver, as the `dtype` of `get_window_coeffs()` and the 
+    `accumulatorPrecision` of the PSD sums.
+    
+    With `single` precision, the window coefficients are float32, so 
+    complex64 samples are windowed, FIR-filtered and FFTed as complex64 
+    and their PSDs computed as float32. `double` upcasts the samples to 
+    complex128 when they are windowed, doubling the memory traffic and FFT 
+    cost. The PSDs are summed over frames and integrations in 
+    `accumulatorPrecision`, which should stay `double` for long 
+    integrations. See `benchmarks/check_precision.py` for the difference.
+    
+    Parameters:
+        precision (str):
+            `single` or `double`, for the channelisation.
+        accumulatorPrecision (str):
+            `single` or `double`, for the PSD sums.
+    """
+    global _window_dtype, _accumulator_dtype
+    _window_dtype = precision_dict[precision]
+    _accumulator_dtype = precision_dict[accumulatorPrecision]
+
+
+def accumulator_dtype(accumulatorPrecision=None):
+    """
+    Real dtype of the PSD sums for `accumulatorPrecision` (`single` or 
+    `double`), or the default set by `set_precision()` if `None`.
+    """
+    if accumulatorPrecision is None:
+        return _accumulator_dtype
+    return precision_dict[accumulatorPrecision]
+
+
+def reject_frames(power, peak, clipLevel=None, madThreshold=None):
+    """
+    Select the frames to reject before accumulation: those that reach the 
+    ADC clip level, and those whose power exceeds the median of the set by 
+    more than `madThreshold` robust standard deviations (from the median 
+    absolute deviation), e.g. impulsive RFI. The robust threshold is only 
+    applied to sets of at least `MIN_FRAMES_MAD` frames.
+    
+    Parameters:
+        power (array_like):
+            Mean power of each frame, e.g. from 
+            `adc_stats.frame_power_peak()`.
+        peak (array_like):
+            Peak ADC magnitude of each frame.
+        clipLevel (float):
+            ADC magnitude at or above which a frame counts as clipped, or 
+            `None` not to reject clipped frames.
+        madThreshold (float):
+            Power threshold above the median, in robust standard 
+            deviations, or `None` not to reject power outliers.
+    
+    Returns:
+        clipped, outliers (array_like):
+            Boolean masks of the frames rejected by each test. A clipped 
+            frame is not also counted as an outlier.
+    """
+    clipped = np.zeros(power.shape, dtype=bool)
+    outliers = np.zeros(power.shape, dtype=bool)
+    if clipLevel is not None:
+        clipped = peak >= clipLevel
+    if madThreshold is not None and np.count_nonzero(~clipped) \
+                                    >= MIN_FRAMES_MAD:
+        median = np.median(power[~clipped])
+        sigma = MAD_SCALE * np.median(np.abs(power[~clipped] - median))
+        if sigma > 0:
+            outliers = ~clipped & (power > median + madThreshold * sigma)
+    return clipped, outliers
+
+
+def fft_psd(frame_set, win_coeffs, nChannels, nTaps=None, fft=None):
+    """
+    Channelise a set of frames with a windowed FFT, giving the PSD of each 
+    frame.
+    
+    Parameters:
+        frame_set (array_like):
+            Complex array of IQ samples from the ADC, of shape 
+            `(time_samples, freq_samples)`.
+        win_coeffs (array_like):
+            Window coeffcients generated using `create_window()`.
+        nChannels (int):
+            Number of frequency channels to produce.
+        nTaps (int):
+            Number of taps. This parameter is ignored.
+        fft (callable):
+            FFT function, from `fft_backend.get_fft_backend()` (default: 
+            set by `set_fft_backend()`).
+    
+    Returns:
+        psd (array_like):
+            PSD of each frame, of shape `(time_samples, nChannels)`, in FFT 
+            (unshifted) channel ordering.
+    """
+    # Perform an FFT on the windowed buffer, then calculate PSD
+    spectrum = (fft or _fft)(frame_set * win_coeffs[np.newaxis,:], axis=1)
+    psd = np.square(spectrum.real)
+    psd += np.square(spectrum.imag)
+    return psd
+
+
+def fft_power_sum(frame_set, win_coeffs, nChannels, nTaps=None, fft=None,
+                  accumulatorPrecision=None):
+    """
+    Channelise a set of frames with a windowed FFT and sum their PSDs.
+    
+    Parameters:
+        frame_set (array_like):
+            Complex array of IQ samples from the ADC, of shape 
+            `(time_samples, freq_samples)`.
+        win_coeffs (array_like):
+            Window coeffcients generated using `create_window()`.
+        nChannels (int):
+            Number of frequency channels to produce.
+        nTaps (int):
+            Number of taps. This parameter is ignored.
+        fft (callable):
+            FFT function, see `fft_psd()`.
+        accumulatorPrecision (str):
+            Precision of the sum, see `accumulator_dtype()`.
+    
+    Returns:
+        psd_sum (array_like):
+            Sum of the PSDs of all frames, in the accumulator precision, in 
+            FFT (unshifted) channel ordering.
+        n_spectra (int):
+            Number of spectra summed.
+    """
+    psd = fft_psd(frame_set, win_coeffs, nChannels, fft=fft)
+    return psd.sum(axis=0, dtype=accumulator_dtype(accumulatorPrecision)), \
+           psd.shape[0]
+
+
+def buffer_to_psd_fft(frame_set, win_coeffs, nChannels, nTaps=None, fft=None,
+                      accumulatorPrecision=None):
     """
     Channelise and accumulate IQ samples into a single PSD (spectrum) time 
     sample, using a windowed FFT for channelisation. 
@@ -26,13 +210,15 @@ def buffer_to_psd_fft(frame_set, win_coeffs, nChannels, nTaps=None):
             Number of frequency channels to produce.
         nTaps (int):
             Number of taps. This parameter is ignored.
+        fft, accumulatorPrecision:
+            See `fft_power_sum()`.
     """
-    # Perform an FFT on the windowed buffer, then calculate PSD
-    spectrum = np.fft.fft(frame_set * win_coeffs[np.new_axis,:], axis=1)
-    psd = (spectrum * spectrum.conj()).real
+    psd_sum, n_spectra = fft_power_sum(frame_set, win_coeffs, nChannels, 
+                                       fft=fft, 
+                                       accumulatorPrecision=accumulatorPrecision)
     
     # Average along time axis and shift into frequency channel ordering
-    return np.fft.fftshift( np.mean(psd, axis=0) )
+    return np.fft.fftshift( psd_sum / n_spectra )
     
 
 def pfb_fir_frontend(x, win_coeffs, nTaps, nChannels):
@@ -61,7 +247,7 @@ def pfb_fir_frontend(x, win_coeffs, nTaps, nChannels):
     return x_summed
 
 
-def pfb_filterbank(x, win_coeffs, nTaps, nChannels):
+def pfb_filterbank(x, win_coeffs, nTaps, nChannels, fft=None):
     """ 
     Based on Danny Price's PFB notebook
     
@@ -76,7 +262,7 @@ def pfb_filterbank(x, win_coeffs, nTaps, nChannels):
             Final number of channels.
     """
     x_fir = pfb_fir_frontend(x, win_coeffs, nTaps, nChannels)
-    x_pfb = np.fft.fft(x_fir)
+    x_pfb = (fft or _fft)(x_fir)
     return np.abs(x_pfb)**2
 
 def create_window(appliedWindow, nChannels, nTaps):
@@ -89,7 +275,181 @@ def create_window(appliedWindow, nChannels, nTaps):
                     cutoff=1.0/nChannels, 
                     window="rectangular")
 
-def buffer_to_psd_pfb(frame_set, win_coeffs, nChannels, nTaps):
+def get_window_coeffs(spectrometerMode, appliedWindow, nChannels, nTaps=None,
+                      dtype=None, windowCachePath=None):
+    """
+    Window coefficients for the `fft` or `pfb` channeliser, memoised.
+    
+    The last `WINDOW_CACHE_SIZE` coefficient sets are kept in memory, keyed 
+    by all of the parameters, so repeated measurements do not recompute 
+    them. With `windowCachePath`, they are also saved there as `.npy` files 
+    and loaded from there by later runs.
+    
+    Parameters:
+        spectrometerMode (str):
+            Whether the coefficients are for `fft` or `pfb` channelisation.
+        appliedWindow (str):
+            Window name; see `window_dict` for `fft` and 
+            `scipy.signal.get_window` for `pfb`.
+        nChannels (int):
+            Number of frequency channels.
+        nTaps (int):
+            Number of PFB taps (ignored for `fft`).
+        dtype (dtype):
+            Data type of the coefficients (default: set by the precision 
+            policy, see `set_precision()`).
+        windowCachePath (str):
+            Folder to persist the coefficients in, if given.
+    
+    Returns:
+        win_coeffs (array_like):
+            Read-only coefficients, of shape `(nChannels,)` for `fft` or 
+            `(nTaps, nChannels)` for `pfb`. The array is shared between 
+            callers.
+    """
+    if spectrometerMode == 'fft':
+        nTaps = None
+    if dtype is None:
+        dtype = _window_dtype
+    return _cached_window_coeffs(spectrometerMode, appliedWindow, nChannels, 
+                                 nTaps, np.dtype(dtype).name, windowCachePath)
+
+
+@lru_cache(maxsize=WINDOW_CACHE_SIZE)
+def _cached_window_coeffs(spectrometerMode, appliedWindow, nChannels, nTaps, 
+                          dtype, windowCachePath):
+    if spectrometerMode == 'fft':
+        shape = (nChannels,)
+    else:
+        shape = (nTaps, nChannels)
+    win_coeffs = None
+    if windowCachePath is not None:
+        path = os.path.join(windowCachePath, 
+                            f'window_{spectrometerMode}_{appliedWindow}_'
+                            f'{nChannels}_{nTaps}_{dtype}.npy')
+        if os.path.exists(path):
+            win_coeffs = np.load(path)
+            if win_coeffs.shape != shape or win_coeffs.dtype != dtype:
+                win_coeffs = None
+    
+    if win_coeffs is None:
+        if spectrometerMode == 'fft':
+            win_coeffs = window_dict[appliedWindow](nChannels)
+        else:
+            win_coeffs = create_window(appliedWindow, nChannels, nTaps)
+        win_coeffs = np.ascontiguousarray(win_coeffs.reshape(shape), 
+                                          dtype=dtype)
+        if windowCachePath is not None:
+            os.makedirs(windowCachePath, exist_ok=True)
+            np.save(path, win_coeffs)
+    win_coeffs.flags.writeable = False
+    return win_coeffs
+
+
+def pfb_fir_frontend_batch(frame_set, win_coeffs, nTaps, nChannels):
+    """
+    Apply the PFB FIR frontend to a whole set of frames at once.
+    
+    Parameters:
+        frame_set (array_like):
+            Complex array of IQ samples from the ADC, of shape 
+            `(n_frames, nTaps*nChannels)`.
+        win_coeffs (array_like):
+            Window coeffcients generated using `create_window()`. Can be 
+            either flat or already reshaped to `(nTaps, nChannels)`.
+        nTaps (int):
+            Number of PFB taps to use.
+        nChannels (int):
+            Number of PFB frequency channels to compute.
+    
+    Returns:
+        x_fir (array_like):
+            Weighted sum over the taps for each frame, of shape 
+            `(n_frames, nChannels)`.
+    """
+    # Views only; no copy of the frames or coefficients is made here
+    x_p = frame_set.reshape((frame_set.shape[0], nTaps, nChannels))
+    h_p = np.reshape(win_coeffs, (nTaps, nChannels))
+    
+    # Accumulate tap-by-tap so that only one (n_frames, nChannels) 
+    # intermediate array is allocated, rather than the full weighted block
+    x_fir = x_p[:,0,:] * h_p[0]
+    for k in range(1, nTaps):
+        x_fir += x_p[:,k,:] * h_p[k]
+    return x_fir
+
+
+def pfb_psd(frame_set, win_coeffs, nChannels, nTaps, fft=None):
+    """
+    Channelise a set of frames with a polyphase filter bank (PFB), giving 
+    the PSD of each frame. The FIR frontend and FFT are applied to all 
+    frames in one go, rather than frame-by-frame.
+    
+    Parameters:
+        frame_set (array_like):
+            Complex array of IQ samples from the ADC, of shape 
+            `(time_samples, nTaps*nChannels)`.
+        win_coeffs (array_like):
+            Window coeffcients generated using `create_window()`.
+        nChannels (int):
+            Number of frequency channels to produce.
+        nTaps (int):
+            Number of taps.
+        fft (callable):
+            FFT function, from `fft_backend.get_fft_backend()` (default: 
+            set by `set_fft_backend()`).
+    
+    Returns:
+        psd (array_like):
+            PSD of each frame, of shape `(time_samples, nChannels)`, in FFT 
+            (unshifted) channel ordering.
+    """
+    x_fir = pfb_fir_frontend_batch(frame_set, win_coeffs, nTaps, nChannels)
+    
+    # One FFT call over the whole block of frames
+    x_pfb = (fft or _fft)(x_fir, axis=1)
+    
+    # Accumulate |X|^2 in place
+    psd = np.square(x_pfb.real)
+    psd += np.square(x_pfb.imag)
+    return psd
+
+
+def pfb_power_sum(frame_set, win_coeffs, nChannels, nTaps, fft=None,
+                  accumulatorPrecision=None):
+    """
+    Channelise a set of frames with a polyphase filter bank (PFB) and sum 
+    their PSDs (see `pfb_psd()`).
+    
+    Parameters:
+        frame_set (array_like):
+            Complex array of IQ samples from the ADC, of shape 
+            `(time_samples, nTaps*nChannels)`.
+        win_coeffs (array_like):
+            Window coeffcients generated using `create_window()`.
+        nChannels (int):
+            Number of frequency channels to produce.
+        nTaps (int):
+            Number of taps.
+        fft (callable):
+            FFT function, see `pfb_psd()`.
+        accumulatorPrecision (str):
+            Precision of the sum, see `accumulator_dtype()`.
+    
+    Returns:
+        psd_sum (array_like):
+            Sum of the PSDs of all frames, in the accumulator precision, in 
+            FFT (unshifted) channel ordering.
+        n_spectra (int):
+            Number of spectra summed.
+    """
+    psd = pfb_psd(frame_set, win_coeffs, nChannels, nTaps, fft=fft)
+    return psd.sum(axis=0, dtype=accumulator_dtype(accumulatorPrecision)), \
+           psd.shape[0]
+
+
+def buffer_to_psd_pfb(frame_set, win_coeffs, nChannels, nTaps, fft=None,
+                      accumulatorPrecision=None):
     """
     Channelise and accumulate IQ samples into a single PSD (spectrum) time 
     sample, using a polyphase filter bank (PFB) for channelisation.
@@ -104,8 +464,287 @@ def buffer_to_psd_pfb(frame_set, win_coeffs, nChannels, nTaps):
             Number of frequency channels to produce.
         nTaps (int):
             Number of taps.
+        fft, accumulatorPrecision:
+            See `pfb_power_sum()`.
     """
-    spectra = np.array([pfb_filterbank(b, win_coeffs, nTaps, nChannels) 
-                        for b in frame_set])
-    return np.fft.fftshift( np.mean(spectra, axis=0) )
+    psd_sum, n_spectra = pfb_power_sum(frame_set, win_coeffs, nChannels, nTaps,
+                                       fft=fft, 
+                                       accumulatorPrecision=accumulatorPrecision)
+    return np.fft.fftshift( psd_sum / n_spectra )
+
 
+class StreamingPFB:
+    """
+    Overlapping (true polyphase) PFB, which carries the tap history across 
+    successive calls so that one spectrum is produced for every 
+    `nChannels` new samples.
+    
+    The last `(nTaps-1)*nChannels` samples of each call are kept and used 
+    as the start of the FIR input for the next call, so every ADC sample is 
+    weighted by every tap of the window exactly once. Call `reset()` after 
+    any discontinuity in the sample stream (e.g. when the stream is 
+    restarted).
+    
+    Instances can be used in place of `buffer_to_psd_pfb()` as the 
+    spectrometer function.
+    
+    Parameters:
+        win_coeffs (array_like):
+            Window coeffcients generated using `create_window()`.
+        nTaps (int):
+            Number of taps.
+        nChannels (int):
+            Number of frequency channels to produce.
+        fft (callable):
+            FFT function, from `fft_backend.get_fft_backend()` (default: 
+            set by `set_fft_backend()` when the object is created).
+        accumulatorPrecision (str):
+            Precision of the sums from `process()`, see 
+            `accumulator_dtype()`.
+    """
+    def __init__(self, win_coeffs, nTaps, nChannels, fft=None, 
+                 accumulatorPrecision=None):
+        self.nTaps = nTaps
+        self.nChannels = nChannels
+        self.h_p = np.reshape(win_coeffs, (nTaps, nChannels))
+        self.fft = fft or _fft
+        self.accumulator_dtype = accumulator_dtype(accumulatorPrecision)
+        self.reset()
+    
+    def reset(self):
+        """
+        Discard the stored tap history.
+        """
+        self.history = np.zeros((0, self.nChannels), dtype=np.complex64)
+    
+    def process(self, samples):
+        """
+        Channelise a contiguous block of new samples.
+        
+        Parameters:
+            samples (array_like):
+                Complex IQ samples, contiguous in time with those passed to 
+                the previous call. Any shape is accepted as long as the total 
+                number of samples is a multiple of `nChannels`, e.g. a 
+                `(n_frames, nTaps*nChannels)` frame set.
+        
+        Returns:
+            psd_sum (array_like):
+                Sum of the PSDs of all spectra produced, of length 
+                `nChannels`, in FFT (unshifted) channel ordering.
+            n_spectra (int):
+                Number of spectra summed in `psd_sum`.
+        """
+        psd = self.psd(samples)
+        return psd.sum(axis=0, dtype=self.accumulator_dtype), psd.shape[0]
+    
+    def psd(self, samples):
+        """
+        Channelise a contiguous block of new samples, as `process()`, but 
+        return the PSD of each spectrum produced, of shape 
+        `(n_spectra, nChannels)`, rather than their sum.
+        """
+        nTaps, nChannels = self.nTaps, self.nChannels
+        new_blocks = np.reshape(samples, (-1, nChannels))
+        hist = self.history
+        n_hist = hist.shape[0]
+        n_out = n_hist + new_blocks.shape[0] - (nTaps - 1)
+        
+        if n_out > 0:
+            # Output j is the weighted sum of blocks j..j+nTaps-1 of the 
+            # concatenated (history, new) block sequence. Avoid building the 
+            # concatenated array by splitting each tap into a history part 
+            # and a new-sample part.
+            x_fir = np.zeros((n_out, nChannels), 
+                             dtype=np.result_type(new_blocks, self.h_p))
+            for k in range(nTaps):
+                n_from_hist = min(max(n_hist - k, 0), n_out)
+                if n_from_hist > 0:
+                    x_fir[:n_from_hist] += hist[k:k + n_from_hist] \
+                                           * self.h_p[k]
+                start = max(k - n_hist, 0)
+                x_fir[n_from_hist:] += new_blocks[start:start + n_out 
+                                                  - n_from_hist] \
+                                       * self.h_p[k]
+            
+            x_pfb = self.fft(x_fir, axis=1)
+            psd = np.square(x_pfb.real)
+            psd += np.square(x_pfb.imag)
+        else:
+            psd = np.zeros((0, nChannels), dtype=self.h_p.dtype)
+        
+        # Keep the last nTaps-1 blocks as history for the next call
+        n_keep = nTaps - 1
+        if n_keep == 0:
+            self.history = hist[:0]
+        elif new_blocks.shape[0] >= n_keep:
+            self.history = new_blocks[-n_keep:].copy()
+        else:
+            self.history = np.concatenate((hist, new_blocks))[-n_keep:]
+        
+        return psd
+    
+    def __call__(self, frame_set, win_coeffs, nChannels, nTaps):
+        """
+        Channelise a frame set and return its time-averaged PSD, with the 
+        same call signature as `buffer_to_psd_pfb()`. The `win_coeffs`, 
+        `nChannels` and `nTaps` arguments are ignored in favour of the 
+        values given when the object was created.
+        """
+        psd_sum, n_spectra = self.process(frame_set)
+        return np.fft.fftshift( psd_sum / max(n_spectra, 1) )
+
+
+class PSDAccumulator:
+    """
+    Incremental accumulator that folds chunks of frames into a running PSD 
+    sum (float64 unless set otherwise by `accumulatorPrecision` or 
+    `set_precision()`), so that a full integration never has to be held in 
+    memory at once.
+    
+    Usage is `init(nChannels)`, then `add_chunk(samples)` for each chunk 
+    of frames in the integration, then `finalize()` to get the time-averaged 
+    PSD. `add_chunk()` may be called from several threads at once; the 
+    channelisation runs outside the lock and only the fold is serialised.
+    
+    With `spectralKurtosis`, the sum of the squared PSDs is kept as well, 
+    and `spectral_kurtosis()` gives the spectral kurtosis (SK) estimate of 
+    each channel over the integration and a mask of the channels flagged as 
+    RFI.
+    
+    Parameters:
+        spectrometerMode (str):
+            Whether to use `fft` or `pfb` channelisation.
+        win_coeffs (array_like):
+            Window coeffcients for the channeliser.
+        nTaps (int):
+            Number of PFB taps, or `None` for FFT channelisation.
+        pfbOverlap (bool):
+            Use the overlapping `StreamingPFB`. In this mode chunks must be 
+            added in time order, from a single thread.
+        nChannels (int):
+            Number of frequency channels. If given, `init()` is called.
+        streaming_pfb (StreamingPFB):
+            Existing overlapping PFB to use, so that the tap history can 
+            be carried from one accumulator to the next.
+        spectralKurtosis (bool):
+            Also accumulate the squared PSDs, for `spectral_kurtosis()`.
+        skThreshold (float):
+            Channels whose SK differs from 1 by more than `skThreshold` 
+            standard deviations (of SK for Gaussian noise) are flagged.
+        fft (callable):
+            FFT function, from `fft_backend.get_fft_backend()` (default: 
+            set by `set_fft_backend()` when the accumulator is created).
+        accumulatorPrecision (str):
+            `single` or `double` precision of the PSD sums (default: set by 
+            `set_precision()` when the accumulator is created).
+    """
+    def __init__(self, spectrometerMode, win_coeffs, nTaps=None, 
+                 pfbOverlap=False, nChannels=None, streaming_pfb=None,
+                 spectralKurtosis=False, skThreshold=3., fft=None,
+                 accumulatorPrecision=None):
+        self.spectrometerMode = spectrometerMode
+        self.win_coeffs = win_coeffs
+        self.nTaps = nTaps
+        self.streaming_pfb = streaming_pfb
+        self.fft = fft or _fft
+        self.accumulatorPrecision = accumulatorPrecision
+        self.accumulator_dtype = accumulator_dtype(accumulatorPrecision)
+        if spectrometerMode == 'fft':
+            self.psd_func = fft_psd
+        elif pfbOverlap:
+            self.psd_func = None
+        else:
+            self.psd_func = pfb_psd
+        self.pfbOverlap = pfbOverlap and spectrometerMode != 'fft'
+        self.spectralKurtosis = spectralKurtosis
+        self.skThreshold = skThreshold
+        self._lock = threading.Lock()
+        self.nChannels = None
+        if nChannels is not None:
+            self.init(nChannels)
+    
+    def init(self, nChannels):
+        """
+        Start a new integration, zeroing the running sum. The tap history of 
+        the overlapping PFB is kept, as the stream is assumed continuous.
+        """
+        if self.pfbOverlap and (self.streaming_pfb is None 
+                                or self.streaming_pfb.nChannels != nChannels):
+            self.streaming_pfb = StreamingPFB(self.win_coeffs, self.nTaps, 
+                                              nChannels, self.fft,
+                                              self.accumulatorPrecision)
+        self.nChannels = nChannels
+        self.psd_sum = np.zeros(nChannels, dtype=self.accumulator_dtype)
+        self.psd2_sum = np.zeros(nChannels, dtype=self.accumulator_dtype) \
+                        if self.spectralKurtosis else None
+        self.n_spectra = 0
+    
+    def add_chunk(self, samples):
+        """
+        Channelise a chunk of frames and fold it into the running sum.
+        
+        Parameters:
+            samples (array_like):
+                Complex array of IQ samples, of shape 
+                `(n_frames, n_spec_points)`.
+        
+        Returns:
+            n_spectra (int):
+                Number of spectra added from this chunk.
+        """
+        if self.pfbOverlap:
+            psd = self.streaming_pfb.psd(samples)
+        else:
+            psd = self.psd_func(samples, self.win_coeffs, self.nChannels, 
+                                self.nTaps, fft=self.fft)
+        n_spectra = psd.shape[0]
+        psd_sum = psd.sum(axis=0, dtype=self.accumulator_dtype)
+        if self.spectralKurtosis:
+            # S2, while the chunk's PSDs are still in cache
+            psd2_sum = np.einsum('ij,ij->j', psd, psd, 
+                                 dtype=self.accumulator_dtype)
+        with self._lock:
+            self.psd_sum += psd_sum
+            if self.spectralKurtosis:
+                self.psd2_sum += psd2_sum
+            self.n_spectra += n_spectra
+        return n_spectra
+    
+    def finalize(self):
+        """
+        Return the time-averaged PSD of the integration, shifted into 
+        frequency channel ordering.
+        """
+        with self._lock:
+            return np.fft.fftshift( self.psd_sum / max(self.n_spectra, 1) )
+    
+    def spectral_kurtosis(self):
+        """
+        Spectral kurtosis estimate of each channel over the integration, 
+        `SK = (M+1)/(M-1) * (M*S2/S1**2 - 1)` for `M` spectra with power 
+        sums `S1` and `S2` (Nita & Gary 2010). SK is 1 for Gaussian noise; 
+        intermittent RFI raises it and steady tones lower it. Requires 
+        `spectralKurtosis`.
+        
+        Returns:
+            sk (array_like):
+                SK of each channel, NaN if fewer than two spectra were 
+                accumulated, in frequency channel ordering.
+            sk_flags (array_like):
+                Boolean mask of the channels with `|SK - 1|` above 
+                `skThreshold` standard deviations.
+        """
+        with self._lock:
+            M = self.n_spectra
+            s1, s2 = self.psd_sum, self.psd2_sum
+            if M < 2:
+                sk = np.full(self.nChannels, np.nan)
+            else:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    sk = (M + 1) / (M - 1) * (M * s2 / np.square(s1) - 1)
+        # Standard deviation of SK for Gaussian noise
+        sigma = np.sqrt(4. * M**2 / ((M - 1) * (M + 2) * (M + 3))) \
+                if M >= 2 else np.inf
+        sk_flags = np.abs(sk - 1) > self.skThreshold * sigma
+        return np.fft.fftshift(sk), np.fft.fftshift(sk_flags)
@@ -0,0 +1,136 @@
+"""
+Merging of overlapping sub-band spectra, e.g. from `sdr_scan.py`, into
+wideband spectra and waterfalls.
+
+The output frequency grid and the map from every sub-band channel to a grid
+channel are built once, as a sparse matrix, so merging a waterfall of any
+length is a sparse matrix product.
+"""
+import numpy as np
+from scipy import sparse
+
+
+# Spectra merged per sparse product in `Stitcher.__call__`
+BLOCK_SPECTRA = 16
+
+
+def estimate_passband(spectra, keep=None):
+    """
+    Estimate the relative passband response of the sub-bands from the data,
+    as the median over sub-bands (and time) of each spectrum normalised by
+    its own median. Assumes the sky varies slowly compared with the
+    sub-band width, so the channel-to-channel shape is the edge roll-off.
+
+    Parameters:
+        spectra (array_like):
+            Sub-band spectra, of shape `(..., n_steps, nChannels)`.
+        keep (array_like):
+            Boolean mask of channels to include in the normalisation
+            (default all).
+
+    Returns:
+        passband (array_like):
+            Response of each channel, with a maximum of 1.
+    """
+    spectra = np.asarray(spectra, dtype=np.float64)
+    nChannels = spectra.shape[-1]
+    spectra = spectra.reshape(-1, nChannels)
+    if keep is None:
+        keep = np.ones(nChannels, dtype=bool)
+    norm = np.nanmedian(spectra[:, keep], axis=1, keepdims=True)
+    passband = np.nanmedian(spectra / norm, axis=0)
+    return passband / np.nanmax(passband)
+
+
+class Stitcher:
+    """
+    Precomputed merge of sub-band spectra onto one frequency grid.
+
+    Each output channel is the passband-weighted mean of the sub-band
+    channels that fall in it, `sum(P) / sum(g)` for measured powers `P` and
+    passband responses `g`, which corrects the edge roll-off and gives
+    overlapping channels weight in proportion to their response. Channels
+    with a response below `min_response` are left out, and output channels
+    with no data are NaN.
+
+    Parameters:
+        subband_freqs (array_like):
+            Channel frequencies of each sub-band, of shape
+            `(n_steps, nChannels)`.
+        passband (array_like):
+            Relative response of each sub-band channel, of shape
+            `(nChannels,)` or `(n_steps, nChannels)` (default flat). A
+            boolean mask crops each sub-band to the channels it selects.
+        grid (array_like):
+            Output channel frequencies, evenly spaced (default: spanning
+            all the sub-bands with the sub-band channel width). Each
+            sub-band channel goes to the nearest grid channel, so a grid of
+            the sub-band channel width should be aligned with the sub-band
+            channels: channels halfway between two grid channels are
+            rounded to the even one, doubling up some grid channels and
+            leaving others empty.
+        min_response (float):
+            Smallest passband response to include.
+    """
+    def __init__(self, subband_freqs, passband=None, grid=None,
+                 min_response=0.):
+        subband_freqs = np.asarray(subband_freqs, dtype=np.float64)
+        self.n_steps, self.nChannels = subband_freqs.shape
+        if passband is None:
+            passband = np.ones(self.nChannels)
+        passband = np.broadcast_to(np.asarray(passband, dtype=np.float64),
+                                   subband_freqs.shape)
+
+        if grid is None:
+            channel_width = np.median(np.diff(subband_freqs, axis=1))
+            n_grid = int(round((subband_freqs.max() - subband_freqs.min())
+                               / channel_width)) + 1
+            grid = subband_freqs.min() + channel_width * np.arange(n_grid)
+        self.grid = np.asarray(grid, dtype=np.float64)
+        channel_width = self.grid[1] - self.grid[0]
+
+        # Nearest grid channel of every sub-band channel
+        index = np.rint((subband_freqs - self.grid[0])
+                        / channel_width).astype(np.int64).ravel()
+        weight = passband.ravel()
+        use = (index >= 0) & (index < self.grid.size) \
+              & (weight > min_response) & (weight > 0)
+        rows = np.flatnonzero(use)
+        index = index[use]
+        self.response = np.bincount(index, weights=weight[use],
+                                    minlength=self.grid.size)
+        self.coverage = np.bincount(index, minlength=self.grid.size)
+
+        # sum(P) over the channels in each grid channel, / sum(g)
+        covered = self.response > 0
+        scale = np.zeros(self.grid.size)
+        scale[covered] = 1. / self.response[covered]
+        self.matrix = sparse.csr_matrix(
+                            (scale[index], (index, rows)),
+                            shape=(self.grid.size,
+                                   self.n_steps * self.nChannels))
+        self.empty = ~covered
+
+    def __call__(self, spectra):
+        """
+        Merge sub-band spectra onto the grid.
+
+        Parameters:
+            spectra (array_like):
+                Sub-band spectra, of shape `(..., n_steps, nChannels)`,
+                e.g. a waterfall of scans `(n_times, n_steps, nChannels)`.
+
+        Returns:
+            merged (array_like):
+                Merged spectra, of shape `(..., n_grid)`.
+        """
+        spectra = np.asarray(spectra)
+        lead = spectra.shape[:-2]
+        flat = spectra.reshape(-1, self.n_steps * self.nChannels)
+        merged = np.empty((flat.shape[0], self.grid.size))
+        # A few spectra at a time, so each block stays in cache
+        for i in range(0, flat.shape[0], BLOCK_SPECTRA):
+            block = flat[i:i + BLOCK_SPECTRA]
+            merged[i:i + BLOCK_SPECTRA] = (self.matrix @ block.T).T
+        merged[:, self.empty] = np.nan
+        return merged.reshape(*lead, self.grid.size)
@@ -0,0 +1,137 @@
+"""
+HDF5 storage profiles (chunking, compression and shuffle) for the
+observation data files.
+
+Profiles are selected by name with `observationParams.storageProfile` in
+`obs_config.yaml`:
+
+    none            contiguous, uncompressed
+    lzf             LZF with byte shuffle (fast, built into h5py)
+    gzip[-N]        DEFLATE level N (default 4) with byte shuffle
+    blosc-zstd[-N]  Blosc/Zstandard level N (default 5) with byte shuffle,
+                    also blosc-lz4[-N]; needs the `hdf5plugin` package
+"""
+import numpy as np
+
+# Target uncompressed chunk size, in bytes
+CHUNK_BYTES = 256 * 1024
+
+
+def chunk_shape(shape, dtype, chunk_bytes=CHUNK_BYTES):
+    """
+    Chunk shape compromising between time-slice and channel-slice reads.
+
+    For a 2-D `(time, channel)` waterfall, chunks span a block of time
+    samples and channels of roughly equal byte length in each direction, so
+    neither reading a single spectrum nor a single channel's time series
+    has to decompress the whole file. Other shapes are chunked along the
+    first axis only.
+
+    Parameters:
+        shape (tuple):
+            Shape of the dataset.
+        dtype (dtype):
+            Data type of the dataset.
+        chunk_bytes (int):
+            Target size of each chunk, in bytes.
+
+    Returns:
+        chunks (tuple):
+            Chunk shape, or `None` for empty or scalar datasets.
+    """
+    if len(shape) == 0 or 0 in shape:
+        return None
+    itemsize = np.dtype(dtype).itemsize
+    n_elements = max(chunk_bytes // itemsize, 1)
+    if len(shape) == 2:
+        side = int(np.sqrt(n_elements))
+        n_time = min(shape[0], side)
+        n_chan = min(shape[1], max(n_elements // n_time, 1))
+        return (n_time, n_chan)
+    row_elements = int(np.prod(shape[1:]))
+    n_rows = min(shape[0], max(n_elements // row_elements, 1))
+    return (n_rows,) + tuple(shape[1:])
+
+
+def storage_kwargs(storageProfile, shape, dtype):
+    """
+    Keyword arguments for `h5py.Group.create_dataset` for a storage profile.
+
+    Parameters:
+        storageProfile (str):
+            Name of the profile, e.g. `lzf`, `gzip-4` or `blosc-zstd-5`.
+        shape (tuple):
+            Shape of the dataset.
+        dtype (dtype):
+            Data type of the dataset.
+
+    Returns:
+        kwargs (dict):
+            `chunks`, `compression`, `compression_opts` and `shuffle`
+            arguments as required.
+    """
+    if storageProfile is None or storageProfile == 'none':
+        return {}
+    chunks = chunk_shape(shape, dtype)
+    if chunks is None:
+        return {} # HDF5 filters need chunked storage
+
+    name, _, level = storageProfile.partition('-')
+    if name == 'lzf':
+        return {'chunks': chunks, 'compression': 'lzf', 'shuffle': True}
+    if name == 'gzip':
+        return {'chunks': chunks, 'compression': 'gzip',
+                'compression_opts': int(level) if level else 4,
+                'shuffle': True}
+    if name == 'blosc':
+        import hdf5plugin
+        cname, _, level = level.partition('-')
+        return {'chunks': chunks,
+                **hdf5plugin.Blosc(cname=cname or 'zstd',
+                                   clevel=int(level) if level else 5,
+                                   shuffle=hdf5plugin.Blosc.SHUFFLE)}
+    raise ValueError(f'Unknown storage profile: {storageProfile}')
+
+
+def create_dataset(group, name, data, storageProfile=None):
+    """
+    Create a dataset from an array using a storage profile.
+    """
+    data = np.asarray(data)
+    return group.create_dataset(name, data=data, dtype=data.dtype,
+                                **storage_kwargs(storageProfile, data.shape,
+                                                 data.dtype))
+
+
+def copy_dataset(source, group, name, storageProfile=None,
+                 chunk_bytes=16 * 1024 * 1024):
+    """
+    Copy an HDF5 dataset into a group, re-chunking and compressing it with
+    a storage profile. The copy is done in slabs along the first axis, so
+    the whole dataset is never held in memory.
+
+    Parameters:
+        source (h5py.Dataset):
+            Dataset to copy.
+        group (h5py.Group):
+            Destination group.
+        name (str):
+            Name of the new dataset.
+        storageProfile (str):
+            Name of the storage profile.
+        chunk_bytes (int):
+            Approximate size of each slab read from `source`, in bytes.
+    """
+    dest = group.create_dataset(name, shape=source.shape, dtype=source.dtype,
+                                **storage_kwargs(storageProfile, source.shape,
+                                                 source.dtype))
+    if source.shape == ():
+        dest[()] = source[()]
+        return dest
+    row_bytes = source.dtype.itemsize * int(np.prod(source.shape[1:]))
+    n_rows = max(chunk_bytes // max(row_bytes, 1), 1)
+    if dest.chunks is not None: # write whole chunks where possible
+        n_rows = max(n_rows // dest.chunks[0], 1) * dest.chunks[0]
+    for start in range(0, source.shape[0], n_rows):
+        dest[start:start + n_rows] = source[start:start + n_rows]
+    return dest
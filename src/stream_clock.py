@@ -0,0 +1,68 @@
+"""
+Timestamps for SDR samples, taken from the SoapySDR stream rather than the
+host clock after channelisation.
+"""
+import time
+from sim_sdr import SOAPY_SDR_HAS_TIME # same as SoapySDR
+
+
+class StreamClock:
+    """
+    Convert `readStream` results into UTC timestamps for the samples they
+    returned.
+
+    The clock is anchored to UTC once, on the first successful read: the end
+    of that buffer is taken to be `time.time()` when `readStream` returned.
+    After that, reads carrying a hardware time (`SOAPY_SDR_HAS_TIME` in
+    `sr.flags`) are timed from `sr.timeNs`, i.e. by the SDR sample clock, and
+    any others from `time.monotonic()`, so the timestamps are unaffected by
+    channelisation latency or host clock adjustments during the run.
+
+    Parameters:
+        sampleRate (float):
+            Complex sample rate of the stream, in Hz.
+    """
+    def __init__(self, sampleRate):
+        self.sampleRate = sampleRate
+        self.reset()
+
+    def reset(self):
+        """
+        Drop the anchor, e.g. after the stream has been restarted.
+        """
+        self.anchor_utc = None
+        self.anchor_mono = None
+        self.anchor_ns = None
+
+    def stamp(self, sr):
+        """
+        Time span of the samples returned by a `readStream` call. Must be
+        called straight after `readStream` returns.
+
+        Parameters:
+            sr (StreamResult):
+                Result returned by `readStream`.
+
+        Returns:
+            span (tuple):
+                `(t_start, t_stop)` of the samples, in seconds since the
+                UNIX epoch, or `None` if no samples were returned.
+        """
+        t_mono = time.monotonic()
+        ret = int(sr.ret)
+        if ret <= 0:
+            return None
+        duration = ret / self.sampleRate
+        has_time = bool(sr.flags & SOAPY_SDR_HAS_TIME)
+
+        if self.anchor_utc is None:
+            self.anchor_utc = time.time()
+            self.anchor_mono = t_mono
+            if has_time:
+                self.anchor_ns = sr.timeNs + duration * 1e9
+
+        if has_time and self.anchor_ns is not None:
+            t_start = self.anchor_utc + (sr.timeNs - self.anchor_ns) / 1e9
+        else:
+            t_start = self.anchor_utc + (t_mono - self.anchor_mono) - duration
+        return t_start, t_start + duration
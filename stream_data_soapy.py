@@ -8,6 +8,7 @@ import argparse
 import h5py
 import matplotlib.pyplot as plt
 import sys, time
+from src.fft_backend import get_fft_backend
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -18,7 +19,10 @@ if __name__ == "__main__":
     parser.add_argument("-fw", "--fft_window", help="FFT window (Rectangular, Blackman, )", type=str, choices=['Rectangular, Blackman'])
     parser.add_argument("-g", "--sdr_gain", help='Gain of SDR [dB]', type=int)
     parser.add_argument("-sr", "--sample_rate", help="Set samplerate/bandwidth of SDR [Hz]", type=float, choices=[10e6, 8e6, 6e6, 4e6,2e6])
+    parser.add_argument("-fb", "--fft_backend", help="FFT backend (numpy, scipy, pyfftw)", type=str, default='numpy')
+    parser.add_argument("-fwk", "--fft_workers", help="Number of FFT threads (-1 for all cores)", type=int, default=None)
     args = parser.parse_args()
+    fft = get_fft_backend(args.fft_backend, args.fft_workers)
 
     if args.centre_freq == None:
         centre_freq = 70e6
@@ -131,12 +135,7 @@ if __name__ == "__main__":
         # Save output
         tt0 = time.time()
         print("    Saving PSD")
-        spectra = []
-        for i in range(len(buffs)):
-            d = buffs[i]
-            PSD = np.abs(np.fft.fftshift(np.fft.fft(d)))**2
-            spectra.append(PSD)
-        spectra = np.array(spectra)
+        spectra = np.abs(np.fft.fftshift(fft(np.array(buffs), axis=1), axes=1))**2
         spectra = np.mean(spectra, axis=0)
         spectras.append(spectra)
         times.append(time.time())